@@ -0,0 +1,156 @@
+import os
+import gzip
+import time
+import errno
+import logging
+
+from hypernode import inotify
+
+logger = logging.getLogger(__name__)
+
+MAILLOG = "/var/log/mail.log"
+
+# Seconds between checks for new lines when inotify is not available
+POLL_INTERVAL = 0.2
+
+# Upper bound for a single wait, so we periodically look at the file even if
+# we miss an event
+MAX_WAIT = 1.0
+
+_READSIZE = 65536
+
+
+def open_log(path):
+    # Rotated logs may be compressed, those are decompressed while reading
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_lines(path):
+    # Stream the lines of a (possibly compressed) log file
+    with open_log(path) as fd:
+        for line in fd:
+            yield line
+
+
+class LogReader(object):
+    """
+    Reads the lines appended to a log file, also when it gets rotated while
+    we read. After a rotation we first read the old file up to its end, and
+    then continue at the start of the new file at the same path.
+    """
+    def __init__(self, path=MAILLOG, fromend=True):
+        if fromend and path.endswith(".gz"):
+            # Compressed logs are rotated ones, they do not grow and can
+            # not be seeked from the end
+            raise ValueError("Compressed log %s can only be read from the start" % path)
+        self.path = path
+        self.partial = ""
+        self.rotations = 0
+        self._open()
+        if fromend:
+            self.fd.seek(0, 2)
+
+    def _open(self):
+        self.fd = open_log(self.path)
+        self.inode = os.fstat(self.fd.fileno()).st_ino
+
+    def _read(self):
+        if isinstance(self.fd, gzip.GzipFile):
+            return self.fd.read(_READSIZE)
+
+        # Read from the descriptor ourselves: a file object that has seen EOF
+        # does not reliably return data appended later
+        data = os.read(self.fd.fileno(), _READSIZE)
+        if not data and os.fstat(self.fd.fileno()).st_size < os.lseek(self.fd.fileno(), 0, os.SEEK_CUR):
+            # Truncated in place (copytruncate), so start over
+            logger.debug("%s was truncated", self.path)
+            os.lseek(self.fd.fileno(), 0, os.SEEK_SET)
+            data = os.read(self.fd.fileno(), _READSIZE)
+        return data
+
+    def rotated(self):
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError as e:
+            # Moved away, but not yet replaced by a new file
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+
+    def read_lines(self):
+        """
+        Return the complete lines that are available right now, which may
+        be none.
+        """
+        lines = []
+        while True:
+            data = self._read()
+            if data:
+                lines.extend((self.partial + data).split("\n"))
+                self.partial = lines.pop()
+                continue
+
+            if not self.rotated():
+                break
+
+            # The old file has been read to its end, continue in the new one
+            logger.debug("%s has been rotated, continuing in new file", self.path)
+            self.fd.close()
+            self._open()
+            self.rotations += 1
+
+        return [line + "\n" for line in lines]
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def follow(reader, timeout, poll_interval=POLL_INTERVAL):
+    """
+    Yield complete lines appended to the log of reader as soon as they are
+    written. Stops after timeout seconds, or when the caller stops
+    iterating.
+    """
+    end = time.time() + timeout
+
+    try:
+        notifier = inotify.Inotify()
+        # Watching the directory wakes us up when the log is rotated
+        notifier.add_watch(os.path.dirname(os.path.abspath(reader.path)),
+                           inotify.IN_CREATE | inotify.IN_MOVED_TO)
+        notifier.add_watch(reader.path, inotify.IN_MODIFY)
+    except OSError as e:
+        logger.debug("Not using inotify to follow %s: %s", reader.path, e)
+        notifier = None
+
+    try:
+        while True:
+            rotations = reader.rotations
+            lines = reader.read_lines()
+            if notifier is not None and reader.rotations != rotations:
+                notifier.add_watch(reader.path, inotify.IN_MODIFY)
+
+            for line in lines:
+                yield line
+            if lines:
+                continue
+
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+
+            if notifier is not None:
+                notifier.read(timeout=min(remaining, MAX_WAIT))
+            else:
+                time.sleep(min(remaining, poll_interval))
+    finally:
+        if notifier is not None:
+            notifier.close()
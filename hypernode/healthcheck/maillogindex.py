@@ -0,0 +1,311 @@
+import os
+import re
+import gzip
+import time
+import errno
+import hashlib
+import logging
+import sqlite3
+import collections
+
+from hypernode.healthcheck import maillog
+
+logger = logging.getLogger(__name__)
+
+INDEXDB = "/var/cache/hypernode/maillog.sqlite"
+
+# Lines are committed in batches, so indexing a large log for the first time
+# does not keep everything in a single transaction
+BATCHSIZE = 10000
+
+# The last line of the checkpoint is searched for within this many bytes
+# before the checkpoint offset
+_READSIZE = 65536
+
+LINE_RE = re.compile(r"^(?P<timestamp>\w{3} [ \d]\d \d\d:\d\d:\d\d) \S+ "
+                     r"(?P<process>postfix/[\w/-]+)\[\d+\]: (?P<queueid>[0-9A-F]+): (?P<message>.*)$")
+# Postfix always logs the status last, its response may contain commas
+FIELD_RE = re.compile(r"(?:^|, )(?P<key>[\w-]+)=(?P<value>(?<=\bstatus=).*|<[^>]*>|[^,]*)")
+STATUS_RE = re.compile(r"^(?P<status>\w+)(?: \((?P<response>.*)\))?$")
+
+# Log fields we store, and the column they go into
+FIELDS = {
+    "from": "sender",
+    "to": "recipient",
+    "relay": "relay",
+    "delay": "delay",
+    "delays": "delays",
+    "dsn": "dsn",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    linehash TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    queueid TEXT PRIMARY KEY,
+    first_seen INTEGER,
+    last_seen INTEGER,
+    sender TEXT,
+    recipient TEXT,
+    relay TEXT,
+    delay REAL,
+    delays TEXT,
+    dsn TEXT,
+    status TEXT,
+    response TEXT
+);
+"""
+
+Checkpoint = collections.namedtuple("Checkpoint", "inode offset linehash")
+
+
+def hash_line(line):
+    return hashlib.sha1(line).hexdigest()
+
+
+def parse_timestamp(stamp, now=None):
+    # Syslog timestamps have no year. We assume the current one, unless that
+    # puts the line in the future, in which case it was logged last year.
+    if now is None:
+        now = time.time()
+    year = time.localtime(now).tm_year
+    parsed = time.mktime(time.strptime("%d %s" % (year, stamp), "%Y %b %d %H:%M:%S"))
+    if parsed > now + 86400:
+        parsed = time.mktime(time.strptime("%d %s" % (year - 1, stamp), "%Y %b %d %H:%M:%S"))
+    return int(parsed)
+
+
+def parse_line(line, now=None):
+    """
+    Parse a postfix log line into a dict with the queueid, the time it was
+    logged and the fields we index. Returns None for lines that are not
+    about a queued message.
+    """
+    match = LINE_RE.match(line.rstrip("\n"))
+    if not match:
+        return None
+
+    entry = {"queueid": match.group("queueid"),
+             "timestamp": parse_timestamp(match.group("timestamp"), now)}
+
+    message = match.group("message")
+    for field in FIELD_RE.finditer(message):
+        key, value = field.group("key"), field.group("value")
+        if key == "status":
+            status = STATUS_RE.match(value)
+            if status:
+                entry["status"] = status.group("status")
+                entry["response"] = status.group("response")
+        elif key in FIELDS:
+            entry[FIELDS[key]] = value.strip("<>") if value.startswith("<") else value
+
+    if "delay" in entry:
+        try:
+            entry["delay"] = float(entry["delay"])
+        except ValueError:
+            del entry["delay"]
+
+    return entry
+
+
+class MailLogIndex(object):
+    """
+    Incremental index of the postfix mail log, keyed on queue id. A
+    checkpoint with the inode, offset and hash of the last indexed line is
+    stored with the index, so an update only reads the lines that were
+    written since the previous one.
+    """
+    def __init__(self, path=INDEXDB):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname, 0700)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def get_checkpoint(self, logpath):
+        row = self.db.execute("SELECT inode, offset, linehash FROM checkpoint WHERE path = ?",
+                              (logpath,)).fetchone()
+        if row is None:
+            return None
+        return Checkpoint(row["inode"], row["offset"], row["linehash"])
+
+    def set_checkpoint(self, logpath, checkpoint):
+        self.db.execute("INSERT OR REPLACE INTO checkpoint (path, inode, offset, linehash) VALUES (?, ?, ?, ?)",
+                        (logpath, checkpoint.inode, checkpoint.offset, checkpoint.linehash))
+
+    def add(self, entry):
+        self.db.execute("INSERT OR IGNORE INTO messages (queueid, first_seen) VALUES (?, ?)",
+                        (entry["queueid"], entry["timestamp"]))
+
+        columns = sorted(key for key in entry if key not in ("queueid", "timestamp"))
+        assignments = ["last_seen = ?"] + ["%s = ?" % column for column in columns]
+        values = [entry["timestamp"]] + [entry[column] for column in columns] + [entry["queueid"]]
+        self.db.execute("UPDATE messages SET %s WHERE queueid = ?" % ", ".join(assignments), values)
+
+    def lookup(self, queueid):
+        row = self.db.execute("SELECT * FROM messages WHERE queueid = ?", (queueid,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(row.keys(), row))
+
+    def update(self, logpath=maillog.MAILLOG):
+        """
+        Index the lines added to logpath since the last update. If the log
+        was rotated in the meantime, the rest of the rotated file is indexed
+        first. Returns the number of lines read.
+        """
+        checkpoint = self.get_checkpoint(logpath)
+        inode = os.stat(logpath).st_ino
+        count = 0
+
+        # Compressing a rotated log frees its inode, the new log may get it
+        if checkpoint is not None and (checkpoint.inode != inode or not matches(logpath, checkpoint)):
+            rotated = find_rotated(logpath, checkpoint)
+            if rotated is not None:
+                logger.debug("%s has been rotated, indexing the rest of %s first", logpath, rotated)
+                count += self._index(logpath, rotated, checkpoint)
+                if rotated.endswith(".2.gz"):
+                    # Rotated twice, the file in between is read as a whole
+                    for middle in (logpath + ".1", logpath + ".1.gz"):
+                        if os.path.exists(middle):
+                            count += self._index(logpath, middle, None)
+                            break
+            checkpoint = None
+
+        count += self._index(logpath, logpath, checkpoint)
+        return count
+
+    def _index(self, logpath, path, checkpoint):
+        count = 0
+        with maillog.open_log(path) as fd:
+            inode = os.fstat(fd.fileno()).st_ino
+            compressed = isinstance(fd, gzip.GzipFile)
+            offset = 0
+            linehash = None
+
+            if checkpoint is not None and (compressed or checkpoint.inode == inode):
+                verify = verify_compressed_checkpoint if compressed else verify_checkpoint
+                if verify(fd, checkpoint):
+                    offset, linehash = checkpoint.offset, checkpoint.linehash
+                else:
+                    logger.info("Checkpoint does not match %s anymore, indexing it from the start", path)
+            if compressed:
+                # A verified checkpoint leaves us at its offset already
+                if offset == 0:
+                    fd.rewind()
+            else:
+                fd.seek(offset)
+
+            while True:
+                line = fd.readline()
+                # Incomplete lines are picked up by the next update
+                if not line.endswith("\n"):
+                    break
+
+                offset += len(line)
+                linehash = hash_line(line)
+                count += 1
+
+                entry = parse_line(line)
+                if entry is not None:
+                    self.add(entry)
+
+                if count % BATCHSIZE == 0:
+                    self._commit(logpath, Checkpoint(inode, offset, linehash))
+
+        self._commit(logpath, Checkpoint(inode, offset, linehash))
+        return count
+
+    def _commit(self, logpath, checkpoint):
+        self.set_checkpoint(logpath, checkpoint)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def find_rotated(logpath, checkpoint):
+    # logrotate moves the log to .1, which is compressed right away or, with
+    # delaycompress, on the next rotation to .2.gz. Compressing gives the
+    # file a new inode, so those are recognized by the checkpoint line.
+    candidate = logpath + ".1"
+    try:
+        if os.stat(candidate).st_ino == checkpoint.inode:
+            return candidate
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    for candidate in (logpath + ".1.gz", logpath + ".2.gz"):
+        try:
+            with maillog.open_log(candidate) as fd:
+                if verify_compressed_checkpoint(fd, checkpoint):
+                    return candidate
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    return None
+
+
+def matches(path, checkpoint):
+    with open(path, "rb") as fd:
+        return verify_checkpoint(fd, checkpoint)
+
+
+def verify_checkpoint(fd, checkpoint):
+    """
+    Check that the line before the checkpoint offset is the line we indexed
+    last, so we know the file was not truncated or rewritten since.
+    """
+    if checkpoint.offset == 0:
+        return True
+    if os.fstat(fd.fileno()).st_size < checkpoint.offset:
+        return False
+
+    start = max(checkpoint.offset - _READSIZE, 0)
+    fd.seek(start)
+    data = fd.read(checkpoint.offset - start)
+    if not data.endswith("\n"):
+        return False
+
+    newline = data.rfind("\n", 0, len(data) - 1)
+    if newline == -1 and start > 0:
+        # The line is longer than we are willing to look back
+        return False
+    return hash_line(data[newline + 1:]) == checkpoint.linehash
+
+
+def verify_compressed_checkpoint(fd, checkpoint):
+    """
+    Like verify_checkpoint, for compressed files that can only be read
+    forward. Leaves fd at the checkpoint offset.
+    """
+    data = ""
+    remaining = checkpoint.offset
+    while remaining:
+        chunk = fd.read(min(remaining, _READSIZE))
+        if not chunk:
+            return False
+        remaining -= len(chunk)
+        data = data[-_READSIZE:] + chunk
+
+    if checkpoint.offset == 0:
+        return True
+    if not data.endswith("\n"):
+        return False
+    newline = data.rfind("\n", 0, len(data) - 1)
+    if newline == -1 and checkpoint.offset > len(data):
+        return False
+    return hash_line(data[newline + 1:]) == checkpoint.linehash
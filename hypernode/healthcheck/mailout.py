@@ -1,19 +1,62 @@
 import smtplib
 from smtplib import SMTPSenderRefused, SMTPRecipientsRefused, SMTPDataError, SMTPConnectError, SMTPException
 import re
+import math
+import time
 import socket
-import requests
+import collections
+import hypernode.httpclient
+import hypernode.metrics
 import hypernode.nodeconfig.common
 import hypernode.log
+from hypernode.healthcheck import maillog
 
+# Seconds to wait for a delivery to show up in the mail log
+DELIVERY_DEADLINE = 30
 
-def send_mail(smtphost="localhost", smtpport="25", recipient="recipient@hypernode.com", sender="sender@hypernode.com", subject="testsubject", body="testbody"):
+# Postfix logs the total delay of a delivery, and in delays=a/b/c/d the time
+# spent before the queue manager, in the queue manager, setting up the
+# connection and transmitting the message
+DELAY_RE = re.compile(r"\bdelay=(?P<total>[\d.]+), delays=(?P<stages>[\d.]+/[\d.]+/[\d.]+/[\d.]+)")
+
+DeliveryResult = collections.namedtuple("DeliveryResult", "delivered latency delays")
+Delays = collections.namedtuple("Delays", "total before_qmgr in_qmgr connect transmit")
+LatencySummary = collections.namedtuple("LatencySummary", "p50 p95 max")
 
+
+def connect(smtphost="localhost", smtpport="25"):
     try:
-        smtp = smtplib.SMTP(smtphost, smtpport)
+        return smtplib.SMTP(smtphost, smtpport)
     except socket.error as e:
         raise SMTPConnectError(smtphost, smtpport)
 
+
+def send_mail(smtphost="localhost", smtpport="25", recipient="recipient@hypernode.com", sender="sender@hypernode.com", subject="testsubject", body="testbody"):
+    smtp = connect(smtphost, smtpport)
+    queueid = send_message(smtp, recipient, sender, body)
+    smtp.quit()
+
+    return queueid
+
+
+def send_mails(count, smtphost="localhost", smtpport="25", recipient="recipient@hypernode.com", sender="sender@hypernode.com", subject="testsubject", body="testbody"):
+    """
+    Send count probe messages over a single connection. Returns an ordered
+    dict of the queue ids and the time each message was queued.
+    """
+    smtp = connect(smtphost, smtpport)
+
+    queued = collections.OrderedDict()
+    for i in range(count):
+        queueid = send_message(smtp, recipient, sender, body)
+        queued[queueid] = time.time()
+
+    smtp.quit()
+
+    return queued
+
+
+def send_message(smtp, recipient, sender, body):
     """
     Take code from smtplib.sendmail. We need the send return code.
     """
@@ -43,16 +86,18 @@ def send_mail(smtphost="localhost", smtpport="25", recipient="recipient@hypernod
     if not match or not match.group('queueid'):
         raise ValueError("Could not find queue id in response: '%s'" % resp)
 
-    smtp.quit()
-
     return match.group('queueid')
 
 
-def check_delivery(messageid, loglines):
+def delivery_matcher(messageid):
     if messageid is None:
         raise ValueError("specify a message id")
 
-    matcher = re.compile("%s: .* queued as [0-9A-F]+\)$" % messageid)
+    return re.compile("%s: .* queued as [0-9A-F]+\)$" % messageid)
+
+
+def check_delivery(messageid, loglines):
+    matcher = delivery_matcher(messageid)
 
     for line in loglines:
         if matcher.search(line):
@@ -61,6 +106,90 @@ def check_delivery(messageid, loglines):
     return False
 
 
+def parse_delays(line):
+    """
+    Return the Delays postfix logged for a delivery, or None if the line
+    has no delays.
+    """
+    match = DELAY_RE.search(line)
+    if not match:
+        return None
+
+    stages = [float(stage) for stage in match.group("stages").split("/")]
+    return Delays(float(match.group("total")), *stages)
+
+
+def record_delays(delays):
+    for stage, value in zip(Delays._fields, delays):
+        hypernode.metrics.record("mailout.delay.seconds", value, stage=stage)
+
+
+def deliveries_matcher(messageids):
+    if not messageids or None in messageids:
+        raise ValueError("specify a message id")
+
+    return re.compile("(?P<queueid>%s): .* queued as [0-9A-F]+\)$" % "|".join(re.escape(m) for m in messageids))
+
+
+def wait_for_delivery(messageid, reader, deadline=DELIVERY_DEADLINE):
+    """
+    Follow the mail log through a maillog.LogReader until the delivery of
+    messageid shows up, or until deadline seconds have passed. Returns a
+    DeliveryResult with the seconds it took to show up and the delays
+    postfix logged.
+    """
+    if messageid is None:
+        raise ValueError("specify a message id")
+
+    results = wait_for_deliveries({messageid: time.time()}, reader, deadline)
+    return results.get(messageid, DeliveryResult(False, None, None))
+
+
+def wait_for_deliveries(queued, reader, deadline=DELIVERY_DEADLINE):
+    """
+    Follow the mail log until the deliveries of all messages in queued, a
+    dict of queue ids and the time they were queued, have shown up or until
+    deadline seconds have passed. Returns a dict with a DeliveryResult for
+    every message that was delivered.
+    """
+    matcher = deliveries_matcher(queued.keys())
+    results = {}
+
+    for line in maillog.follow(reader, deadline):
+        match = matcher.search(line)
+        if not match or match.group("queueid") in results:
+            continue
+
+        queueid = match.group("queueid")
+        latency = time.time() - queued[queueid]
+        hypernode.metrics.record("mailout.delivery.seconds", latency)
+
+        delays = parse_delays(line)
+        if delays is not None:
+            record_delays(delays)
+
+        results[queueid] = DeliveryResult(True, latency, delays)
+        if len(results) == len(queued):
+            break
+
+    return results
+
+
+def percentile(values, percent):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarize_latencies(latencies):
+    if not latencies:
+        return None
+
+    values = list(latencies)
+    return LatencySummary(percentile(values, 50), percentile(values, 95), max(values))
+
+
 def raise_sos(message=""):
     logger = hypernode.log.getLogger(__name__)
 
@@ -71,7 +200,8 @@ def raise_sos(message=""):
         return False
 
     data = {'message': message}
-    resp = requests.post(config["sos_url"], data=data)
+    # A repeated SOS pages the on-call again
+    resp = hypernode.httpclient.post(config["sos_url"], data=data, idempotent=False)
 
     if resp.status_code == 200:
         return True
@@ -0,0 +1,81 @@
+import time
+import random
+import threading
+import logging
+
+import requests
+
+from hypernode import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection, and for a response once connected
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Retries after the first attempt, with full-jitter exponential backoff
+RETRIES = 4
+BACKOFF = 0.5
+MAX_BACKOFF = 10
+
+# Responses that indicate a transient problem on the other end
+RETRY_STATUS = (502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    # One session per process, so connections to control are kept alive and
+    # reused between callbacks
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        return _session
+
+
+def post(url, data=None, headers=None, verify=True, timeout=None, retries=None, idempotent=True, **kwargs):
+    """
+    POST to url through the shared session. Connection errors, timeouts and
+    gateway errors are retried; the last error or response is returned to the
+    caller like requests.post would.
+
+    After a read timeout or a gateway timeout the server may have received
+    the request already, so requests that must not be sent twice, with
+    idempotent False, are not retried after those.
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if retries is None:
+        retries = RETRIES
+
+    for attempt in range(retries + 1):
+        start = time.time()
+        try:
+            response = get_session().post(url, data=data, headers=headers, verify=verify,
+                                          timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(url, start, attempt, "error")
+            if attempt == retries or (not idempotent and isinstance(e, requests.ReadTimeout)):
+                raise
+            logger.warning("POST to %s failed: %s", url, e)
+        else:
+            _record(url, start, attempt, response.status_code)
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                return response
+            if not idempotent and response.status_code == 504:
+                return response
+            logger.warning("POST to %s failed with HTTP status code %d", url, response.status_code)
+
+        delay = backoff(attempt)
+        logger.info("Retrying POST to %s in %.1f seconds", url, delay)
+        time.sleep(delay)
+
+
+def backoff(attempt):
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+
+def _record(url, start, attempt, status):
+    metrics.record("http.request.seconds", time.time() - start, url=url, attempt=attempt, status=status)
@@ -0,0 +1,105 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import collections
+
+# Event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_CLOEXEC = 02000000
+IN_NONBLOCK = 04000
+
+_EVENT = struct.Struct("iIII")
+_BUFSIZE = 65536
+
+Event = collections.namedtuple("Event", "wd mask cookie name")
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Inotify(object):
+    """
+    Minimal wrapper around the Linux inotify API. Raises OSError when
+    inotify is not available, so callers can fall back to polling.
+    """
+    def __init__(self):
+        try:
+            libc = _get_libc()
+            self._init = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, "inotify is not available: %s" % e)
+
+        self.fd = _check(self._init(IN_CLOEXEC | IN_NONBLOCK))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        return _check(self._add_watch(self.fd, path, mask))
+
+    def rm_watch(self, wd):
+        _check(self._rm_watch(self.fd, wd))
+
+    def read(self, timeout=None):
+        # Returns the events that arrive within timeout seconds, or an empty
+        # list. A timeout of None blocks until there are events.
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, _BUFSIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+            events.append(Event(wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
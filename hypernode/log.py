@@ -2,6 +2,10 @@
 import logging
 import logging.handlers
 import sys
+import Queue
+import atexit
+import threading
+import collections
 
 
 def getLogger(name="hypernode"):
@@ -10,30 +14,105 @@ def getLogger(name="hypernode"):
     return logger
 
 
+class _BufferEntry(object):
+    # Only the parts of a LogRecord our formatters use, and the formatted
+    # line once it has been asked for
+    __slots__ = ("created", "name", "levelno", "message", "exc_text", "line")
+
+    def __init__(self, created, name, levelno, message, exc_text):
+        self.created = created
+        self.name = name
+        self.levelno = levelno
+        self.message = message
+        self.exc_text = exc_text
+        self.line = None
+
+    @property
+    def size(self):
+        return len(self.message) + len(self.exc_text or "")
+
+    def record(self):
+        return logging.makeLogRecord({
+            "created": self.created,
+            "msecs": (self.created - int(self.created)) * 1000,
+            "name": self.name,
+            "levelno": self.levelno,
+            "levelname": logging.getLevelName(self.levelno),
+            "msg": self.message,
+            "exc_text": self.exc_text,
+        })
+
+
 class MyBufferHandler(logging.handlers.BufferingHandler):
     """
     This is our implementation of the logging BufferingHandler that
-    never removes any records. It has overridden flush() and shouldFlush()
-    methods.
+    never flushes. It is a ring buffer that keeps the last capacity
+    records, as long as their messages do not exceed maxbytes in total.
+    Records are stored compactly and formatted the first time
+    formatBuffer() asks for them, so formatters can only use the name,
+    level, time and message of a record.
 
     Should you ever want to clear the logs, use truncate().
 
     Also see nosetests.logcapture.MyMemoryHandler.
     """
-    def __init__(self, capacity=1000):
+    def __init__(self, capacity=1000, maxbytes=1024 * 1024):
         logging.handlers.BufferingHandler.__init__(self, capacity)
+        self.maxbytes = maxbytes
+        self.buffer = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+    def emit(self, record):
+        # Like the handlers of the logging module, we never raise into the
+        # caller, for instance because of a broken format string
+        try:
+            exc_text = record.exc_text
+            if record.exc_info and not exc_text:
+                exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+
+            entry = _BufferEntry(record.created, record.name, record.levelno, record.getMessage(), exc_text)
+        except Exception:
+            self.handleError(record)
+            return
+
+        self.buffer.append(entry)
+        self.size += entry.size
+
+        # Always keep the newest record, even if it is larger than maxbytes
+        while len(self.buffer) > 1 and (len(self.buffer) > self.capacity or self.size > self.maxbytes):
+            self.size -= self.buffer.popleft().size
+            self.dropped += 1
 
     def flush(self):
         pass
 
     def truncate(self):
-        self.buffer = []
+        self.acquire()
+        try:
+            self.buffer.clear()
+            self.size = 0
+            self.dropped = 0
+        finally:
+            self.release()
 
     def shouldFlush(self, record):
         return False
 
     def formatBuffer(self):
-        return [self.format(x) for x in self.buffer]
+        self.acquire()
+        try:
+            lines = []
+            if self.dropped:
+                lines.append("[%d earlier log lines dropped]" % self.dropped)
+
+            for entry in self.buffer:
+                if entry.line is None:
+                    entry.line = self.format(entry.record())
+                lines.append(entry.line)
+            return lines
+        finally:
+            self.release()
 
 
 def attachBufferHandler(logger):
@@ -45,19 +124,103 @@ def attachBufferHandler(logger):
     return bh
 
 
-def attachConsoleHandler(logger):
+class QueueHandler(logging.Handler):
+    """
+    Hands records to a background thread that passes them on to target,
+    so a slow target (like a stalled /dev/log) never blocks the thread
+    that logs. When more than maxsize records are waiting, new records are
+    dropped and counted. Waiting records are written when the process
+    exits, for at most STOP_TIMEOUT seconds.
+    """
+    STOP_TIMEOUT = 5
+
+    def __init__(self, target, maxsize=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._drain, name="log-%s" % target.__class__.__name__)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def prepare(self, record):
+        # Resolve the message and exception now, the arguments may have
+        # changed by the time the record gets written
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = (self.target.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _drain(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        if not self.thread.is_alive():
+            return
+
+        try:
+            self.queue.put(None, timeout=timeout)
+        except Queue.Full:
+            pass
+        self.thread.join(timeout)
+
+        if self.dropped:
+            self.target.handle(logging.makeLogRecord({
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": logging.getLevelName(logging.WARNING),
+                "msg": "Dropped %d log records because the log queue was full" % self.dropped,
+            }))
+            self.dropped = 0
+        self.target.flush()
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def attachQueueHandler(logger, target):
+    qh = QueueHandler(target)
+    qh.setLevel(target.level)
+    logger.addHandler(qh)
+    return qh
+
+
+def attachConsoleHandler(logger, queued=False):
     formatter = logging.Formatter("%(asctime)s - %(name)-20s - %(levelname)-7s   %(message)s")
     ch = logging.StreamHandler(sys.stdout)
     ch.setFormatter(formatter)
     ch.setLevel(logging.DEBUG)
+    if queued:
+        return attachQueueHandler(logger, ch)
     logger.addHandler(ch)
     return ch
 
 
-def attachSyslogHandler(logger):
+def attachSyslogHandler(logger, queued=False):
     formatter = logging.Formatter('%(name)s: %(levelname)s %(message)s')
     syslog = logging.handlers.SysLogHandler(address='/dev/log')
     syslog.setFormatter(formatter)
     syslog.setLevel(logging.INFO)
+    if queued:
+        return attachQueueHandler(logger, syslog)
     logger.addHandler(syslog)
-    return syslog
\ No newline at end of file
+    return syslog
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import errno
+import tempfile
+import threading
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Summaries are written here by flush(), one JSON file per program, for the
+# monitoring to pick up
+METRICSDIR = "/var/lib/hypernode/metrics"
+
+# The most recent measurements are kept as they are, everything is summed up
+# per name and tags. Processes like the nodeconfig daemon run for a long
+# time, so both are bounded.
+RECENT_KEPT = 1000
+MAX_SERIES = 1000
+
+_lock = threading.Lock()
+_recent = collections.deque(maxlen=RECENT_KEPT)
+_summaries = collections.OrderedDict()
+_dropped = 0
+_started = time.time()
+
+
+def record(name, value, **tags):
+    global _dropped
+    key = (name, tuple(sorted(tags.items())))
+    with _lock:
+        _recent.append((name, value, tags))
+
+        summary = _summaries.get(key)
+        if summary is None:
+            if len(_summaries) >= MAX_SERIES:
+                _dropped += 1
+                return
+            summary = _summaries[key] = {"name": name, "tags": tags, "count": 0, "sum": 0,
+                                         "min": value, "max": value}
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["min"] = min(summary["min"], value)
+        summary["max"] = max(summary["max"], value)
+        summary["last"] = value
+
+    logger.debug("metric %s=%s %s", name, value,
+                 " ".join("%s=%s" % item for item in sorted(tags.items())))
+
+
+def get(name=None):
+    # The most recent measurements, as (name, value, tags) tuples
+    with _lock:
+        return [m for m in _recent if name is None or m[0] == name]
+
+
+def summaries(name=None):
+    # The count, sum, min, max and last value of every name and set of tags
+    # since the start of the process
+    with _lock:
+        return [dict(summary) for summary in _summaries.values() if name is None or summary["name"] == name]
+
+
+def reset():
+    global _dropped
+    with _lock:
+        _recent.clear()
+        _summaries.clear()
+        _dropped = 0
+
+
+def flush(program, dirname=None):
+    """
+    Write the summaries of this process to <program>.json in dirname. The
+    file is replaced atomically, so readers never see a partial one. Metrics
+    are not worth failing the program for, errors are only logged.
+    """
+    if dirname is None:
+        dirname = METRICSDIR
+
+    with _lock:
+        data = {"started": int(_started),
+                "written": int(time.time()),
+                "dropped": _dropped,
+                "metrics": [dict(summary) for summary in _summaries.values()]}
+
+    try:
+        try:
+            os.makedirs(dirname, 0755)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd, tmpname = tempfile.mkstemp(prefix=".%s." % program, dir=dirname)
+        try:
+            with os.fdopen(fd, "w") as fh:
+                os.fchmod(fh.fileno(), 0644)
+                json.dump(data, fh, sort_keys=True)
+            os.rename(tmpname, os.path.join(dirname, "%s.json" % program))
+        except:
+            os.unlink(tmpname)
+            raise
+    except Exception as e:
+        logger.warning("Could not write metrics to %s: %s", dirname, e)
@@ -1,18 +1,24 @@
 #!/usr/bin/env python
 
-import hashlib
-import json
-import requests
+import gzip
+import StringIO
 import hypernode.nodeconfig
+import hypernode.httpclient
 import hypernode.log
 from hypernode.nodeconfig import common
 
+# The log sent along with an error callback is capped at LOG_MAXBYTES. Of a
+# longer log we send the first LOG_HEADBYTES, where the run started, and the
+# end, where it failed.
+LOG_MAXBYTES = 256 * 1024
+LOG_HEADBYTES = 32 * 1024
+
 
 class CallbackException(Exception):  # pragma: no cover
     pass
 
 
-def call_success(config):
+def call_success(config, timings=None):
     logger = hypernode.log.getLogger(__name__)
 
     common.check_vars(config, ["callback_url", "app_name"])
@@ -22,7 +28,11 @@ def call_success(config):
     logger.debug("POSTing to %s" % config["callback_url"])
 
     headers = {'User-Agent': 'nodeconfig/callback for %s' % config["app_name"]}
-    r = requests.post(config["callback_url"], data={"applied_hash": hash}, headers=headers, verify=True)
+    data = {"applied_hash": hash,
+            "section_hashes": common.canonical_json(common.hash_config_sections(config))}
+    if timings is not None:
+        data["timings"] = common.canonical_json(timings)
+    r = hypernode.httpclient.post(config["callback_url"], data=data, headers=headers, verify=True)
 
     if r.status_code == 200:
         logger.info("Callback was received")
@@ -32,7 +42,7 @@ def call_success(config):
         raise Exception("Success callback failed with HTTP status code %d: %s" % (r.status_code, r.text))
 
 
-def call_error(config, module, exception, log):
+def call_error(config, module, exception, log, timings=None):
     logger = hypernode.log.getLogger(__name__)
 
     common.check_vars(config, ["callback_url", "app_name"])
@@ -41,15 +51,26 @@ def call_error(config, module, exception, log):
     logger.info("Signaling back to control that module %s failed while applying the nodeconfig" % module.__name__)
     logger.debug("POSTing to %s" % config["callback_url"])
 
+    text = "\n".join(log)
+    capped, truncated = cap_log(text)
+    if truncated:
+        logger.debug("Sending %d of %d bytes of log" % (len(capped), len(text)))
+
+    data = {"applied_hash": hash,
+            "error": exception,
+            "module": module.__name__,
+            "log_size": len(text),
+            "log_truncated": int(truncated)
+            }
+    if timings is not None:
+        data["timings"] = common.canonical_json(timings)
+
     headers = {'User-Agent': 'nodeconfig/callback for %s' % config["app_name"]}
-    r = requests.post(config["callback_url"],
-                      data={"applied_hash": hash,
-                            "error": exception,
-                            "module": module.__name__,
-                            "log": "\n".join(log)
-                            },
-                      headers=headers,
-                      verify=True)
+    r = hypernode.httpclient.post(config["callback_url"],
+                                  data=data,
+                                  files={"log": ("log.gz", compress(capped), "application/gzip")},
+                                  headers=headers,
+                                  verify=True)
 
     if r.status_code == 200:
         logger.debug("Callback was received")
@@ -59,6 +80,36 @@ def call_error(config, module, exception, log):
         raise CallbackException("Error callback failed with HTTP status code %d: %s" % (r.status_code, r.text))
 
 
+def cap_log(text, maxbytes=None, headbytes=None):
+    """
+    Return text cut down to a head and a tail of at most maxbytes in total,
+    with a marker where it was cut, and whether it was cut at all.
+    """
+    if maxbytes is None:
+        maxbytes = LOG_MAXBYTES
+    if headbytes is None:
+        headbytes = LOG_HEADBYTES
+
+    if len(text) <= maxbytes:
+        return text, False
+
+    headbytes = min(headbytes, maxbytes)
+    tailbytes = maxbytes - headbytes
+    marker = "\n[... %d bytes truncated ...]\n" % (len(text) - headbytes - tailbytes)
+    return text[:headbytes] + marker + text[len(text) - tailbytes:], True
+
+
+def compress(text):
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+
+    buf = StringIO.StringIO()
+    gz = gzip.GzipFile(fileobj=buf, mode="wb")
+    gz.write(text)
+    gz.close()
+    return buf.getvalue()
+
+
 def hash_deployment_config(config):
     # do not handle any json or hashing exceptions
-    return hashlib.sha512(json.dumps(config)).hexdigest()
+    return common.hash_config(config)
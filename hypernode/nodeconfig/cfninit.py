@@ -1,4 +1,4 @@
-import subprocess
+from hypernode import timing
 from hypernode.nodeconfig import common
 import logging
 
@@ -11,4 +11,4 @@ def apply_config(config):
     common.check_vars(config, ["app_name", "region"])
 
     logger.info("Calling /usr/local/bin/cfn-init")
-    subprocess.call(["/usr/local/bin/cfn-init", "-s", config["app_name"], "-r", "LaunchConfig", "--credential-file", "/etc/cfn/cfn-credentials", "--region", config["region"]])
\ No newline at end of file
+    timing.call(["/usr/local/bin/cfn-init", "-s", config["app_name"], "-r", "LaunchConfig", "--credential-file", "/etc/cfn/cfn-credentials", "--region", config["region"]])
\ No newline at end of file
@@ -3,21 +3,111 @@
 import sys
 import json
 import os
+import stat
+import errno
+import hashlib
+import binascii
+import threading
 
-from django.conf import settings
-import django.template
+# The files of the node are read from and written to below ROOT. Only the
+# benchmarks change it, to run the parts against a sandbox.
+ROOT = "/"
 
-settings.configure(DEBUG=True, TEMPLATE_DEBUG=True,
-                   TEMPLATE_DIRS=('conf.d'))
+# Templates of the parts. Can be pointed elsewhere to render configs against
+# other templates.
+TEMPLATEDIR = "/etc/hypernode/templates"
+
+# Parsed templates by filename, together with the mtime and size of the file
+# they were parsed from
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+class NodeConfig(dict):
+    """
+    A nodeconfig as loaded by get_config. It behaves like a dict, but keeps
+    values derived from it, like its hashes, until it is modified. Only
+    changes to the top level are noticed, nested values must be replaced
+    rather than changed in place.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.cache = {}
+
+    def __setitem__(self, key, value):
+        self.cache.clear()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.cache.clear()
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self.cache.clear()
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self.cache.clear()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self.cache.clear()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.cache.clear()
+        return dict.popitem(self)
+
+    def clear(self):
+        self.cache.clear()
+        dict.clear(self)
+
+
+def rootpath(path):
+    if ROOT == "/":
+        return path
+    return os.path.join(ROOT, path.lstrip("/"))
 
 
 def get_config(filename):
-    with open(filename, 'r') as fd:
+    with open(rootpath(filename), 'r') as fd:
         content = fd.read()
         try:
-            return json.loads(content)
+            config = json.loads(content)
         except ValueError:
-            return {}
+            return NodeConfig()
+
+        if isinstance(config, dict):
+            return NodeConfig(config)
+        return config
+
+
+def canonical_json(value):
+    # Sorted keys and fixed separators, so equal configs always serialize,
+    # and therefore hash, the same
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def memoize(config, name, compute):
+    # Only a NodeConfig can hold on to derived values
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return compute()
+    if name not in cache:
+        cache[name] = compute()
+    return cache[name]
+
+
+def hash_config(config):
+    return memoize(config, "hash",
+                   lambda: hashlib.sha512(canonical_json(config)).hexdigest())
+
+
+def hash_config_sections(config):
+    # A hash per top-level key, to tell cheaply which sections changed
+    return memoize(config, "section_hashes",
+                   lambda: dict((key, hashlib.sha512(canonical_json(value)).hexdigest())
+                                for key, value in config.items()))
 
 
 def check_vars(config, keynames):
@@ -28,21 +118,135 @@ def check_vars(config, keynames):
 
 
 def write_file(filename, data, umask=None):
-    old_umask = None
+    """
+    Atomically replace the contents of filename with data, unless the file
+    already holds exactly that data. Returns True if the file was written and
+    False if it was left untouched.
 
-    if not umask is None:
-        old_umask = os.umask(umask)
+    The umask determines the mode of the file. Without a umask, an existing
+    file keeps its mode and a new file gets the default mode of the process.
+    """
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
 
+    filename = rootpath(filename)
     try:
-        with open(filename, 'w') as fd:
-            fd.write(data)
-    finally:
-        if not umask is None:
-            os.umask(old_umask)
+        st = os.stat(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        st = None
 
+    mode = None
+    if umask is not None:
+        mode = 0666 & ~umask
+    elif st is not None:
+        mode = stat.S_IMODE(st.st_mode)
 
-def fill_template(template, vars={}):
+    if st is not None and file_has_content(filename, st, data):
+        if mode is not None and stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(filename, mode)
+        return False
+
+    tmpname, fd = _create_tempfile(filename, 0600 if mode is not None else 0666)
+    try:
+        # The file object owns the descriptor, so it is closed on errors too
+        with os.fdopen(fd, 'w') as fh:
+            if mode is not None:
+                os.fchmod(fh.fileno(), mode)
+            if st is not None:
+                _fchown(fh.fileno(), st.st_uid, st.st_gid)
+
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
 
+        os.rename(tmpname, filename)
+    except:
+        os.unlink(tmpname)
+        raise
+
+    return True
+
+
+def file_has_content(filename, st, data):
+    # Compare sizes first, so we only read the file if it is likely to match
+    if st.st_size != len(data):
+        return False
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(65536), b""):
+            digest.update(chunk)
+
+    return digest.digest() == hashlib.sha1(data).digest()
+
+
+def _create_tempfile(filename, mode):
+    # The tempfile lives next to the file, so the final rename is atomic
+    dirname, basename = os.path.split(filename)
+    while True:
+        tmpname = os.path.join(dirname, ".%s.%s" % (basename, binascii.hexlify(os.urandom(4))))
+        try:
+            return tmpname, os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def _fchown(fd, uid, gid):
+    # Keep the owner of the file we replace. Only root can do this, so we
+    # ignore failures when running unprivileged.
+    try:
+        os.fchown(fd, uid, gid)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            raise
+
+
+def load_django():
+    # Django is only needed to render templates. It is imported and
+    # configured on first use, so entry points that never render a template
+    # do not pay for it on startup.
+    import django.template
+    from django.conf import settings
+
+    with _templates_lock:
+        if not settings.configured:
+            settings.configure(DEBUG=True, TEMPLATE_DEBUG=True,
+                               TEMPLATE_DIRS=('conf.d'))
+
+    return django.template
+
+
+def get_template(template):
+    # Reuse the parsed template as long as the file on disk is unchanged
+    template = rootpath(template)
+    st = os.stat(template)
+    key = (st.st_mtime, st.st_size)
+
+    with _templates_lock:
+        cached = _templates.get(template)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    django_template = load_django()
     with open(template, "r") as fd:
-        tmpl = django.template.Template(fd.read())
-        return tmpl.render(django.template.Context(vars))
+        tmpl = django_template.Template(fd.read())
+
+    with _templates_lock:
+        _templates[template] = (key, tmpl)
+    return tmpl
+
+
+def fill_template(template, vars={}):
+    tmpl = get_template(template)
+    return tmpl.render(load_django().Context(vars))
+
+
+def fill_templates(template, varslist):
+    # Render many sets of variables against the same template, for instance
+    # when validating templates against the nodeconfigs of many nodes
+    tmpl = get_template(template)
+    context = load_django().Context
+    return [tmpl.render(context(vars)) for vars in varslist]
@@ -0,0 +1,65 @@
+import os
+import logging
+
+from hypernode import inotify, metrics
+from hypernode.nodeconfig import common, runner
+
+logger = logging.getLogger(__name__)
+
+# Seconds without further changes before a burst of writes is considered done
+DEBOUNCE = 0.5
+
+# Editors and deploy tools either rewrite the file or move a new one in place
+WATCHMASK = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+
+
+def is_relevant(events, filename):
+    for event in events:
+        if event.mask & inotify.IN_Q_OVERFLOW or event.name == filename:
+            return True
+    return False
+
+
+def watch(path, callback, debounce=DEBOUNCE, stop=None):
+    """
+    Call callback() every time path is written or replaced, once per burst
+    of changes. We watch the directory, so replacing the file by a rename is
+    picked up as well. Returns once the stop event is set.
+    """
+    dirname, filename = os.path.split(path)
+
+    with inotify.Inotify() as notifier:
+        notifier.add_watch(dirname, WATCHMASK)
+        logger.info("Watching %s for changes", path)
+
+        while stop is None or not stop.is_set():
+            if not is_relevant(notifier.read(timeout=1), filename):
+                continue
+
+            while is_relevant(notifier.read(timeout=debounce), filename):
+                pass
+
+            logger.info("%s has changed", path)
+            callback()
+
+
+def apply_nodeconfig(path, logbuffer, parts=None):
+    # Nothing in here may stop the daemon, it should just try again on the
+    # next change
+    try:
+        logbuffer.truncate()
+        logger.debug("Fetching nodeconfig from %s" % path)
+        config = common.get_config(path)
+        runner.apply_parts(config, logbuffer, parts)
+    except Exception as e:
+        logger.critical("Could not apply nodeconfig in %s" % path)
+        logger.critical(e)
+    finally:
+        metrics.flush("nodeconfig-daemon")
+
+
+def run(path, logbuffer, parts=None, stop=None):
+    # Catch up on changes made while we were not running, then apply every
+    # change as it comes in. Unchanged parts are skipped by the runner.
+    apply_nodeconfig(path, logbuffer, parts)
+    watch(path, lambda: apply_nodeconfig(path, logbuffer, parts), stop=stop)
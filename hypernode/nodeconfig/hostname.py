@@ -1,27 +1,55 @@
-import subprocess
-from hypernode.nodeconfig import common
+from hypernode.nodeconfig import common, services
+import os
+import ctypes
+import socket
 import logging
 
 logger = logging.getLogger(__name__)
 
+CONFIG_KEYS = ["hostnames", "app_name"]
+TEMPLATES = ["03.hostname.hosts"]
 
-def apply_config(config):
 
+def render(config):
     common.check_vars(config, ["hostnames", "app_name"])
 
-    logger.debug("Setting hostname to %s" % config["app_name"])
+    return {"/etc/hostname": config["app_name"],
+            "/etc/hosts": common.fill_template(os.path.join(common.TEMPLATEDIR, "03.hostname.hosts"),
+                                               {"hostnames": config["hostnames"],
+                                                "app_name": config["app_name"]})}
 
-    logger.info("Writing /etc/hostname")
-    common.write_file("/etc/hostname", config["app_name"])
 
-    logger.info("Writing /etc/hosts from template /etc/hypernode/templates/03.hostname.hosts")
-    common.write_file("/etc/hosts",
-                      common.fill_template("/etc/hypernode/templates/03.hostname.hosts",
-                                           {"hostnames": config["hostnames"],
-                                           "app_name": config["app_name"]}))
+def sethostname(name):
+    # What `hostname <name>` does, without starting a process for it. The
+    # symbols of the running python include those of libc.
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.sethostname(name, len(name)) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, "Could not set hostname to %s: %s" % (name, os.strerror(err)))
+
 
-    logger.info("Calling `hostname`")
-    subprocess.call(["hostname", config["app_name"]])
+def apply_config(config):
+
+    files = render(config)
 
-    logger.info("Restarting rsyslog")
-    subprocess.call(["service", "rsyslog", "restart"])
\ No newline at end of file
+    logger.info("Writing /etc/hostname")
+    changed = [common.write_file("/etc/hostname", files["/etc/hostname"])]
+
+    logger.info("Writing /etc/hosts from template 03.hostname.hosts")
+    changed.append(common.write_file("/etc/hosts", files["/etc/hosts"]))
+
+    # rsyslog only looks up the hostname when it starts, so it has to be
+    # restarted for a new name. For a changed hosts file a HUP is enough,
+    # which does not lose messages like a restart does.
+    if socket.gethostname() != config["app_name"]:
+        logger.info("Setting hostname to %s", config["app_name"])
+        sethostname(config["app_name"])
+        logger.info("Scheduling restart of rsyslog")
+        services.schedule("rsyslog", "restart")
+    elif any(changed):
+        logger.info("Hostname unchanged, scheduling reload of rsyslog")
+        services.schedule("rsyslog", "reload")
+    else:
+        logger.info("Hostname and hosts file unchanged, not restarting rsyslog")
@@ -1,12 +1,30 @@
-import subprocess
+import os
+import time
+import errno
+import signal
+import socket
 import logging
 
-from hypernode.nodeconfig import common
+from hypernode import metrics, timing
+from hypernode.nodeconfig import common, services
 
 logger = logging.getLogger(__name__)
 
+CONFIG_KEYS = ["php_options"]
+TEMPLATES = ["20.phpini"]
+
+INIPATH = "/etc/php5/mods-available/hypernode.ini"
+
+FPM_PIDFILE = "/var/run/php5-fpm.pid"
+FPM_SOCKET = "/var/run/php5-fpm.sock"
+
+# Seconds to wait for php5-fpm to accept connections again after a reload
+# or restart, and how often to check
+READY_TIMEOUT = 10
+READY_POLL_INTERVAL = 0.05
 
-def apply_config(config):
+
+def render(config):
 
     logger.debug("Checking configuration for php_options")
     common.check_vars(config, ["php_options"])
@@ -28,14 +46,124 @@ def apply_config(config):
             logger.debug("Enabling extension '%s'" % item)
             extensions[item] = True
 
-    logger.info("Writing /etc/php5/mods-available/hypernode.ini")
-    common.write_file("/etc/php5/mods-available/hypernode.ini",
-                      common.fill_template("/etc/hypernode/templates/20.phpini",
-                                           {"options": options,
-                                            "extensions": extensions}))
+    return {INIPATH: common.fill_template(os.path.join(common.TEMPLATEDIR, "20.phpini"),
+                                          {"options": options,
+                                           "extensions": extensions})}
+
+
+def apply_config(config):
+
+    files = render(config)
+
+    logger.info("Writing %s", INIPATH)
+    changed = common.write_file(INIPATH, files[INIPATH])
+
+    if not changed:
+        logger.info("hypernode.ini unchanged, not restarting PHP5-FPM daemon")
+        return
 
     logger.info("Enabling hypernode.ini using php5enmod")
-    subprocess.call(["php5enmod", "hypernode/99"])
+    timing.call(["php5enmod", "hypernode/99"])
+
+    logger.info("Scheduling reload of PHP5-FPM daemon")
+    services.schedule("php5-fpm", "reload")
+
+
+def read_pid(pidfile=FPM_PIDFILE):
+    with open(common.rootpath(pidfile)) as fd:
+        return int(fd.read().strip())
+
+
+def pidfile_stat(pidfile=FPM_PIDFILE):
+    try:
+        st = os.stat(common.rootpath(pidfile))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    return st.st_ino, st.st_mtime
+
+
+def accepts_connections(path=FPM_SOCKET):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(common.rootpath(path))
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def wait_until_ready(before, timeout=None):
+    """
+    Wait until php5-fpm has written a new pidfile, which it does once it
+    has read its configuration again, and accepts connections on its
+    socket. before is the pidfile_stat() from before the reload or restart.
+    Returns whether it got ready within timeout seconds.
+    """
+    if timeout is None:
+        timeout = READY_TIMEOUT
+
+    deadline = time.time() + timeout
+    while True:
+        current = pidfile_stat()
+        if current is not None and current != before and accepts_connections():
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(READY_POLL_INTERVAL)
+
+
+def reload_fpm(timer=None):
+    """
+    Gracefully reload php5-fpm, which lets the workers finish the requests
+    they are handling, unlike a restart. Falls back to a restart if the
+    reload does not work out. Returns an exit code like `service` would.
+    """
+    if timing.call(["php5-fpm", "-t"], timer=timer) != 0:
+        # A restart would not get it running with this configuration either,
+        # so we leave the running php5-fpm alone
+        logger.error("Configuration test of PHP5-FPM failed, not reloading it")
+        return 1
+
+    before = pidfile_stat()
+    start = time.time()
+    try:
+        pid = read_pid()
+    except (IOError, ValueError) as e:
+        logger.info("PHP5-FPM is not running (%s), starting it", e)
+        return timing.call(["service", "php5-fpm", "restart"], timer=timer)
+
+    try:
+        os.kill(pid, signal.SIGUSR2)
+    except OSError as e:
+        logger.warning("Could not signal PHP5-FPM with pid %d: %s", pid, e)
+    else:
+        if wait_until_ready(before):
+            report_downtime(time.time() - start, "reload")
+            return 0
+        logger.warning("PHP5-FPM did not come back within %ss after a reload", READY_TIMEOUT)
+
+    logger.warning("Falling back to a restart of PHP5-FPM")
+    before = pidfile_stat()
+    ret = timing.call(["service", "php5-fpm", "restart"], timer=timer)
+    if ret != 0:
+        # Not a downtime we can measure, php5-fpm may well be down still
+        logger.error("Restart of PHP5-FPM failed with exit code %d", ret)
+        metrics.record("php5-fpm.restart.failures", 1)
+        return ret
+    if not wait_until_ready(before):
+        logger.warning("PHP5-FPM did not come back within %ss after a restart", READY_TIMEOUT)
+    report_downtime(time.time() - start, "restart")
+    return ret
+
+
+def report_downtime(seconds, method):
+    # The time from the start of the reload until php5-fpm accepted
+    # connections again. Requests that come in meanwhile wait or fail.
+    logger.info("PHP5-FPM was unavailable for %.3fs during %s", seconds, method)
+    metrics.record("php5-fpm.downtime.seconds", seconds, method=method)
+
 
-    logger.info("Restarting PHP5-FPM daemon")
-    subprocess.call(["service", "php5-fpm", "restart"])
\ No newline at end of file
+services.register("php5-fpm", "reload", reload_fpm)
\ No newline at end of file
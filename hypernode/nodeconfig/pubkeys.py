@@ -1,5 +1,11 @@
 import os
+import json
+import base64
+import struct
+import hashlib
 import logging
+import binascii
+import collections
 
 from hypernode.nodeconfig import common
 
@@ -7,21 +13,168 @@ from hypernode.nodeconfig import common
 logger = logging.getLogger(__name__)
 
 PREAMBLE = "#\n# This file is generated. Please update your public keys on the Hyperpanel\n#\n\n"
+# The account the public keys give access to
+USER = "user"
 DOTSSH = "/home/user/.ssh"
 AUTHKEYS = "/home/user/.ssh/authorized_keys"
 
+# The keys by fingerprint, for hypernode-authorized-keys to look up
+KEYINDEX = "/var/lib/hypernode/authorized_keys.json"
 
-def apply_config(config):
+CONFIG_KEYS = ["public_keys"]
+
+
+class PublicKey(collections.namedtuple("PublicKey", "options keytype key comment")):
+    """
+    A parsed line of authorized_keys: its options, the key type, the base64
+    encoded key and the comment.
+    """
+    @property
+    def fingerprint(self):
+        return fingerprint(self.key)
+
+    def line(self):
+        return " ".join(part for part in self if part)
+
+
+def fingerprint(key):
+    # Same format as ssh-keygen -l, SHA256 over the key blob
+    digest = hashlib.sha256(base64.b64decode(key)).digest()
+    return "SHA256:" + base64.b64encode(digest).rstrip("=")
+
+
+def split_options(line):
+    # Options come first, separated from the key by the first space that is
+    # not inside quotes
+    quoted = False
+    escaped = False
+    for i, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char in " \t" and not quoted:
+            return line[:i], line[i:].lstrip()
+    return line, ""
+
+
+def parse_key(line):
+    """
+    Parse a line of authorized_keys into a PublicKey. Raises ValueError if it
+    does not hold a valid key.
+    """
+    line = line.strip()
+    options = ""
+    fields = line.split(None, 2)
+    if len(fields) < 2 or not key_matches_type(fields[0], fields[1]):
+        options, line = split_options(line)
+        fields = line.split(None, 2)
+        if len(fields) < 2 or not key_matches_type(fields[0], fields[1]):
+            raise ValueError("Not a valid public key: %r" % line[:40])
+
+    return PublicKey(options, fields[0], fields[1], fields[2] if len(fields) > 2 else "")
+
+
+def key_matches_type(keytype, key):
+    # The key blob starts with its own type, which must match the one given
+    try:
+        blob = base64.b64decode(key)
+        length, = struct.unpack(">I", blob[:4])
+    except (TypeError, binascii.Error, struct.error):
+        return False
+    return blob[4:4 + length] == keytype
+
+
+def parse_keys(lines):
+    """
+    Return the valid keys in lines by fingerprint. Keys that are given
+    more than once are kept once, with the options and comment of the first.
+    An entry may hold several keys on separate lines.
+    """
+    keys = collections.OrderedDict()
+    for line in (line for entry in lines for line in entry.splitlines() if line.strip()):
+        try:
+            key = parse_key(line)
+        except ValueError as e:
+            logger.warning("Skipping public key: %s", e)
+            continue
+
+        if key.fingerprint in keys:
+            logger.debug("Skipping duplicate public key %s", key.fingerprint)
+            continue
+        keys[key.fingerprint] = key
+    return keys
+
+
+def render(config):
     common.check_vars(config, ["public_keys"])
-    contents = PREAMBLE + "".join([("%s\n\n" % key) for key in config["public_keys"]])
+    keys = parse_keys(config["public_keys"])
+
+    # Ordered by fingerprint, so the file only changes when the set of keys
+    # changes
+    index = dict((fp, key._asdict()) for fp, key in keys.items())
+    return {AUTHKEYS: PREAMBLE + "".join(["%s\n\n" % keys[fp].line() for fp in sorted(keys)]),
+            KEYINDEX: json.dumps(index, sort_keys=True, indent=2)}
+
+
+def apply_config(config):
+    files = render(config)
 
     # do not handle any errors here
-    if not os.path.isdir(DOTSSH):
+    dotssh = common.rootpath(DOTSSH)
+    if not os.path.isdir(dotssh):
         logging.info("Creating .ssh directory")
-        os.mkdir(DOTSSH, 0755)
+        os.mkdir(dotssh, 0755)
 
     logging.info("Setting .ssh dir owner")
-    os.chown(DOTSSH, 1000, 1000)
+    os.chown(dotssh, 1000, 1000)
 
     logging.info("Write authorized_keys file")
-    common.write_file(AUTHKEYS, contents, umask=0022)
\ No newline at end of file
+    if common.write_file(AUTHKEYS, files[AUTHKEYS], umask=0022):
+        logger.info("Public keys changed, wrote %s", AUTHKEYS)
+    else:
+        logger.info("Public keys unchanged, left %s alone", AUTHKEYS)
+
+    write_index(files[KEYINDEX])
+
+
+def write_index(data):
+    # The index only serves the AuthorizedKeysCommand, sshd falls back to the
+    # authorized_keys file, so failing to write it is not fatal
+    try:
+        dirname = os.path.dirname(common.rootpath(KEYINDEX))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0755)
+        common.write_file(KEYINDEX, data, umask=0022)
+    except (IOError, OSError) as e:
+        logger.warning("Could not write public key index %s: %s", KEYINDEX, e)
+
+
+def load_index(filename=KEYINDEX):
+    try:
+        return common.get_config(filename)
+    except IOError:
+        return {}
+
+
+def lookup(username, keytype, key, index=None):
+    """
+    Return the authorized_keys line of the key, encoded as UTF-8, if it is
+    in the index and username is the account the keys are for, or None.
+    sshd asks about every account, so the keys must not be given out for
+    any other.
+    """
+    if username != USER:
+        return None
+    if index is None:
+        index = load_index()
+
+    try:
+        entry = index.get(fingerprint(key))
+    except (TypeError, binascii.Error):
+        return None
+    if entry is None or entry["keytype"] != keytype:
+        return None
+    return PublicKey(**entry).line().encode("utf-8")
@@ -0,0 +1,101 @@
+import os
+import errno
+import logging
+import traceback
+import multiprocessing
+
+from hypernode.nodeconfig import common, schema
+from hypernode.nodeconfig import hostname, phpini, pubkeys, sslcerts
+
+logger = logging.getLogger(__name__)
+
+# The parts whose files we render, they all provide render(config)
+RENDERPARTS = [hostname, phpini, pubkeys, sslcerts]
+
+# Configs are handed to the workers in chunks, to keep the overhead per
+# config low
+CHUNKSIZE = 32
+
+
+def render_config(config, parts=None, private=False):
+    """
+    Return the files the parts would write for config, by path, without
+    writing anything. The files with key material the parts list in
+    PRIVATE_FILES are left out, unless private is True.
+    """
+    if parts is None:
+        parts = RENDERPARTS
+
+    files = {}
+    for part in parts:
+        rendered = part.render(config)
+        if not private:
+            for path in getattr(part, "PRIVATE_FILES", []):
+                rendered.pop(path, None)
+        files.update(rendered)
+    return files
+
+
+def write_tree(outdir, files):
+    # The output holds the configs of many customers, so only we may read it
+    for path, data in files.items():
+        filename = os.path.join(outdir, path.lstrip("/"))
+        try:
+            os.makedirs(os.path.dirname(filename), 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, "w") as fh:
+            os.fchmod(fh.fileno(), 0600)
+            fh.write(data)
+
+
+def render_node(task):
+    # Runs in a worker. Returns the name of the node and the error, if any,
+    # so one broken config does not stop the others.
+    path, outdir = task
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        config = common.get_config(path)
+        schema.validate(config)
+        write_tree(os.path.join(outdir, name), render_config(config))
+    except Exception as e:
+        logger.debug("Could not render %s: %s", path, traceback.format_exc())
+        return name, "%s: %s" % (e.__class__.__name__, e)
+    return name, None
+
+
+def _init_worker(templatedir):
+    common.TEMPLATEDIR = templatedir
+
+
+def render_configs(configdir, outdir, templatedir=None, processes=None):
+    """
+    Render every nodeconfig JSON file in configdir to a tree per node in
+    outdir, spread over a pool of processes. Returns the number of nodes
+    rendered and a dict with the error of every node that failed.
+    """
+    if templatedir is None:
+        templatedir = common.TEMPLATEDIR
+
+    tasks = [(os.path.join(configdir, filename), outdir)
+             for filename in sorted(os.listdir(configdir)) if filename.endswith(".json")]
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(templatedir,))
+    try:
+        errors = {}
+        for name, error in pool.imap_unordered(render_node, tasks, CHUNKSIZE):
+            if error is not None:
+                errors[name] = error
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return len(tasks), errors
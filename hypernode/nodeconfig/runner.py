@@ -0,0 +1,237 @@
+import time
+import Queue
+import threading
+import traceback
+import logging
+
+import hypernode.log
+from hypernode import timing
+from hypernode.nodeconfig import callback, schema, services, state
+from hypernode.nodeconfig import hostname, phpini, pubkeys, sslcerts
+
+logger = logging.getLogger(__name__)
+
+RUNPARTS = [hostname, phpini, pubkeys, sslcerts]
+MAX_WORKERS = 4
+
+
+class PartError(Exception):
+    """
+    Raised by run_parts() when a part fails. It carries the failing module,
+    the original exception and its formatted traceback, so the caller can
+    report them through the error callback.
+    """
+    def __init__(self, module, exception, tb):
+        Exception.__init__(self, "Could not execute part %s" % module.__name__)
+        self.module = module
+        self.exception = exception
+        self.traceback = tb
+
+
+def get_dependencies(module, modules):
+    # Parts declare the names of the parts they must run after in AFTER.
+    # Dependencies that are not part of this run are considered satisfied.
+    return set(name for name in getattr(module, "AFTER", []) if name in modules)
+
+
+def run_parts(parts, config, applied=None, force=False, workers=MAX_WORKERS, timings=None):
+    """
+    Run the apply_config of all parts, running parts that do not depend on
+    each other concurrently. Once a part fails no new parts are started; the
+    parts that are still running are waited for and the first failure is
+    raised as a PartError. The timers of the parts that ran are appended to
+    timings. The parts that succeeded are marked in applied, saving it is up
+    to the caller.
+    """
+    if applied is None:
+        applied = state.load_state()
+
+    modules = dict((module.__name__, module) for module in parts)
+    dependencies = dict((module.__name__, get_dependencies(module, modules)) for module in parts)
+
+    waiting = list(parts)
+    done = set()
+    running = 0
+    failure = None
+    lock = threading.Lock()
+    results = Queue.Queue()
+
+    while waiting or running:
+        if failure is None:
+            ready = [module for module in waiting if dependencies[module.__name__] <= done]
+            for module in ready[:max(workers - running, 0)]:
+                waiting.remove(module)
+                thread = threading.Thread(target=_run_part,
+                                          args=(module, config, applied, force, lock, results, timings))
+                thread.start()
+                running += 1
+
+            if not running:
+                raise RuntimeError("Circular dependency between parts %s" %
+                                   ", ".join(module.__name__ for module in waiting))
+        elif not running:
+            break
+
+        module, error = results.get()
+        running -= 1
+
+        if error is None:
+            done.add(module.__name__)
+        elif failure is None:
+            failure = error
+
+    if failure is not None:
+        raise failure
+
+
+def _run_part(module, config, applied, force, lock, results, timings=None):
+    try:
+        if not force and not state.part_changed(module, config, applied):
+            logger.debug("Skipping part %s, its configuration has not changed", module.__name__)
+            results.put((module, None))
+            return
+
+        logger.debug("Running part %s", module.__name__)
+        timer = timing.Timer(module.__name__)
+        try:
+            with timer:
+                module.apply_config(config)
+        finally:
+            if timings is not None:
+                with lock:
+                    timings.append(timer)
+        logger.debug("Part %s took %.2fs", module.__name__, timer.wall)
+
+        with lock:
+            state.mark_applied(module, config, applied)
+    except Exception as e:
+        results.put((module, PartError(module, e, traceback.format_exc())))
+    else:
+        results.put((module, None))
+
+
+def run_and_restart(parts, config, force=False, timings=None):
+    """
+    Run the parts and then the service actions they scheduled. Raises
+    PartError if a part failed, after running the actions of the parts that
+    did succeed, or ServiceError if an action failed.
+
+    The parts are only saved as applied once all actions succeeded. Actions
+    that did not succeed, or were interrupted, are retried on the next run:
+    the parts would not schedule them again, as their files are unchanged by
+    then.
+    """
+    if timings is None:
+        timings = []
+
+    applied = state.load_state()
+    for service, action in sorted(state.load_pending().items()):
+        logger.info("Retrying %s of %s left by an earlier run", action, service)
+        services.schedule(service, action)
+
+    failure = None
+    try:
+        run_parts(parts, config, applied, force=force, timings=timings)
+    except PartError as e:
+        failure = e
+
+    pending = services.pending()
+    _save(state.save_pending, pending)
+    results = restart_services(timings)
+    failed = dict((service, ret) for service, ret in results.items() if ret != 0)
+    _save(state.save_pending, dict((service, pending[service]) for service in failed if service in pending))
+
+    if not failed:
+        _save(state.save_state, applied)
+
+    if failure is not None:
+        raise failure
+    if failed:
+        raise services.ServiceError(failed)
+
+
+def _save(save, data):
+    # Losing the state only means that parts and service actions are done
+    # again, or not retried, which is no reason to fail the run
+    try:
+        save(data)
+    except (IOError, OSError) as e:
+        logger.warning("Could not save nodeconfig state: %s", e)
+
+
+def apply_parts(config, logbuffer, parts=None, force=False, timings=None):
+    """
+    Validate the config, run the parts, restart the services they asked for
+    and report the result to control. The contents of logbuffer are sent
+    along if the config is invalid or a part fails.
+    The timings of the run are sent along and kept in a local run record,
+    timers of earlier steps can be passed in timings. Returns True if
+    everything succeeded.
+    """
+    if parts is None:
+        parts = RUNPARTS
+    timings = list(timings or [])
+    started = time.time()
+
+    # Check the whole config before any part touches the node
+    try:
+        schema.validate(config)
+    except schema.SchemaError as e:
+        for error in e.errors:
+            logger.error("Invalid nodeconfig: %s" % error)
+
+        report_error(config, schema, e, logbuffer, make_run(started, timings, schema))
+        return False
+
+    # Parts that fail do not stop the service actions of the parts that did
+    # succeed. The config is not in effect until those actions succeeded.
+    try:
+        run_and_restart(parts, config, force=force, timings=timings)
+    except PartError as e:
+        modulelogger = hypernode.log.getLogger(e.module.__name__)
+        modulelogger.error("Could not execute part %s" % e.module.__name__)
+        modulelogger.error(e.traceback)
+
+        report_error(config, e.module, e.exception, logbuffer, make_run(started, timings, e.module))
+        return False
+    except services.ServiceError as e:
+        logger.error(str(e))
+        report_error(config, services, e, logbuffer, make_run(started, timings, services))
+        return False
+
+    run = make_run(started, timings)
+    state.record_run(run)
+
+    try:
+        callback.call_success(config, timings=run)
+    except Exception as e:
+        logger.error("Could not perform success callback to control")
+        logger.error(e)
+        return False
+
+    return True
+
+
+def report_error(config, module, exception, logbuffer, run):
+    state.record_run(run)
+
+    try:
+        callback.call_error(config, module, exception, logbuffer.formatBuffer(), timings=run)
+    except Exception as e:
+        logger.error("Could not perform error callback to control")
+        logger.error(e)
+
+
+def restart_services(timings):
+    # Returns the exit code of every service action by service
+    with timing.Timer("services") as timer:
+        results = services.run_pending()
+    timings.append(timer)
+    return results
+
+
+def make_run(started, timings, failed=None):
+    return {"started": int(started),
+            "wall": round(time.time() - started, 3),
+            "failed": failed.__name__ if failed is not None else None,
+            "timings": [timer.as_dict() for timer in timings]}
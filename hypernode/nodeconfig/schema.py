@@ -0,0 +1,128 @@
+import numbers
+
+# The ssl_* keys are given all together, or not at all
+SSL_KEYS = ['ssl_common_name', 'ssl_body', 'ssl_certificate', 'ssl_key_chain']
+
+# The keys of the nodeconfig the parts use. Keys that are not listed here are
+# not checked, so control can add keys before the parts know about them.
+SCHEMA = {
+    "app_name": {"type": basestring, "required": True},
+    "hostnames": {"type": list, "required": True, "items": {"type": basestring}},
+    "public_keys": {"type": list, "required": True, "items": {"type": basestring}},
+    "php_options": {"type": dict, "required": True, "keys": {
+        "options": {"type": dict, "values": {"type": (basestring, numbers.Number)}},
+        "extensions": {"type": list, "items": {"type": basestring}},
+    }},
+    "ssl_common_name": {"type": basestring},
+    "ssl_body": {"type": basestring},
+    "ssl_certificate": {"type": basestring},
+    "ssl_key_chain": {"type": basestring},
+}
+
+GROUPS = [SSL_KEYS]
+
+TYPENAMES = [
+    (bool, "a boolean"),
+    (basestring, "a string"),
+    (numbers.Number, "a number"),
+    (list, "a list"),
+    (dict, "an object"),
+]
+
+
+class SchemaError(ValueError):
+    """
+    Raised by validate() with all the problems found in a nodeconfig.
+    """
+    def __init__(self, errors):
+        ValueError.__init__(self, "Invalid nodeconfig: %s" % "; ".join(errors))
+        self.errors = errors
+
+
+def typename(types):
+    if not isinstance(types, tuple):
+        types = (types,)
+    return " or ".join(name for cls, name in TYPENAMES if cls in types)
+
+
+def valuetype(value):
+    if value is None:
+        return "null"
+    for cls, name in TYPENAMES:
+        if isinstance(value, cls):
+            return name
+    return value.__class__.__name__
+
+
+def compile_schema(schema, groups=()):
+    """
+    Turn a schema into a function that appends the problems of a config to
+    a list of errors. Compiling once up front keeps validation itself to a
+    single pass over the config.
+    """
+    checks = compile_keys(schema)
+
+    def validate(config, errors):
+        if not isinstance(config, dict):
+            errors.append("nodeconfig must be an object, not %s" % valuetype(config))
+            return
+
+        checks(config, "", errors)
+        for group in groups:
+            missing = [key for key in group if key not in config]
+            if missing and len(missing) < len(group):
+                errors.append("%s must be given together, missing %s" % (", ".join(group), ", ".join(missing)))
+
+    return validate
+
+
+def compile_keys(schema):
+    keys = [(key, spec.get("required", False), compile_value(spec)) for key, spec in sorted(schema.items())]
+
+    def check(value, path, errors):
+        for key, required, check_value in keys:
+            if key in value:
+                check_value(value[key], path + key, errors)
+            elif required:
+                errors.append("%s is required" % (path + key))
+
+    return check
+
+
+def compile_value(spec):
+    types = spec["type"]
+    expected = typename(types)
+    items = compile_value(spec["items"]) if "items" in spec else None
+    values = compile_value(spec["values"]) if "values" in spec else None
+    keys = compile_keys(spec["keys"]) if "keys" in spec else None
+
+    def check(value, path, errors):
+        if not isinstance(value, types):
+            errors.append("%s must be %s, not %s" % (path, expected, valuetype(value)))
+            return
+
+        if items is not None:
+            for i, item in enumerate(value):
+                items(item, "%s[%d]" % (path, i), errors)
+        if values is not None:
+            for key, item in value.items():
+                values(item, "%s.%s" % (path, key), errors)
+        if keys is not None:
+            keys(value, path + ".", errors)
+
+    return check
+
+
+_validate = compile_schema(SCHEMA, GROUPS)
+
+
+def errors(config):
+    result = []
+    _validate(config, result)
+    return result
+
+
+def validate(config):
+    problems = errors(config)
+    if problems:
+        raise SchemaError(problems)
@@ -0,0 +1,88 @@
+import threading
+import logging
+
+from hypernode import timing
+
+logger = logging.getLogger(__name__)
+
+# Known actions, in increasing order of impact. A scheduled restart makes a
+# reload of the same service superfluous.
+ACTIONS = ["reload", "restart"]
+
+_lock = threading.Lock()
+_pending = {}
+_handlers = {}
+
+
+class ServiceError(Exception):
+    """
+    Raised when service actions failed, with the exit codes of the failed
+    services by service.
+    """
+    def __init__(self, failed):
+        Exception.__init__(self, "Service actions failed: %s" %
+                           ", ".join("%s (exit code %s)" % item for item in sorted(failed.items())))
+        self.failed = failed
+
+
+def register(service, action, handler):
+    # Lets a part do an action of a service itself, instead of through the
+    # init script. The handler is called with the timer to time its commands
+    # on and returns an exit code like the command would.
+    if action not in ACTIONS:
+        raise ValueError("Unknown service action '%s'" % action)
+    _handlers[(service, action)] = handler
+
+
+def schedule(service, action="restart"):
+    # Parts call this instead of restarting services themselves. Intents are
+    # deduplicated here and executed once by run_pending() at the end of the run.
+    if action not in ACTIONS:
+        raise ValueError("Unknown service action '%s'" % action)
+
+    with _lock:
+        current = _pending.get(service)
+        if current is None or ACTIONS.index(action) > ACTIONS.index(current):
+            logger.debug("Scheduling %s of %s", action, service)
+            _pending[service] = action
+
+
+def pending():
+    with _lock:
+        return dict(_pending)
+
+
+def run_pending():
+    with _lock:
+        todo = sorted(_pending.items())
+        _pending.clear()
+
+    # Services are independent of each other, so we run them in parallel. The
+    # commands are timed as part of the caller's current timer.
+    results = {}
+    timer = timing.current()
+    threads = [threading.Thread(target=_run, args=(service, action, results, timer)) for service, action in todo]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def _run(service, action, results, timer=None):
+    logger.info("Running %s of %s", action, service)
+    handler = _handlers.get((service, action))
+    try:
+        if handler is not None:
+            ret = handler(timer)
+        else:
+            ret = timing.call(["service", service, action], timer=timer)
+    except Exception:
+        # Reported as a failure like a non-zero exit code, instead of getting
+        # lost in this thread
+        logger.exception("%s of %s failed", action.capitalize(), service)
+        ret = -1
+    if ret != 0:
+        logger.error("%s of %s failed with exit code %d", action.capitalize(), service, ret)
+    results[service] = ret
@@ -1,16 +1,41 @@
 import os
-import tempfile
-import subprocess
+import re
+import json
+import time
 import errno
+import hashlib
 import logging
 
-from hypernode.nodeconfig import common
+from OpenSSL import crypto, SSL
+
+from hypernode.nodeconfig import common, schema, services
 
 
 logger = logging.getLogger(__name__)
 
 CRTPATH = '/etc/ssl/private/hypernode.crt'
 CAPATH = '/etc/ssl/private/hypernode.ca'
+VHOSTPATH = '/etc/apache2/sites-enabled/default-ssl'
+
+# Trusted root certificates, like the default CApath of `openssl verify`
+SYSTEM_CAPATH = '/etc/ssl/certs'
+
+# Files with key material, left out when rendering configs offline
+PRIVATE_FILES = [CRTPATH, CAPATH]
+
+# Successful verifications by fingerprint of certificate, key and chain
+VERIFYCACHE = '/var/cache/hypernode/sslverify.json'
+VERIFYCACHE_SIZE = 16
+
+PEM_CERTIFICATE = re.compile("-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----", re.DOTALL)
+
+SSL_KEYS = schema.SSL_KEYS
+
+CONFIG_KEYS = ['app_name'] + SSL_KEYS
+
+# Apache resolves the ServerName of the vhost, so we need /etc/hosts first
+AFTER = ['hypernode.nodeconfig.hostname']
+TEMPLATES = ['05.ssl.default-ssl-vhost']
 
 
 def apply_config(config):
@@ -31,84 +56,166 @@ def apply_config(config):
     #    configuration
 
     # We always need an app_name. Not found => exception
-    common.check_vars(config, ["app_name"])
+    files = render(config)
 
-    if "ssl_common_name" in config and "ssl_body" in config and "ssl_certificate" in config and "ssl_key_chain" in config:
-        logger.debug("Configuring SSL")
-
-        logger.debug("Verifying SSL key and certificate")
-        verify_ssl(config["ssl_certificate"], config["ssl_body"], config["ssl_key_chain"])
+    if not files:
+        logger.debug("Disabling SSL")
+        disable_ssl()
+        return
 
-        template_vars = {'app_name': config['app_name'],
-                         'servername': config['ssl_common_name'],
-                         'crtpath': CRTPATH}
+    logger.debug("Configuring SSL")
 
-        if 'ssl_key_chain' in config and config['ssl_key_chain']:
-            logger.info("Writing %s", CAPATH)
-            common.write_file(CAPATH,
-                              config["ssl_key_chain"],
-                              umask=0077)
+    logger.debug("Verifying SSL key and certificate")
+    verify_ssl(config["ssl_certificate"], config["ssl_body"], config["ssl_key_chain"])
 
-            template_vars['capath'] = CAPATH
+    changed = []
 
-        logger.info("Writing %s", CRTPATH)
-        common.write_file(CRTPATH,
-                          "%s\n\n%s" % (config["ssl_certificate"], config["ssl_body"]),
-                          umask=0077)
+    if CAPATH in files:
+        logger.info("Writing %s", CAPATH)
+        changed.append(common.write_file(CAPATH, files[CAPATH], umask=0077))
 
-        logger.info("Writing /etc/apache2/sites-enabled/default-ssl")
-        common.write_file("/etc/apache2/sites-enabled/default-ssl",
-                          common.fill_template("/etc/hypernode/templates/05.ssl.default-ssl-vhost",
-                                               vars=template_vars))
+    logger.info("Writing %s", CRTPATH)
+    changed.append(common.write_file(CRTPATH, files[CRTPATH], umask=0077))
 
-        logger.info("Restarting apache2")
-        subprocess.call(["service", "apache2", "restart"])
-        return
+    logger.info("Writing %s", VHOSTPATH)
+    changed.append(common.write_file(VHOSTPATH, files[VHOSTPATH]))
 
-    elif "ssl_common_name" not in config and "ssl_body" not in config and "ssl_certificate" not in config and "ssl_key_chain" not in config:
-        logger.debug("Disabling SSL")
-        disable_ssl()
-        return
+    if any(changed):
+        logger.info("Scheduling restart of apache2")
+        services.schedule("apache2", "restart")
     else:
-        raise RuntimeError("Incomplete SSL parameters in configuration")
+        logger.info("SSL configuration unchanged, not restarting apache2")
+
+
+def ssl_enabled(config):
+    # True if all ssl-fields are present, False if none are
+    present = [key in config for key in SSL_KEYS]
+    if all(present):
+        return True
+    if not any(present):
+        return False
+    raise RuntimeError("Incomplete SSL parameters in configuration")
+
+
+def render(config):
+    common.check_vars(config, ["app_name"])
+    if not ssl_enabled(config):
+        return {}
+
+    files = {}
+    template_vars = {'app_name': config['app_name'],
+                     'servername': config['ssl_common_name'],
+                     'crtpath': CRTPATH}
+
+    if config['ssl_key_chain']:
+        files[CAPATH] = config["ssl_key_chain"]
+        template_vars['capath'] = CAPATH
+
+    files[CRTPATH] = "%s\n\n%s" % (config["ssl_certificate"], config["ssl_body"])
+    files[VHOSTPATH] = common.fill_template(os.path.join(common.TEMPLATEDIR, "05.ssl.default-ssl-vhost"),
+                                            vars=template_vars)
+    return files
+
+
+class SSLVerificationError(Exception):
+    pass
 
 
 def verify_ssl(crt, key, ca):
+    # Verifying only depends on the certificate, key and chain, so a
+    # combination that verified before does not need to be checked again
+    # until one of its certificates expires
+    fingerprint = ssl_fingerprint(crt, key, ca)
+    cache = load_verify_cache()
+
+    if fingerprint in cache and cache[fingerprint] > asn1_time(time.time()):
+        logger.debug("SSL key and certificate were verified before, skipping verification")
+        return
+
+    # If verification fails, an exception will be raised
+    valid_until = verify_ssl_pem(crt, key)
+    if ca:
+        valid_until = min(valid_until, verify_ssl_ca(crt, ca))
+
+    cache[fingerprint] = valid_until
+    save_verify_cache(cache)
+
+
+def verify_ssl_pem(crt, key):
+    # Parse certificate and key, and check that they belong together.
+    # Returns the expiry time of the certificate.
+    try:
+        certificate = crypto.load_certificate(crypto.FILETYPE_PEM, crt)
+        privatekey = crypto.load_privatekey(crypto.FILETYPE_PEM, key)
+
+        context = SSL.Context(SSL.SSLv23_METHOD)
+        context.use_certificate(certificate)
+        context.use_privatekey(privatekey)
+        context.check_privatekey()
+    except (crypto.Error, SSL.Error) as e:
+        raise SSLVerificationError("Invalid SSL key or certificate: %s" % e)
+
+    return certificate.get_notAfter()
+
+
+def verify_ssl_ca(crt, ca):
+    # Verify the certificate against the chain and the system root
+    # certificates. Returns the earliest expiry time in the chain.
+    try:
+        certificate = crypto.load_certificate(crypto.FILETYPE_PEM, crt)
+        chain = [crypto.load_certificate(crypto.FILETYPE_PEM, pem) for pem in PEM_CERTIFICATE.findall(ca)]
+        if not chain:
+            raise SSLVerificationError("No certificates found in SSL key chain")
+
+        store = crypto.X509Store()
+        if os.path.isdir(SYSTEM_CAPATH):
+            store.load_locations(None, SYSTEM_CAPATH)
+        for cacert in chain:
+            store.add_cert(cacert)
+
+        crypto.X509StoreContext(store, certificate).verify_certificate()
+    except (crypto.Error, crypto.X509StoreContextError) as e:
+        raise SSLVerificationError("Could not verify SSL certificate against key chain: %s" % e)
+
+    return min(cacert.get_notAfter() for cacert in chain)
+
+
+def ssl_fingerprint(crt, key, ca):
+    return hashlib.sha256("\0".join([crt, key, ca])).hexdigest()
 
-    # Write certificate to tempfiles, and test them
-    with tempfile.NamedTemporaryFile() as fd_crt, tempfile.NamedTemporaryFile() as fd_ca:
-        fd_crt.write("%s\n\n%s" % (key, crt))
-        fd_crt.flush()
-        fd_ca.write(ca)
-        fd_ca.flush()
 
-        # If verification fails, an exception will be raised
-        verify_ssl_pem(fd_crt.name)
-        if ca:
-            verify_ssl_ca(fd_crt.name, fd_ca.name)
+def asn1_time(timestamp):
+    # Same format as X509.get_notAfter(), so the two compare as strings
+    return time.strftime("%Y%m%d%H%M%SZ", time.gmtime(timestamp))
 
 
-def verify_ssl_pem(crt_file):
-    # check_output raises CalledProcessError if exit code is != 0
-    subprocess.check_output(["/usr/bin/openssl", "x509",
-                             "-in", crt_file, "-noout"],
-                            shell=False, stderr=subprocess.STDOUT)
+def load_verify_cache():
+    try:
+        return common.get_config(VERIFYCACHE)
+    except IOError:
+        return {}
 
 
-def verify_ssl_ca(crt_file, ca_file):
-    # check_output raises CalledProcessError if exit code is != 0
-    subprocess.check_output(["/usr/bin/openssl", "verify",
-                             "-CAfile", ca_file, crt_file],
-                            shell=False, stderr=subprocess.STDOUT)
+def save_verify_cache(cache):
+    # Keep the entries that stay valid longest. Failing to write the cache is
+    # not fatal, we will just verify again on the next run.
+    entries = sorted(cache.items(), key=lambda item: item[1], reverse=True)[:VERIFYCACHE_SIZE]
+    try:
+        dirname = os.path.dirname(common.rootpath(VERIFYCACHE))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0700)
+        common.write_file(VERIFYCACHE, json.dumps(dict(entries)), umask=0077)
+    except (IOError, OSError) as e:
+        logger.warning("Could not write SSL verification cache %s: %s", VERIFYCACHE, e)
 
 
 def disable_ssl():
     restart_apache = False
 
-    for f in ["/etc/ssl/private/hypernode.crt", "/etc/ssl/private/hypernode.ca", "/etc/apache2/sites-enabled/default-ssl"]:
+    for f in [CRTPATH, CAPATH, VHOSTPATH]:
         try:
             logger.info("Removing %s", f)
-            os.unlink(f)
+            os.unlink(common.rootpath(f))
             # if any of the files existed (and the unlink succeeded), we
             # need to restart apache after this
             restart_apache = True
@@ -123,5 +230,5 @@ def disable_ssl():
                 raise
 
     if restart_apache:
-        logging.info("Restarting apache2")
-        subprocess.call(["service", "apache2", "restart"])
\ No newline at end of file
+        logger.info("Scheduling restart of apache2")
+        services.schedule("apache2", "restart")
\ No newline at end of file
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+
+from hypernode.nodeconfig import common
+
+logger = logging.getLogger(__name__)
+
+STATEPATH = "/var/lib/hypernode/nodeconfig.state"
+
+# Service actions that have not succeeded yet, to be retried on the next run
+PENDINGPATH = "/var/lib/hypernode/nodeconfig.services"
+
+# Timings of the last RUNS_KEPT runs
+RUNSPATH = "/var/lib/hypernode/nodeconfig.runs"
+RUNS_KEPT = 20
+
+
+def load_state(filename=STATEPATH):
+    # A missing or unreadable state file simply means that every part will be
+    # applied again
+    try:
+        return common.get_config(filename)
+    except IOError as e:
+        logger.debug("Could not read state from %s: %s", filename, e)
+        return {}
+
+
+def save_state(state, filename=STATEPATH):
+    dirname = os.path.dirname(common.rootpath(filename))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, 0755)
+
+    common.write_file(filename, json.dumps(state, sort_keys=True, indent=2))
+
+
+def load_pending(filename=PENDINGPATH):
+    pending = load_state(filename)
+    if not isinstance(pending, dict):
+        return {}
+    return pending
+
+
+def save_pending(pending, filename=PENDINGPATH):
+    save_state(pending, filename)
+
+
+def record_run(run, filename=RUNSPATH):
+    # The run record is informational, failing to read or write it does not
+    # fail the run. A missing, empty or corrupt record is started anew.
+    try:
+        try:
+            runs = common.get_config(filename)
+        except IOError:
+            runs = []
+        if not isinstance(runs, list):
+            runs = []
+
+        save_state((runs + [run])[-RUNS_KEPT:], filename)
+    except Exception as e:
+        logger.warning("Could not write run record to %s: %s", filename, e)
+
+
+def template_hashes(templates):
+    # The templates are updated by cfn-init, independently of the nodeconfig.
+    # A missing template gets no hash, the part will fail on it anyway.
+    hashes = {}
+    for name in templates:
+        try:
+            with open(common.rootpath(os.path.join(common.TEMPLATEDIR, name)), "rb") as fd:
+                hashes[name] = hashlib.sha256(fd.read()).hexdigest()
+        except IOError:
+            hashes[name] = None
+    return hashes
+
+
+def config_digest(config, keynames, templates=()):
+    # Keys that are absent are left out, so "not configured" and "configured
+    # as null" yield different digests
+    sections = common.hash_config_sections(config)
+    hashes = dict((key, sections[key]) for key in keynames if key in config)
+    return hashlib.sha256(common.canonical_json({"config": hashes,
+                                                 "templates": template_hashes(templates)})).hexdigest()
+
+
+def part_digest(module, config):
+    # Parts that do not declare their keys have no digest
+    keynames = getattr(module, "CONFIG_KEYS", None)
+    if keynames is None:
+        return None
+    return config_digest(config, keynames, getattr(module, "TEMPLATES", ()))
+
+
+def part_changed(module, config, state):
+    # Parts without a digest are always applied
+    digest = part_digest(module, config)
+    return digest is None or state.get(module.__name__) != digest
+
+
+def mark_applied(module, config, state):
+    digest = part_digest(module, config)
+    if digest is not None:
+        state[module.__name__] = digest
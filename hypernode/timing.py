@@ -0,0 +1,109 @@
+import time
+import resource
+import threading
+import subprocess
+import logging
+
+from hypernode import metrics
+
+logger = logging.getLogger(__name__)
+
+# Not defined by the resource module of Python 2, this is the Linux value
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", 1)
+
+_local = threading.local()
+
+
+def thread_cpu():
+    # Parts run concurrently, so we want the CPU time of this thread only
+    try:
+        usage = resource.getrusage(RUSAGE_THREAD)
+    except (ValueError, resource.error):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def current():
+    # The innermost timer of this thread, or None
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+class Timer(object):
+    """
+    Measures the wall clock time of a block, the CPU time of the thread
+    running it and the CPU time of the subprocesses started through call()
+    within it.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall = None
+        self.cpu = None
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @property
+    def children(self):
+        with self._lock:
+            return sum(entry["children"] for entry in self.calls)
+
+    def add_call(self, entry):
+        with self._lock:
+            self.calls.append(entry)
+
+    def __enter__(self):
+        _stack().append(self)
+        self._start = time.time()
+        self._cpu = thread_cpu()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.time() - self._start
+        self.cpu = thread_cpu() - self._cpu
+        _stack().remove(self)
+        metrics.record("timing.seconds", self.wall, timer=self.name)
+
+    def as_dict(self):
+        return {"name": self.name,
+                "wall": round(self.wall, 3),
+                "cpu": round(self.cpu, 3),
+                "children": round(self.children, 3),
+                "calls": list(self.calls)}
+
+
+def call(args, timer=None, **kwargs):
+    """
+    subprocess.call that adds the duration of the command to timer, or to
+    the current timer of this thread.
+    """
+    if timer is None:
+        timer = current()
+
+    # The kernel only accounts children in bulk when they are reaped, so
+    # commands that run at the same time in other threads may be counted
+    # here as well
+    start = time.time()
+    children = children_cpu()
+    ret = subprocess.call(args, **kwargs)
+    wall = time.time() - start
+
+    entry = {"command": " ".join(args),
+             "returncode": ret,
+             "wall": round(wall, 3),
+             "children": round(children_cpu() - children, 3)}
+    if timer is not None:
+        timer.add_call(entry)
+    metrics.record("subprocess.seconds", wall, command=args[0])
+
+    return ret
@@ -4,7 +4,7 @@ setup(
     name='hypernode-nodescripts',
     version='0.1',
     packages=['hypernode', 'hypernode.healthcheck', 'hypernode.nodeconfig'],
-    scripts=['bin/check_mailout', 'bin/hypernode-apply-nodeconfig', 'bin/hypernode-wait-for-appvol'],
+    scripts=['bin/check_mailout', 'bin/hypernode-authorized-keys', 'bin/hypernode-maillog-lookup', 'bin/hypernode-apply-nodeconfig', 'bin/hypernode-nodeconfig-daemon', 'bin/hypernode-render-nodeconfig', 'bin/hypernode-wait-for-appvol'],
     url='https://github.com/hypernode/nodescripts.git',
     license='',
     author='Allard Hoeve',
@@ -0,0 +1,190 @@
+import os
+import sys
+import base64
+import struct
+import time
+import shutil
+import tempfile
+import unittest
+
+from OpenSSL import crypto
+
+from hypernode.nodeconfig import common, hostname, runner
+
+# Maximum time in seconds that applying a config may take, and the number of
+# hostnames and public keys of a large config. Can be overridden for slow
+# build machines or to benchmark other sizes.
+APPLY_BUDGET = float(os.environ.get("HYPERNODE_APPLY_BUDGET", "5"))
+LARGE_SIZE = int(os.environ.get("HYPERNODE_BENCHMARK_SIZE", "5000"))
+
+# Seconds that every fake command takes
+LATENCY = float(os.environ.get("HYPERNODE_BENCHMARK_LATENCY", "0.05"))
+
+SIZES = [("small", 10), ("large", LARGE_SIZE)]
+
+# The commands the parts call, replaced by scripts that only take time
+FAKE_COMMANDS = ["service", "php5enmod", "php5-fpm"]
+
+FAKE_COMMAND = """#!/bin/sh
+sleep %s
+"""
+
+TEMPLATES = {
+    "03.hostname.hosts": "127.0.0.1 localhost\n"
+                         "{% for hostname in hostnames %}127.0.1.1 {{ hostname }} {{ app_name }}\n{% endfor %}",
+    "20.phpini": "{% for key, value in options.items %}{{ key }} = {{ value }}\n{% endfor %}"
+                 "{% for extension in extensions %}extension={{ extension }}.so\n{% endfor %}",
+    "05.ssl.default-ssl-vhost": "<VirtualHost *:443>\n"
+                                "  ServerName {{ servername }}\n"
+                                "  SSLCertificateFile {{ crtpath }}\n"
+                                "{% if capath %}  SSLCACertificateFile {{ capath }}\n{% endif %}"
+                                "</VirtualHost>\n",
+}
+
+DIRECTORIES = ["etc/hypernode/templates", "etc/php5/mods-available", "etc/apache2/sites-enabled",
+               "etc/ssl/private", "home/user"]
+
+_certificate = None
+
+
+def make_certificate():
+    # Generating a key is slow, so all configs share the same certificate
+    global _certificate
+    if _certificate is None:
+        key = crypto.PKey()
+        key.generate_key(crypto.TYPE_RSA, 2048)
+
+        crt = crypto.X509()
+        crt.get_subject().CN = "benchmark.hypernode.io"
+        crt.set_serial_number(1)
+        crt.gmtime_adj_notBefore(0)
+        crt.gmtime_adj_notAfter(86400)
+        crt.set_issuer(crt.get_subject())
+        crt.set_pubkey(key)
+        crt.sign(key, "sha256")
+
+        _certificate = (crypto.dump_certificate(crypto.FILETYPE_PEM, crt),
+                        crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+    return _certificate
+
+
+def make_key(i):
+    # A key blob of the right form, the key material itself does not matter
+    return base64.b64encode(struct.pack(">I", 7) + "ssh-rsa" + struct.pack(">I", i) * 64)
+
+
+def make_config(size):
+    crt, key = make_certificate()
+    return common.NodeConfig({
+        "app_name": "benchmark",
+        "hostnames": ["host%d.benchmark.hypernode.io" % i for i in range(size)],
+        "public_keys": ["ssh-rsa %s user%d@benchmark" % (make_key(i), i) for i in range(size)],
+        "php_options": {"options": dict(("option%d" % i, i) for i in range(min(size, 100))),
+                        "extensions": ["ioncube", "xdebug"]},
+        "ssl_common_name": "benchmark.hypernode.io",
+        "ssl_certificate": crt,
+        "ssl_body": key,
+        "ssl_key_chain": "",
+    })
+
+
+class Sandbox(object):
+    """
+    A temporary filesystem root for the parts to write to, with fake
+    commands on the PATH. Setting the hostname is left out, as that would
+    rename the machine running the benchmark.
+    """
+    def __init__(self, latency=LATENCY):
+        self.root = tempfile.mkdtemp(prefix="hypernode-benchmark-")
+        for directory in DIRECTORIES + ["bin"]:
+            os.makedirs(os.path.join(self.root, directory))
+
+        for name, content in TEMPLATES.items():
+            with open(os.path.join(self.root, "etc/hypernode/templates", name), "w") as fd:
+                fd.write(content)
+
+        for name in FAKE_COMMANDS:
+            path = os.path.join(self.root, "bin", name)
+            with open(path, "w") as fd:
+                fd.write(FAKE_COMMAND % latency)
+            os.chmod(path, 0755)
+
+        self.oldroot = common.ROOT
+        self.oldpath = os.environ["PATH"]
+        self.oldsethostname = hostname.sethostname
+        common.ROOT = self.root
+        hostname.sethostname = lambda name: None
+        os.environ["PATH"] = "%s:%s" % (os.path.join(self.root, "bin"), self.oldpath)
+
+    def path(self, path):
+        return common.rootpath(path)
+
+    def close(self):
+        common.ROOT = self.oldroot
+        os.environ["PATH"] = self.oldpath
+        hostname.sethostname = self.oldsethostname
+        shutil.rmtree(self.root)
+
+
+def apply_config(config, force=False):
+    # The apply of hypernode-apply-nodeconfig, without the callbacks
+    timings = []
+    start = time.time()
+    runner.run_and_restart(runner.RUNPARTS, config, force=force, timings=timings)
+    return time.time() - start, timings
+
+
+class TestApply(unittest.TestCase):
+
+    def setUp(self):
+        # The pubkeys part hands .ssh to the user, which only root can do
+        if os.geteuid() != 0:
+            raise unittest.SkipTest("The apply benchmark needs to run as root")
+
+        self.sandbox = Sandbox()
+        self.addCleanup(self.sandbox.close)
+
+    def assertWithinBudget(self, seconds, what):
+        self.assertLess(seconds, APPLY_BUDGET,
+                        "Applying %s took %.3fs, budget is %.3fs" % (what, seconds, APPLY_BUDGET))
+
+    def test_small_config_applies_within_budget(self):
+        seconds, timings = apply_config(make_config(10))
+        self.assertWithinBudget(seconds, "a small config")
+
+    def test_large_config_applies_within_budget(self):
+        seconds, timings = apply_config(make_config(LARGE_SIZE))
+        self.assertWithinBudget(seconds, "a config of size %d" % LARGE_SIZE)
+
+        with open(self.sandbox.path("/home/user/.ssh/authorized_keys")) as fd:
+            self.assertEqual(fd.read().count("ssh-rsa"), LARGE_SIZE)
+        self.assertEqual(sorted(timer.name for timer in timings),
+                         sorted([part.__name__ for part in runner.RUNPARTS] + ["services"]))
+
+    def test_unchanged_large_config_is_skipped_within_budget(self):
+        config = make_config(LARGE_SIZE)
+        apply_config(config)
+
+        seconds, timings = apply_config(make_config(LARGE_SIZE))
+        self.assertWithinBudget(seconds, "an unchanged config of size %d" % LARGE_SIZE)
+        self.assertEqual([timer.name for timer in timings], ["services"])
+
+
+def report(out=sys.stdout):
+    # Per-part timings of a first and a repeated apply of every config size
+    for name, size in SIZES:
+        sandbox = Sandbox()
+        try:
+            config = make_config(size)
+            for run in ("first", "unchanged"):
+                seconds, timings = apply_config(config)
+                out.write("%s config (%d), %s apply: %.3fs\n" % (name, size, run, seconds))
+                for timer in timings:
+                    out.write("  %-35s %8.3fs wall %8.3fs cpu %8.3fs children\n" %
+                              (timer.name, timer.wall, timer.cpu, timer.children))
+        finally:
+            sandbox.close()
+
+
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,69 @@
+import ast
+import os
+import subprocess
+import sys
+import unittest
+
+BINDIR = os.path.join(os.path.dirname(__file__), "..", "..", "bin")
+
+# Maximum time in seconds that the imports of an entry point may take. Can be
+# overridden for slow build machines.
+STARTUP_BUDGET = float(os.environ.get("HYPERNODE_STARTUP_BUDGET", "0.5"))
+
+# Number of times to measure every script, the fastest run counts
+RUNS = 3
+
+MEASURE = """
+import time
+start = time.time()
+exec compile(%r, %r, "exec")
+end = time.time()
+import sys
+print end - start, int("django" in sys.modules)
+"""
+
+
+def python_scripts():
+    for name in sorted(os.listdir(BINDIR)):
+        path = os.path.join(BINDIR, name)
+        with open(path) as fd:
+            if "python" in fd.readline():
+                yield path
+
+
+def import_statements(path):
+    # Only the top-level imports of a script determine its startup time; the
+    # rest of the script does the actual work
+    with open(path) as fd:
+        tree = ast.parse(fd.read(), path)
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join("import %s" % alias.name if isinstance(node, ast.Import) else
+                     "from %s import %s" % (node.module, alias.name)
+                     for node in imports for alias in node.names)
+
+
+def measure_imports(path):
+    code = MEASURE % (import_statements(path), path)
+    runs = []
+    for i in range(RUNS):
+        output = subprocess.check_output([sys.executable, "-c", code])
+        seconds, django = output.split()
+        runs.append((float(seconds), django == "1"))
+    return min(runs)
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_scripts_import_within_budget(self):
+        for path in python_scripts():
+            seconds, django = measure_imports(path)
+            self.assertLess(seconds, STARTUP_BUDGET,
+                            "Importing %s took %.3fs, budget is %.3fs" % (os.path.basename(path), seconds, STARTUP_BUDGET))
+
+    def test_check_mailout_does_not_import_django(self):
+        seconds, django = measure_imports(os.path.join(BINDIR, "check_mailout"))
+        self.assertFalse(django)
+
+    def test_apply_nodeconfig_does_not_import_django_before_rendering(self):
+        seconds, django = measure_imports(os.path.join(BINDIR, "hypernode-apply-nodeconfig"))
+        self.assertFalse(django)
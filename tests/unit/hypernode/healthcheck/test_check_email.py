@@ -1,5 +1,6 @@
 import tests.unit
-from hypernode.healthcheck.mailout import send_mail, check_delivery, raise_sos
+from hypernode.healthcheck.mailout import send_mail, send_mails, check_delivery, wait_for_delivery, wait_for_deliveries, summarize_latencies, parse_delays, Delays, raise_sos
+import hypernode.metrics
 from smtplib import SMTPConnectError, SMTPSenderRefused, SMTPRecipientsRefused, SMTPDataError
 import mock
 import socket
@@ -63,6 +64,24 @@ class TestSendmail(tests.unit.BaseTestCase):
         queueid = send_mail(**self.send_mail_arguments)
         self.assertEqual(queueid, "8E220500567")
 
+    def test_send_mails_sends_all_messages_over_one_connection(self):
+        self.mock_smtp.data.side_effect = [(250, "2.0.0 Ok: queued as 8E220500567"),
+                                           (250, "2.0.0 Ok: queued as 8E220500568"),
+                                           (250, "2.0.0 Ok: queued as 8E220500569")]
+        self.set_up_patch('time.time', mock.Mock(side_effect=[1.0, 2.0, 3.0]))
+
+        queued = send_mails(3, **self.send_mail_arguments)
+
+        self.assertEqual(self.msc.call_count, 1)
+        self.assertEqual(self.mock_smtp.data.call_count, 3)
+        self.mock_smtp.quit.assert_called_once_with()
+        self.assertEqual(queued.items(), [("8E220500567", 1.0), ("8E220500568", 2.0), ("8E220500569", 3.0)])
+
+    def test_send_mails_raises_exception_when_a_message_is_refused(self):
+        self.mock_smtp.data.side_effect = [(250, "2.0.0 Ok: queued as 8E220500567"), (0, "not ok")]
+        with self.assertRaises(SMTPDataError):
+            send_mails(2, **self.send_mail_arguments)
+
 
 class TestCheckDelivery(tests.unit.BaseTestCase):
 
@@ -89,6 +108,75 @@ class TestCheckDelivery(tests.unit.BaseTestCase):
         self.assertTrue(check_delivery("E8313500567", self.sample_log.split("\n")))
         pass
 
+    def test_wait_for_delivery_returns_latency_when_delivery_is_seen(self):
+        lines = [line + "\n" for line in self.sample_log.split("\n")]
+        mock_follow = self.set_up_patch('hypernode.healthcheck.maillog.follow', mock.Mock(return_value=iter(lines)))
+        mock_time = self.set_up_patch('time.time', mock.Mock(side_effect=[100.0] + [101.5] * 10))
+
+        result = wait_for_delivery("E8313500567", "logfile", deadline=5)
+
+        mock_follow.assert_called_once_with("logfile", 5)
+        self.assertTrue(result.delivered)
+        self.assertEqual(result.latency, 1.5)
+        self.assertEqual(result.delays, Delays(0.16, 0.09, 0.0, 0.05, 0.01))
+
+    def test_wait_for_delivery_returns_not_delivered_when_deadline_passes(self):
+        self.set_up_patch('hypernode.healthcheck.maillog.follow', mock.Mock(return_value=iter(["other line\n"])))
+        result = wait_for_delivery("E8313500567", "logfile")
+        self.assertFalse(result.delivered)
+        self.assertIsNone(result.latency)
+
+    def test_wait_for_delivery_croaks_if_no_messageid(self):
+        with self.assertRaises(ValueError):
+            wait_for_delivery(None, "logfile")
+
+    def test_wait_for_deliveries_returns_latency_of_each_delivered_message(self):
+        lines = ["Jan 11 10:39:14 allard postfix/smtp[2100]: %s: to=<testrecipient@hypernode.com>, "
+                 "status=sent (250 2.0.0 Ok: queued as 18E578E802)\n" % queueid
+                 for queueid in ("AAAA", "BBBB", "AAAA", "DDDD")]
+        self.set_up_patch('hypernode.healthcheck.maillog.follow', mock.Mock(return_value=iter(lines)))
+        self.set_up_patch('time.time', mock.Mock(side_effect=[12.0] + [13.0] * 10))
+
+        results = wait_for_deliveries({"AAAA": 10.0, "BBBB": 10.5, "CCCC": 11.0}, "logfile")
+
+        self.assertEqual(sorted(results.keys()), ["AAAA", "BBBB"])
+        self.assertEqual(results["AAAA"].latency, 2.0)
+        self.assertEqual(results["BBBB"].latency, 2.5)
+
+    def test_wait_for_deliveries_stops_when_all_messages_are_delivered(self):
+        lines = iter(["Jan 11 10:39:14 allard postfix/smtp[2100]: AAAA: status=sent (250 2.0.0 Ok: queued as 18E578E802)\n",
+                      "other line\n"])
+        self.set_up_patch('hypernode.healthcheck.maillog.follow', mock.Mock(return_value=lines))
+
+        wait_for_deliveries({"AAAA": 10.0}, "logfile")
+
+        self.assertEqual(list(lines), ["other line\n"])
+
+    def test_wait_for_deliveries_records_postfix_delays_as_metrics(self):
+        hypernode.metrics.reset()
+        self.addCleanup(hypernode.metrics.reset)
+        lines = [line + "\n" for line in self.sample_log.split("\n")]
+        self.set_up_patch('hypernode.healthcheck.maillog.follow', mock.Mock(return_value=iter(lines)))
+
+        wait_for_deliveries({"E8313500567": 10.0}, "logfile")
+
+        stages = dict((m[2]["stage"], m[1]) for m in hypernode.metrics.get("mailout.delay.seconds"))
+        self.assertEqual(stages, {"total": 0.16, "before_qmgr": 0.09, "in_qmgr": 0.0, "connect": 0.05, "transmit": 0.01})
+
+    def test_parse_delays_returns_delay_per_stage(self):
+        delays = parse_delays(self.sample_log.split("\n")[6])
+        self.assertEqual(delays, (0.16, 0.09, 0.0, 0.05, 0.01))
+        self.assertEqual(delays.connect, 0.05)
+
+    def test_parse_delays_returns_none_without_delays(self):
+        self.assertIsNone(parse_delays(self.sample_log.split("\n")[1]))
+
+    def test_summarize_latencies_returns_percentiles_and_max(self):
+        summary = summarize_latencies([float(i) for i in range(1, 21)])
+        self.assertEqual(summary, (10.0, 19.0, 20.0))
+        self.assertEqual(summarize_latencies([3.0]), (3.0, 3.0, 3.0))
+        self.assertIsNone(summarize_latencies([]))
+
 
 class TestRaiseSOS(tests.unit.BaseTestCase):
 
@@ -99,13 +187,13 @@ class TestRaiseSOS(tests.unit.BaseTestCase):
         get_deployment_config = self.set_up_patch('hypernode.nodeconfig.common.get_config')
         get_deployment_config.return_value = {'sos_url': 'my_url'}
 
-        mock_post = self.set_up_patch('requests.post')
+        mock_post = self.set_up_patch('hypernode.httpclient.post')
         data = {'message': "Help!"}
 
         ret = raise_sos("Help!")
 
         assert get_deployment_config.called
-        mock_post.assert_called_once_with('my_url', data=data)
+        mock_post.assert_called_once_with('my_url', data=data, idempotent=False)
 
     def test_raise_sos_raises_keyerror_if_sos_url_not_found(self):
         get_deployment_config = self.set_up_patch('hypernode.nodeconfig.common.get_config')
@@ -117,7 +205,7 @@ class TestRaiseSOS(tests.unit.BaseTestCase):
         get_deployment_config = self.set_up_patch('hypernode.nodeconfig.common.get_config')
         get_deployment_config.return_value = {'sos_url': 'my_url'}
 
-        mock_post = self.set_up_patch('requests.post')
+        mock_post = self.set_up_patch('hypernode.httpclient.post')
         mock_post.return_value.status_code = 200
 
         ret = raise_sos("Help!")
@@ -128,7 +216,7 @@ class TestRaiseSOS(tests.unit.BaseTestCase):
         get_deployment_config = self.set_up_patch('hypernode.nodeconfig.common.get_config')
         get_deployment_config.return_value = {'sos_url': 'my_url'}
 
-        mock_post = self.set_up_patch('requests.post')
+        mock_post = self.set_up_patch('hypernode.httpclient.post')
         mock_post.return_value.status_code = 403
 
         ret = raise_sos("Help!")
@@ -0,0 +1,132 @@
+import os
+import time
+import gzip
+import shutil
+import tempfile
+import threading
+import mock
+import tests.unit
+
+from hypernode.healthcheck import maillog
+
+
+class LogTestCase(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "mail.log")
+        self.append("old line\n")
+
+    def append(self, data, path=None):
+        with open(path or self.path, "a") as fd:
+            fd.write(data)
+
+    def rotate(self):
+        os.rename(self.path, self.path + ".1")
+
+    def open_reader(self, **kwargs):
+        reader = maillog.LogReader(self.path, **kwargs)
+        self.addCleanup(reader.close)
+        return reader
+
+
+class TestLogReader(LogTestCase):
+
+    def test_read_lines_starts_at_end_of_file(self):
+        reader = self.open_reader()
+        self.assertEqual(reader.read_lines(), [])
+        self.append("line 1\nline 2\n")
+        self.assertEqual(reader.read_lines(), ["line 1\n", "line 2\n"])
+
+    def test_read_lines_starts_at_beginning_if_requested(self):
+        reader = self.open_reader(fromend=False)
+        self.assertEqual(reader.read_lines(), ["old line\n"])
+
+    def test_read_lines_keeps_partial_lines_until_complete(self):
+        reader = self.open_reader()
+        self.append("half a ")
+        self.assertEqual(reader.read_lines(), [])
+        self.append("line\n")
+        self.assertEqual(reader.read_lines(), ["half a line\n"])
+
+    def test_read_lines_reads_old_file_to_end_after_rotation(self):
+        reader = self.open_reader()
+        self.append("before rotation\n")
+        self.rotate()
+        self.append("written to old file\n", self.path + ".1")
+        self.append("new file\n")
+
+        self.assertEqual(reader.read_lines(), ["before rotation\n", "written to old file\n", "new file\n"])
+        self.assertEqual(reader.rotations, 1)
+
+    def test_read_lines_waits_for_new_file_after_rotation(self):
+        reader = self.open_reader()
+        self.rotate()
+        self.assertEqual(reader.read_lines(), [])
+        self.append("new file\n")
+        self.assertEqual(reader.read_lines(), ["new file\n"])
+
+    def test_read_lines_starts_over_after_truncation(self):
+        reader = self.open_reader()
+        with open(self.path, "w") as fd:
+            fd.write("after\n")
+        self.assertEqual(reader.read_lines(), ["after\n"])
+
+    def test_read_lines_decompresses_gzipped_logs(self):
+        fd = gzip.open(self.path + ".1.gz", "wb")
+        fd.write("compressed 1\ncompressed 2\n")
+        fd.close()
+
+        reader = maillog.LogReader(self.path + ".1.gz", fromend=False)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.read_lines(), ["compressed 1\n", "compressed 2\n"])
+
+    def test_reader_refuses_to_start_at_end_of_gzipped_log(self):
+        fd = gzip.open(self.path + ".1.gz", "wb")
+        fd.write("compressed\n")
+        fd.close()
+
+        with self.assertRaises(ValueError):
+            maillog.LogReader(self.path + ".1.gz")
+
+    def test_iter_lines_streams_plain_and_gzipped_logs(self):
+        fd = gzip.open(self.path + ".1.gz", "wb")
+        fd.write("compressed\n")
+        fd.close()
+
+        self.assertEqual(list(maillog.iter_lines(self.path)), ["old line\n"])
+        self.assertEqual(list(maillog.iter_lines(self.path + ".1.gz")), ["compressed\n"])
+
+
+class TestFollow(LogTestCase):
+
+    def append_later(self, data, delay=0.2, rotate=False):
+        def append():
+            if rotate:
+                self.rotate()
+            self.append(data)
+
+        timer = threading.Timer(delay, append)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_follow_yields_lines_as_soon_as_they_are_written(self):
+        self.append_later("new line\n")
+        start = time.time()
+        self.assertEqual(next(maillog.follow(self.open_reader(), 5)), "new line\n")
+        self.assertLess(time.time() - start, 2)
+
+    def test_follow_continues_in_rotated_log(self):
+        self.append_later("new file\n", rotate=True)
+        self.assertEqual(next(maillog.follow(self.open_reader(), 5)), "new file\n")
+
+    def test_follow_stops_after_timeout(self):
+        start = time.time()
+        self.assertEqual(list(maillog.follow(self.open_reader(), 0.3)), [])
+        self.assertGreaterEqual(time.time() - start, 0.3)
+
+    def test_follow_polls_if_inotify_is_not_available(self):
+        self.setUpPatch('hypernode.inotify.Inotify', mock.Mock(side_effect=OSError(38, "")))
+        self.append_later("new line\n")
+        self.assertEqual(next(maillog.follow(self.open_reader(), 5, poll_interval=0.05)), "new line\n")
@@ -0,0 +1,185 @@
+import os
+import gzip
+import time
+import shutil
+import tempfile
+import tests.unit
+
+from hypernode.healthcheck import maillogindex
+
+CLEANUP = "Oct 18 10:00:00 host postfix/cleanup[100]: 8E220500567: message-id=<1@hypernode.com>\n"
+QMGR = "Oct 18 10:00:00 host postfix/qmgr[101]: 8E220500567: from=<sender@hypernode.com>, size=300, nrcpt=1 (queue active)\n"
+SMTP = ("Oct 18 10:00:02 host postfix/smtp[102]: 8E220500567: to=<recipient@hypernode.com>, "
+        "relay=mx.hypernode.com[1.2.3.4]:25, delay=2.1, delays=0.1/0/1.5/0.5, dsn=2.0.0, "
+        "status=sent (250 2.0.0 Ok: queued as 1A2B3C4D)\n")
+DEFERRED = ("Oct 18 10:05:00 host postfix/smtp[102]: 4B5C6D7E8F: to=<other@hypernode.com>, "
+            "relay=none, delay=30, delays=0/0/30/0, dsn=4.4.1, status=deferred (connect timed out)\n")
+BOUNCED = ("Oct 18 10:06:00 host postfix/smtp[102]: 4B5C6D7E8F: to=<other@hypernode.com>, "
+           "relay=mx.example.com[5.6.7.8]:25, delay=0.5, delays=0.1/0/0.2/0.2, dsn=5.1.1, "
+           "status=bounced (host mx.example.com[5.6.7.8] said: 550 5.1.1 <other@hypernode.com>: "
+           "Recipient address rejected: User unknown, see https://example.com/550 (in reply to RCPT TO command))\n")
+NOISE = "Oct 18 10:00:01 host postfix/smtpd[103]: connect from localhost[127.0.0.1]\n"
+
+
+class TestParseLine(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.now = time.mktime((2014, 10, 18, 12, 0, 0, 0, 0, -1))
+
+    def test_parse_line_returns_delivery_fields(self):
+        entry = maillogindex.parse_line(SMTP, self.now)
+        self.assertEqual(entry["queueid"], "8E220500567")
+        self.assertEqual(entry["recipient"], "recipient@hypernode.com")
+        self.assertEqual(entry["relay"], "mx.hypernode.com[1.2.3.4]:25")
+        self.assertEqual(entry["delay"], 2.1)
+        self.assertEqual(entry["delays"], "0.1/0/1.5/0.5")
+        self.assertEqual(entry["dsn"], "2.0.0")
+        self.assertEqual(entry["status"], "sent")
+        self.assertEqual(entry["response"], "250 2.0.0 Ok: queued as 1A2B3C4D")
+        self.assertEqual(entry["timestamp"], int(time.mktime((2014, 10, 18, 10, 0, 2, 0, 0, -1))))
+
+    def test_parse_line_returns_whole_response_containing_commas(self):
+        entry = maillogindex.parse_line(BOUNCED, self.now)
+        self.assertEqual(entry["status"], "bounced")
+        self.assertEqual(entry["response"], "host mx.example.com[5.6.7.8] said: 550 5.1.1 <other@hypernode.com>: "
+                                            "Recipient address rejected: User unknown, see https://example.com/550 "
+                                            "(in reply to RCPT TO command)")
+        self.assertEqual(entry["dsn"], "5.1.1")
+
+    def test_parse_line_returns_sender(self):
+        self.assertEqual(maillogindex.parse_line(QMGR, self.now)["sender"], "sender@hypernode.com")
+
+    def test_parse_line_returns_none_for_lines_without_queue_id(self):
+        self.assertIsNone(maillogindex.parse_line(NOISE, self.now))
+
+    def test_parse_timestamp_uses_previous_year_for_dates_in_the_future(self):
+        now = time.mktime((2015, 1, 1, 0, 5, 0, 0, 0, -1))
+        self.assertEqual(maillogindex.parse_timestamp("Dec 31 23:59:00", now),
+                         int(time.mktime((2014, 12, 31, 23, 59, 0, 0, 0, -1))))
+
+
+class TestMailLogIndex(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.logpath = os.path.join(self.tmpdir, "mail.log")
+        self.append(CLEANUP + QMGR)
+
+        self.index = maillogindex.MailLogIndex(os.path.join(self.tmpdir, "index", "maillog.sqlite"))
+        self.addCleanup(self.index.close)
+
+    def append(self, data, path=None):
+        with open(path or self.logpath, "a") as fd:
+            fd.write(data)
+
+    def test_update_indexes_messages_by_queue_id(self):
+        self.append(SMTP + DEFERRED)
+        self.assertEqual(self.index.update(self.logpath), 4)
+
+        entry = self.index.lookup("8E220500567")
+        self.assertEqual(entry["sender"], "sender@hypernode.com")
+        self.assertEqual(entry["status"], "sent")
+        self.assertLess(entry["first_seen"], entry["last_seen"])
+        self.assertEqual(self.index.lookup("4B5C6D7E8F")["status"], "deferred")
+        self.assertIsNone(self.index.lookup("000000"))
+
+    def test_update_replaces_status_of_deferred_message_that_bounced(self):
+        self.append(DEFERRED + BOUNCED)
+        self.index.update(self.logpath)
+
+        entry = self.index.lookup("4B5C6D7E8F")
+        self.assertEqual(entry["status"], "bounced")
+        self.assertIn("User unknown, see", entry["response"])
+
+    def test_update_only_reads_new_lines(self):
+        self.index.update(self.logpath)
+        self.assertEqual(self.index.update(self.logpath), 0)
+
+        self.append(SMTP)
+        self.assertEqual(self.index.update(self.logpath), 1)
+        self.assertEqual(self.index.lookup("8E220500567")["status"], "sent")
+
+    def test_update_stores_checkpoint_of_last_line(self):
+        self.index.update(self.logpath)
+        checkpoint = self.index.get_checkpoint(self.logpath)
+        self.assertEqual(checkpoint.inode, os.stat(self.logpath).st_ino)
+        self.assertEqual(checkpoint.offset, len(CLEANUP + QMGR))
+        self.assertEqual(checkpoint.linehash, maillogindex.hash_line(QMGR))
+
+    def test_update_leaves_incomplete_lines_for_next_update(self):
+        self.append(SMTP[:40])
+        self.assertEqual(self.index.update(self.logpath), 2)
+        self.append(SMTP[40:])
+        self.assertEqual(self.index.update(self.logpath), 1)
+        self.assertEqual(self.index.lookup("8E220500567")["status"], "sent")
+
+    def test_update_continues_in_rotated_log(self):
+        self.index.update(self.logpath)
+        self.append(SMTP)
+        os.rename(self.logpath, self.logpath + ".1")
+        self.append(DEFERRED)
+
+        self.assertEqual(self.index.update(self.logpath), 2)
+        self.assertEqual(self.index.lookup("8E220500567")["status"], "sent")
+        self.assertEqual(self.index.lookup("4B5C6D7E8F")["status"], "deferred")
+
+    def compress(self, path, target):
+        with open(path, "rb") as src:
+            dst = gzip.open(target, "wb")
+            dst.write(src.read())
+            dst.close()
+        os.unlink(path)
+
+    def test_update_continues_in_compressed_rotated_log(self):
+        self.index.update(self.logpath)
+        self.append(SMTP)
+        os.rename(self.logpath, self.logpath + ".1")
+        self.compress(self.logpath + ".1", self.logpath + ".1.gz")
+        self.append(DEFERRED)
+
+        self.assertEqual(self.index.update(self.logpath), 2)
+        self.assertEqual(self.index.lookup("8E220500567")["status"], "sent")
+        self.assertEqual(self.index.lookup("4B5C6D7E8F")["status"], "deferred")
+
+    def test_update_continues_in_log_compressed_on_next_rotation(self):
+        self.index.update(self.logpath)
+        self.append(SMTP)
+        os.rename(self.logpath, self.logpath + ".1")
+        self.append(NOISE)
+        # delaycompress: the old .1 is compressed to .2.gz when .1 is replaced
+        self.compress(self.logpath + ".1", self.logpath + ".2.gz")
+        os.rename(self.logpath, self.logpath + ".1")
+        self.append(DEFERRED)
+
+        self.assertEqual(self.index.update(self.logpath), 3)
+        self.assertEqual(self.index.lookup("8E220500567")["status"], "sent")
+        self.assertEqual(self.index.lookup("4B5C6D7E8F")["status"], "deferred")
+
+    def test_update_ignores_compressed_log_that_does_not_match_checkpoint(self):
+        self.index.update(self.logpath)
+        os.rename(self.logpath, self.logpath + ".1")
+        self.append(NOISE, self.logpath + ".1")
+        with open(self.logpath + ".1", "r+") as fd:
+            fd.seek(len(CLEANUP))
+            fd.write("X")
+        self.compress(self.logpath + ".1", self.logpath + ".1.gz")
+        self.append(DEFERRED)
+
+        self.assertEqual(self.index.update(self.logpath), 1)
+
+    def test_update_starts_over_if_log_was_rewritten(self):
+        self.index.update(self.logpath)
+        with open(self.logpath, "w") as fd:
+            fd.write(NOISE + DEFERRED)
+
+        self.assertEqual(self.index.update(self.logpath), 2)
+        self.assertEqual(self.index.lookup("4B5C6D7E8F")["status"], "deferred")
+
+    def test_checkpoint_survives_reopening_the_index(self):
+        self.index.update(self.logpath)
+        self.index.close()
+
+        self.index = maillogindex.MailLogIndex(os.path.join(self.tmpdir, "index", "maillog.sqlite"))
+        self.assertEqual(self.index.update(self.logpath), 0)
+        self.assertEqual(self.index.lookup("8E220500567")["sender"], "sender@hypernode.com")
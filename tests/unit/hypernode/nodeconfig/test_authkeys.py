@@ -1,16 +1,29 @@
+import json
+import base64
+import struct
+
 import mock
 import tests.unit
 
 import hypernode.nodeconfig.pubkeys as pubkeys
 
 
+def make_key(keytype, payload):
+    return base64.b64encode(struct.pack(">I", len(keytype)) + keytype + payload)
+
+
+HENK = "ssh-rsa %s henk" % make_key("ssh-rsa", "henk")
+INGRID = "ssh-rsa %s ingrid" % make_key("ssh-rsa", "ingrid")
+
+
 class TestSetup(tests.unit.BaseTestCase):
 
     def setUp(self):
-        self.fixture = {"public_keys": ["ssh-rsa henk", "ssh-rsa ingrid"], "other": "key"}
+        self.fixture = {"public_keys": [HENK, INGRID], "other": "key"}
 
         self.mock_call = self.setUpPatch('subprocess.call')
         self.mock_mkdir = self.setUpPatch('os.mkdir')
+        self.mock_makedirs = self.setUpPatch('os.makedirs')
         self.mock_chown = self.setUpPatch('os.chown')
 
         self.mock_checkvars = self.setUpPatch('hypernode.nodeconfig.common.check_vars')
@@ -47,5 +60,118 @@ class TestSetup(tests.unit.BaseTestCase):
 
     def test_apply_config_writes_pubkeys_to_authkey_file(self):
         pubkeys.apply_config(self.fixture)
-        contents = pubkeys.PREAMBLE + "ssh-rsa henk\n\nssh-rsa ingrid\n\n"
-        self.mock_writefile.assert_called_once_with(pubkeys.AUTHKEYS, contents, umask=0022)
\ No newline at end of file
+        keys = sorted([HENK, INGRID], key=lambda line: pubkeys.parse_key(line).fingerprint)
+        contents = pubkeys.PREAMBLE + "%s\n\n%s\n\n" % tuple(keys)
+        self.mock_writefile.assert_any_call(pubkeys.AUTHKEYS, contents, umask=0022)
+
+    def test_apply_config_writes_the_same_file_whatever_the_order_of_the_keys(self):
+        pubkeys.apply_config(self.fixture)
+        self.fixture["public_keys"].reverse()
+        pubkeys.apply_config(self.fixture)
+
+        written = [call[0][1] for call in self.mock_writefile.call_args_list if call[0][0] == pubkeys.AUTHKEYS]
+        self.assertEqual(len(written), 2)
+        self.assertEqual(written[0], written[1])
+
+    def test_apply_config_writes_the_key_index(self):
+        pubkeys.apply_config(self.fixture)
+
+        self.mock_writefile.assert_any_call(pubkeys.KEYINDEX, mock.ANY, umask=0022)
+        index = json.loads(self.mock_writefile.call_args_list[-1][0][1])
+        self.assertEqual(sorted(index), sorted(pubkeys.parse_key(line).fingerprint for line in [HENK, INGRID]))
+
+    def test_apply_config_does_not_fail_if_the_key_index_can_not_be_written(self):
+        self.mock_writefile.side_effect = [True, IOError("Permission denied")]
+        pubkeys.apply_config(self.fixture)
+
+
+class TestParse(tests.unit.BaseTestCase):
+
+    def test_parse_key_returns_the_parts_of_the_key(self):
+        key = pubkeys.parse_key(HENK)
+        self.assertEqual(key, pubkeys.PublicKey("", "ssh-rsa", make_key("ssh-rsa", "henk"), "henk"))
+
+    def test_parse_key_splits_off_options_with_quoted_spaces(self):
+        line = 'command="echo hello world",no-pty ' + HENK
+        key = pubkeys.parse_key(line)
+        self.assertEqual(key.options, 'command="echo hello world",no-pty')
+        self.assertEqual(key.keytype, "ssh-rsa")
+        self.assertEqual(key.comment, "henk")
+        self.assertEqual(key.line(), line)
+
+    def test_parse_key_accepts_keys_without_a_comment(self):
+        key = pubkeys.parse_key("ssh-rsa %s" % make_key("ssh-rsa", "henk"))
+        self.assertEqual(key.comment, "")
+
+    def test_parse_key_raises_value_error_for_invalid_keys(self):
+        self.assertRaises(ValueError, pubkeys.parse_key, "ssh-rsa henk")
+        self.assertRaises(ValueError, pubkeys.parse_key, "")
+
+    def test_parse_key_raises_value_error_if_the_key_is_of_another_type(self):
+        self.assertRaises(ValueError, pubkeys.parse_key, "ssh-dss %s henk" % make_key("ssh-rsa", "henk"))
+
+    def test_fingerprint_is_in_ssh_keygen_format(self):
+        key = "AAAAC3NzaC1lZDI1NTE5AAAAIFJoZKDKcFXMvqLuJX1POK3sFyl0uLTmDAc3+h9mn7xU"
+        self.assertEqual(pubkeys.fingerprint(key), "SHA256:iUoOKUVMrinKZeQ37013sLcDi6FBL4HPtJfhBmfYlVQ")
+
+    def test_parse_keys_skips_duplicate_keys(self):
+        duplicate = 'no-pty ' + HENK.replace("henk", "other comment")
+        keys = pubkeys.parse_keys([HENK, INGRID, duplicate])
+        self.assertEqual([key.comment for key in keys.values()], ["henk", "ingrid"])
+
+    def test_parse_keys_skips_invalid_keys(self):
+        mock_warning = self.setUpPatch('hypernode.nodeconfig.pubkeys.logger.warning')
+        keys = pubkeys.parse_keys(["ssh-rsa henk", INGRID])
+        self.assertEqual([key.comment for key in keys.values()], ["ingrid"])
+        self.assertEqual(mock_warning.call_count, 1)
+
+    def test_parse_keys_parses_every_line_of_an_entry(self):
+        keys = pubkeys.parse_keys([HENK + "\n" + INGRID + "\n"])
+        self.assertEqual([key.comment for key in keys.values()], ["henk", "ingrid"])
+
+    def test_render_indexes_every_line_of_an_entry(self):
+        files = pubkeys.render({"public_keys": [HENK + "\n" + INGRID, INGRID]})
+        index = json.loads(files[pubkeys.KEYINDEX])
+        self.assertEqual(sorted(entry["comment"] for entry in index.values()), ["henk", "ingrid"])
+        self.assertEqual(files[pubkeys.AUTHKEYS].count("ssh-rsa"), 2)
+
+
+class TestLookup(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.index = json.loads(pubkeys.render({"public_keys": ['no-pty ' + HENK, INGRID]})[pubkeys.KEYINDEX])
+
+    def test_lookup_returns_the_line_of_a_known_key(self):
+        line = pubkeys.lookup("user", "ssh-rsa", make_key("ssh-rsa", "henk"), self.index)
+        self.assertEqual(line, 'no-pty ' + HENK)
+
+    def test_lookup_returns_the_line_encoded_as_utf8(self):
+        index = json.loads(pubkeys.render({"public_keys": [HENK.replace("henk", u"j\xf6rg@laptop")]})[pubkeys.KEYINDEX])
+        line = pubkeys.lookup("user", "ssh-rsa", make_key("ssh-rsa", "henk"), index)
+        self.assertIsInstance(line, str)
+        self.assertEqual(line.decode("utf-8"), HENK.replace("henk", u"j\xf6rg@laptop"))
+
+    def test_lookup_returns_none_for_other_accounts(self):
+        mock_load = self.setUpPatch('hypernode.nodeconfig.pubkeys.load_index', mock.Mock(return_value=self.index))
+        for username in ["root", "nobody", "app", ""]:
+            self.assertIsNone(pubkeys.lookup(username, "ssh-rsa", make_key("ssh-rsa", "henk"), self.index))
+            self.assertIsNone(pubkeys.lookup(username, "ssh-rsa", make_key("ssh-rsa", "henk")))
+        self.assertFalse(mock_load.called)
+
+    def test_lookup_returns_none_for_unknown_keys(self):
+        self.assertIsNone(pubkeys.lookup("user", "ssh-rsa", make_key("ssh-rsa", "piet"), self.index))
+
+    def test_lookup_returns_none_if_the_type_does_not_match(self):
+        self.assertIsNone(pubkeys.lookup("user", "ssh-dss", make_key("ssh-rsa", "henk"), self.index))
+
+    def test_lookup_returns_none_for_garbage(self):
+        self.assertIsNone(pubkeys.lookup("user", "ssh-rsa", "not base64!", self.index))
+
+    def test_lookup_loads_the_index_if_none_given(self):
+        mock_load = self.setUpPatch('hypernode.nodeconfig.pubkeys.load_index', mock.Mock(return_value=self.index))
+        pubkeys.lookup("user", "ssh-rsa", make_key("ssh-rsa", "henk"))
+        mock_load.assert_called_once_with()
+
+    def test_load_index_returns_empty_index_if_there_is_none(self):
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(side_effect=IOError))
+        self.assertEqual(pubkeys.load_index(), {})
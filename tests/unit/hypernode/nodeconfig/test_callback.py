@@ -1,6 +1,9 @@
 import tests.unit
 import hypernode.nodeconfig.callback as callback
+from hypernode.nodeconfig import common
+import gzip
 import hashlib
+import StringIO
 import json
 import requests
 import mock
@@ -14,7 +17,7 @@ class TestCallBack(tests.unit.BaseTestCase):
 
         self.mock_response = mock.Mock()
         self.mock_response.status_code = 200
-        self.mock_post = self.setUpPatch('requests.post')
+        self.mock_post = self.setUpPatch('hypernode.httpclient.post')
         self.mock_post.return_value = self.mock_response
 
     ###
@@ -35,13 +38,19 @@ class TestCallBack(tests.unit.BaseTestCase):
 
     def test_call_success_posts_to_callback_url(self):
         callback.call_success(self.fixture)
-        postdata = {"applied_hash": callback.hash_deployment_config(self.fixture)}
+        postdata = {"applied_hash": callback.hash_deployment_config(self.fixture),
+                    "section_hashes": json.dumps(common.hash_config_sections(self.fixture),
+                                                 sort_keys=True, separators=(',', ':'))}
         self.mock_post.assert_called_once_with(
             self.fixture["callback_url"],
             data=postdata,
             headers={'User-Agent': 'nodeconfig/callback for appname1'},
             verify=True)
 
+    def test_call_success_sends_timings_as_json(self):
+        callback.call_success(self.fixture, timings={"wall": 1.5})
+        self.assertEqual(self.mock_post.call_args[1]["data"]["timings"], '{"wall":1.5}')
+
     def test_call_success_does_not_handle_connection_errors(self):
         self.mock_post.side_effect = requests.ConnectionError
         self.assertRaises(requests.ConnectionError, callback.call_success, self.fixture)
@@ -58,7 +67,7 @@ class TestCallBack(tests.unit.BaseTestCase):
         self.assertEquals(len(hash), 128)
 
     def test_hash_deployment_returns_correct_hash(self):
-        hash = hashlib.sha512(json.dumps(self.fixture)).hexdigest()
+        hash = hashlib.sha512(json.dumps(self.fixture, sort_keys=True, separators=(',', ':'))).hexdigest()
         self.assertEqual(hash, callback.hash_deployment_config(self.fixture))
 
     def test_call_success_checks_callback_url_var(self):
@@ -76,7 +85,9 @@ class TestCallBack(tests.unit.BaseTestCase):
 
     def test_call_success_posts_to_callback_url(self):
         callback.call_success(self.fixture)
-        postdata = {"applied_hash": callback.hash_deployment_config(self.fixture)}
+        postdata = {"applied_hash": callback.hash_deployment_config(self.fixture),
+                    "section_hashes": json.dumps(common.hash_config_sections(self.fixture),
+                                                 sort_keys=True, separators=(',', ':'))}
         self.mock_post.assert_called_once_with(
             self.fixture["callback_url"],
             data=postdata,
@@ -102,9 +113,21 @@ class TestCallBack(tests.unit.BaseTestCase):
         self.assertEquals(len(hash), 128)
 
     def test_hash_deployment_returns_correct_hash(self):
-        hash = hashlib.sha512(json.dumps(self.fixture)).hexdigest()
+        hash = hashlib.sha512(json.dumps(self.fixture, sort_keys=True, separators=(',', ':'))).hexdigest()
         self.assertEqual(hash, callback.hash_deployment_config(self.fixture))
 
+    def test_hash_deployment_config_does_not_depend_on_key_order(self):
+        reordered = json.loads('{"other": "value", "app_name": "appname1", "callback_url": "%s", '
+                               '"hostnames": ["hostname1", "hostname2"]}' % self.fixture["callback_url"])
+        self.assertEqual(callback.hash_deployment_config(self.fixture), callback.hash_deployment_config(reordered))
+
+    def test_hash_deployment_config_is_computed_once_per_loaded_config(self):
+        config = common.NodeConfig(self.fixture)
+        hash = callback.hash_deployment_config(config)
+        with mock.patch('hashlib.sha512') as mock_sha512:
+            self.assertEqual(hash, callback.hash_deployment_config(config))
+            self.assertFalse(mock_sha512.called)
+
     ###
     # Error callback
     ###
@@ -129,12 +152,38 @@ class TestCallBack(tests.unit.BaseTestCase):
         postdata = {"applied_hash": callback.hash_deployment_config(self.fixture),
                     "error": e,
                     "module": callback.__name__,
-                    "log": "\n".join(log)}
+                    "log_size": 5,
+                    "log_truncated": 0}
 
         self.mock_post.assert_called_once_with(self.fixture["callback_url"],
                                                data=postdata,
+                                               files={"log": ("log.gz", mock.ANY, "application/gzip")},
                                                headers={'User-Agent': 'nodeconfig/callback for appname1'},
                                                verify=True)
+        gzipped = self.mock_post.call_args[1]["files"]["log"][1]
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(gzipped)).read(), "a\nb\nc")
+
+    def test_call_error_sends_timings_as_json(self):
+        callback.call_error(self.fixture, callback, Exception(), [], timings={"failed": "a"})
+        self.assertEqual(self.mock_post.call_args[1]["data"]["timings"], '{"failed":"a"}')
+
+    def test_call_error_sends_truncated_log_if_too_large(self):
+        self.setUpPatch('hypernode.nodeconfig.callback.LOG_MAXBYTES', 100)
+        log = ["line %d" % i for i in range(1000)]
+        callback.call_error(self.fixture, callback, Exception(), log)
+
+        data = self.mock_post.call_args[1]["data"]
+        self.assertEqual(data["log_size"], len("\n".join(log)))
+        self.assertEqual(data["log_truncated"], 1)
+
+    def test_cap_log_returns_short_log_unchanged(self):
+        self.assertEqual(callback.cap_log("abc", 10, 2), ("abc", False))
+
+    def test_cap_log_keeps_head_and_tail_of_long_log(self):
+        capped, truncated = callback.cap_log("a" * 10 + "b" * 80 + "c" * 10, 30, 10)
+        self.assertTrue(truncated)
+        self.assertTrue(capped.startswith("a" * 10 + "\n[... 70 bytes truncated ...]\n"))
+        self.assertTrue(capped.endswith("b" * 10 + "c" * 10))
 
     def test_call_error_does_not_handle_connection_errors(self):
         self.mock_post.side_effect = requests.ConnectionError
@@ -1,15 +1,23 @@
 import sys
+import os
+import stat
+import shutil
+import tempfile
 import mock
 import tests.unit
 
-from hypernode.nodeconfig.common import get_config, check_vars, write_file, fill_template
+from hypernode.nodeconfig.common import get_config, check_vars, write_file, fill_template, fill_templates, get_template
+from hypernode.nodeconfig.common import NodeConfig, hash_config, hash_config_sections
 
 
 class TestSetup(tests.unit.BaseTestCase):
 
     def setUp(self):
         self.mock_open = self.setUpPatch('__builtin__.open', themock=mock.mock_open())
-        self.mock_umask = self.setUpPatch('os.umask')
+        self.mock_stat = self.setUpPatch('os.stat')
+        self.mock_stat.return_value.st_mtime = 1
+        self.mock_stat.return_value.st_size = 4
+        self.setUpPatch('hypernode.nodeconfig.common._templates', {})
 
     def test_get_config_throws_exception_on_non_existing_configfile(self):
         with mock.patch('__builtin__.open', mock.Mock(side_effect=IOError)) as mock_open:
@@ -26,6 +34,34 @@ class TestSetup(tests.unit.BaseTestCase):
             ret = get_config("non-exist")
             assert mock_open.called
             self.assertIsInstance(ret, dict)
+            self.assertIsInstance(ret, NodeConfig)
+
+    def test_hash_config_is_invalidated_when_config_changes(self):
+        config = NodeConfig({"a": 1})
+        hash = hash_config(config)
+        config["a"] = 2
+        self.assertNotEqual(hash, hash_config(config))
+        self.assertEqual(hash_config(config), hash_config({"a": 2}))
+
+    def test_hash_config_is_invalidated_by_every_mutating_method(self):
+        mutations = [lambda c: c.setdefault("b", 2),
+                     lambda c: c.pop("a"),
+                     lambda c: c.popitem(),
+                     lambda c: c.clear(),
+                     lambda c: c.update(a=2)]
+        for mutate in mutations:
+            config = NodeConfig({"a": 1})
+            hash_config(config)
+            hash_config_sections(config)
+            mutate(config)
+            self.assertEqual(hash_config(config), hash_config(dict(config)))
+            self.assertEqual(hash_config_sections(config), hash_config_sections(dict(config)))
+
+    def test_hash_config_sections_hashes_every_top_level_key(self):
+        sections = hash_config_sections(NodeConfig({"a": 1, "b": {"c": [1, 2]}}))
+        self.assertEqual(sorted(sections.keys()), ["a", "b"])
+        self.assertEqual(sections["b"], hash_config_sections({"b": {"c": [1, 2]}, "d": 3})["b"])
+        self.assertNotEqual(sections["a"], sections["b"])
 
     def test_check_vars_raises_exception_if_config_is_no_dict(self):
         self.assertRaises(ValueError, check_vars, "no-dict", ["a"])
@@ -44,36 +80,6 @@ class TestSetup(tests.unit.BaseTestCase):
         check_vars({"a": "b", "b": "c"}, ["a", "b"])
         check_vars({"a": None}, ["a"])
 
-    def test_write_file_sets_no_umask_if_none_supplied(self):
-        write_file("no-file", "data")
-
-        fd = self.mock_open()
-        fd.write.assert_called_once_with("data")
-        assert not self.mock_umask.called
-
-    def test_write_file_sets_supplied_umask_and_restores_afterwards(self):
-        with mock.patch('os.umask', mock.Mock(return_value=0022)) as mock_umask:
-            write_file("no-file", "data", umask=0077)
-
-            self.assertIs(len(mock_umask.mock_calls), 2)
-            self.assertEqual(mock_umask.mock_calls[0], mock.call(0077))
-            self.assertEqual(mock_umask.mock_calls[1], mock.call(0022))
-
-    def test_write_file_restores_umask_if_open_fails(self):
-        with mock.patch('__builtin__.open', mock.mock_open(mock=mock.Mock(side_effect=IOError))):
-            with mock.patch('os.umask', mock.Mock(return_value=0022)) as mock_umask:
-
-                self.assertRaises(IOError, write_file, "no-file", "data", umask=0077)
-                self.assertIs(len(mock_umask.mock_calls), 2)
-                self.assertEqual(mock_umask.mock_calls[0], mock.call(0077))
-                self.assertEqual(mock_umask.mock_calls[1], mock.call(0022))
-
-    def test_write_file_writes_given_data(self):
-        write_file("my-file", "my-data")
-        self.mock_open.assert_called_once_with("my-file", "w")
-        fd = self.mock_open()
-        fd.write.assert_called_once_with("my-data")
-
     def test_fill_template_opens_template_and_fills_in_variables(self):
         with mock.patch('__builtin__.open', mock.mock_open(read_data='henk')) as mock_open:
             with mock.patch('django.template.Template') as mock_template:
@@ -89,3 +95,123 @@ class TestSetup(tests.unit.BaseTestCase):
 
                     mock_template_instance.render.assert_called_once_with(mock_context_instance)
 
+    def test_get_template_reuses_parsed_template_if_file_unchanged(self):
+        with mock.patch('__builtin__.open', mock.mock_open(read_data='henk')) as mock_open:
+            with mock.patch('django.template.Template') as mock_template:
+                first = get_template("my-template")
+                second = get_template("my-template")
+
+                self.assertIs(first, second)
+                mock_open.assert_called_once_with("my-template", "r")
+                mock_template.assert_called_once_with("henk")
+
+    def test_get_template_reparses_template_if_file_changed(self):
+        with mock.patch('__builtin__.open', mock.mock_open(read_data='henk')) as mock_open:
+            with mock.patch('django.template.Template') as mock_template:
+                get_template("my-template")
+                self.mock_stat.return_value.st_mtime = 2
+                get_template("my-template")
+                self.mock_stat.return_value.st_size = 5
+                get_template("my-template")
+
+                self.assertEqual(mock_template.call_count, 3)
+
+    def test_get_template_raises_exception_if_template_does_not_exist(self):
+        self.mock_stat.side_effect = OSError(2, "")
+        self.assertRaises(OSError, get_template, "non-exist")
+
+    def test_fill_templates_renders_all_variables_against_one_template(self):
+        with mock.patch('__builtin__.open', mock.mock_open(read_data='{{ a }}')) as mock_open:
+            ret = fill_templates("my-template", [{"a": 1}, {"a": 2}, {}])
+
+            self.assertEqual(ret, ["1", "2", ""])
+            mock_open.assert_called_once_with("my-template", "r")
+
+
+class TestWriteFile(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, "my-file")
+
+    def read(self):
+        with open(self.filename) as fd:
+            return fd.read()
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.filename).st_mode)
+
+    def test_write_file_writes_given_data(self):
+        self.assertTrue(write_file(self.filename, "my-data"))
+        self.assertEqual(self.read(), "my-data")
+
+    def test_write_file_replaces_existing_data(self):
+        write_file(self.filename, "old-data-which-is-longer")
+        self.assertTrue(write_file(self.filename, "new-data"))
+        self.assertEqual(self.read(), "new-data")
+
+    def test_write_file_encodes_unicode_data_as_utf8(self):
+        write_file(self.filename, u"caf\xe9")
+        self.assertEqual(self.read(), "caf\xc3\xa9")
+
+    def test_write_file_does_not_write_unchanged_data(self):
+        write_file(self.filename, "my-data")
+        with mock.patch('os.rename') as mock_rename:
+            self.assertFalse(write_file(self.filename, "my-data"))
+            self.assertFalse(write_file(self.filename, u"my-data"))
+            self.assertFalse(mock_rename.called)
+
+    def test_write_file_writes_data_of_same_size(self):
+        write_file(self.filename, "my-data")
+        self.assertTrue(write_file(self.filename, "my-date"))
+        self.assertEqual(self.read(), "my-date")
+
+    def test_write_file_replaces_file_atomically(self):
+        write_file(self.filename, "old-data")
+        inode = os.stat(self.filename).st_ino
+        write_file(self.filename, "new-data")
+        self.assertNotEqual(os.stat(self.filename).st_ino, inode)
+
+    def test_write_file_leaves_no_tempfiles_behind(self):
+        write_file(self.filename, "my-data")
+        write_file(self.filename, "new-data")
+        self.assertEqual(os.listdir(self.tmpdir), ["my-file"])
+
+    def test_write_file_removes_tempfile_and_keeps_old_data_if_write_fails(self):
+        write_file(self.filename, "old-data")
+        with mock.patch('os.fsync', mock.Mock(side_effect=OSError(5, "I/O error"))):
+            self.assertRaises(OSError, write_file, self.filename, "new-data")
+        self.assertEqual(self.read(), "old-data")
+        self.assertEqual(os.listdir(self.tmpdir), ["my-file"])
+
+    def test_write_file_closes_tempfile_if_setting_mode_fails(self):
+        with mock.patch('os.fchmod', mock.Mock(side_effect=OSError(1, "Operation not permitted"))):
+            with mock.patch('os.fdopen', mock.Mock(wraps=os.fdopen)) as mock_fdopen:
+                self.assertRaises(OSError, write_file, self.filename, "data", umask=0022)
+        fd = mock_fdopen.call_args[0][0]
+        self.assertRaises(OSError, os.fstat, fd)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_write_file_sets_mode_from_supplied_umask(self):
+        write_file(self.filename, "data", umask=0077)
+        self.assertEqual(self.mode(), 0600)
+
+        write_file(self.filename, "other-data", umask=0022)
+        self.assertEqual(self.mode(), 0644)
+
+    def test_write_file_fixes_mode_of_unchanged_file(self):
+        write_file(self.filename, "data", umask=0022)
+        self.assertFalse(write_file(self.filename, "data", umask=0077))
+        self.assertEqual(self.mode(), 0600)
+
+    def test_write_file_keeps_mode_of_existing_file_if_no_umask_supplied(self):
+        write_file(self.filename, "data")
+        os.chmod(self.filename, 0640)
+        write_file(self.filename, "other-data")
+        self.assertEqual(self.mode(), 0640)
+
+    def test_write_file_does_not_change_process_umask(self):
+        with mock.patch('os.umask') as mock_umask:
+            write_file(self.filename, "data", umask=0077)
+            self.assertFalse(mock_umask.called)
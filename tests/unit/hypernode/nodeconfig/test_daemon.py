@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import threading
+import mock
+import tests.unit
+
+from hypernode import inotify
+import hypernode.nodeconfig.daemon as daemon
+
+
+class TestWatch(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "nodeconfig.json")
+        self.stop = threading.Event()
+        self.changed = threading.Event()
+        self.callback = mock.Mock(side_effect=lambda: self.changed.set())
+
+    def start_watching(self):
+        thread = threading.Thread(target=daemon.watch, args=(self.path, self.callback),
+                                  kwargs={"debounce": 0.1, "stop": self.stop})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.stop.set)
+        # Give the thread some time to set up its watch
+        threading.Event().wait(0.2)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.tmpdir, filename), "w") as fd:
+            fd.write(data)
+
+    def test_watch_calls_callback_once_for_burst_of_writes(self):
+        self.start_watching()
+        for i in range(5):
+            self.write("nodeconfig.json", "{}")
+
+        self.assertTrue(self.changed.wait(5))
+        threading.Event().wait(0.3)
+        self.assertEqual(self.callback.call_count, 1)
+
+    def test_watch_calls_callback_when_file_is_replaced(self):
+        self.start_watching()
+        self.write("nodeconfig.json.tmp", "{}")
+        os.rename(os.path.join(self.tmpdir, "nodeconfig.json.tmp"), self.path)
+        self.assertTrue(self.changed.wait(5))
+
+    def test_watch_ignores_other_files(self):
+        self.start_watching()
+        self.write("other.json", "{}")
+        self.assertFalse(self.changed.wait(0.5))
+
+    def test_is_relevant_treats_queue_overflow_as_change(self):
+        event = inotify.Event(-1, inotify.IN_Q_OVERFLOW, 0, "")
+        self.assertTrue(daemon.is_relevant([event], "nodeconfig.json"))
+
+
+class TestApplyNodeconfig(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.logbuffer = mock.Mock()
+        self.mock_getconfig = self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(return_value={"a": 1}))
+        self.mock_applyparts = self.setUpPatch('hypernode.nodeconfig.runner.apply_parts')
+        self.mock_flush = self.setUpPatch('hypernode.metrics.flush')
+
+    def test_apply_nodeconfig_applies_fresh_config(self):
+        daemon.apply_nodeconfig("my-config", self.logbuffer)
+        self.mock_getconfig.assert_called_once_with("my-config")
+        self.mock_applyparts.assert_called_once_with({"a": 1}, self.logbuffer, None)
+
+    def test_apply_nodeconfig_starts_with_empty_log_buffer(self):
+        daemon.apply_nodeconfig("my-config", self.logbuffer)
+        self.logbuffer.truncate.assert_called_once_with()
+
+    def test_apply_nodeconfig_does_not_raise_exceptions(self):
+        self.mock_getconfig.side_effect = IOError
+        daemon.apply_nodeconfig("my-config", self.logbuffer)
+        self.assertFalse(self.mock_applyparts.called)
+
+    def test_apply_nodeconfig_writes_metrics_after_every_apply(self):
+        daemon.apply_nodeconfig("my-config", self.logbuffer)
+        self.mock_getconfig.side_effect = IOError
+        daemon.apply_nodeconfig("my-config", self.logbuffer)
+        self.assertEqual(self.mock_flush.call_args_list, [mock.call("nodeconfig-daemon")] * 2)
+
+    def test_run_applies_config_before_watching(self):
+        mock_watch = self.setUpPatch('hypernode.nodeconfig.daemon.watch')
+        daemon.run("my-config", self.logbuffer)
+        self.assertTrue(self.mock_applyparts.called)
+        self.assertEqual(mock_watch.call_args[0][0], "my-config")
@@ -10,6 +10,9 @@ class TestSetup(tests.unit.BaseTestCase):
         self.fixture = {"hostnames": ["hostname1", "hostname2"], "app_name": "appname1", "other": "value"}
 
         self.mock_call = self.setUpPatch('subprocess.call')
+        self.mock_gethostname = self.setUpPatch('socket.gethostname', mock.Mock(return_value="oldname"))
+        self.mock_sethostname = self.setUpPatch('hypernode.nodeconfig.hostname.sethostname')
+        self.mock_schedule = self.setUpPatch('hypernode.nodeconfig.services.schedule')
 
         self.mock_checkvars = self.setUpPatch('hypernode.nodeconfig.common.check_vars')
         self.mock_writefile = self.setUpPatch('hypernode.nodeconfig.common.write_file')
@@ -40,10 +43,54 @@ class TestSetup(tests.unit.BaseTestCase):
 
         self.mock_writefile.assert_any_call("/etc/hosts", self.mock_template_contents)
 
-    def test_apply_config_calls_hostname_to_set_hostname(self):
+    def test_apply_config_sets_hostname_without_calling_hostname(self):
         hostname.apply_config(self.fixture)
-        self.mock_call.assert_any_call(["hostname", self.fixture["app_name"]])
+        self.mock_sethostname.assert_called_once_with(self.fixture["app_name"])
+        self.assertFalse(self.mock_call.called)
 
-    def test_apply_config_restarts_syslog(self):
+    def test_apply_config_does_not_set_hostname_if_unchanged(self):
+        self.mock_gethostname.return_value = self.fixture["app_name"]
         hostname.apply_config(self.fixture)
-        self.mock_call.assert_any_call(["service", "rsyslog", "restart"])
\ No newline at end of file
+        self.assertFalse(self.mock_sethostname.called)
+
+    def test_apply_config_does_not_handle_errors_setting_the_hostname(self):
+        self.mock_sethostname.side_effect = OSError(1, "Operation not permitted")
+        self.assertRaises(OSError, hostname.apply_config, self.fixture)
+
+    def test_apply_config_schedules_syslog_restart_if_hostname_changed(self):
+        hostname.apply_config(self.fixture)
+        self.mock_schedule.assert_called_once_with("rsyslog", "restart")
+
+    def test_apply_config_schedules_syslog_restart_if_only_hostname_changed(self):
+        self.mock_writefile.return_value = False
+        hostname.apply_config(self.fixture)
+        self.mock_schedule.assert_called_once_with("rsyslog", "restart")
+
+    def test_apply_config_schedules_syslog_reload_if_only_hosts_changed(self):
+        self.mock_gethostname.return_value = self.fixture["app_name"]
+        self.mock_writefile.side_effect = [False, True]
+        hostname.apply_config(self.fixture)
+        self.mock_schedule.assert_called_once_with("rsyslog", "reload")
+
+    def test_apply_config_does_not_restart_syslog_if_nothing_changed(self):
+        self.mock_gethostname.return_value = self.fixture["app_name"]
+        self.mock_writefile.return_value = False
+        hostname.apply_config(self.fixture)
+        self.assertFalse(self.mock_schedule.called)
+
+
+class TestSethostname(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.mock_cdll = self.setUpPatch('ctypes.CDLL')
+        self.mock_libc = self.mock_cdll.return_value
+        self.mock_libc.sethostname.return_value = 0
+
+    def test_sethostname_calls_sethostname_of_libc(self):
+        hostname.sethostname(u"appname1")
+        self.mock_libc.sethostname.assert_called_once_with("appname1", 8)
+
+    def test_sethostname_raises_oserror_if_it_fails(self):
+        self.mock_libc.sethostname.return_value = -1
+        self.setUpPatch('ctypes.get_errno', mock.Mock(return_value=1))
+        self.assertRaises(OSError, hostname.sethostname, "appname1")
@@ -1,4 +1,10 @@
 
+import os
+import shutil
+import signal
+import socket
+import tempfile
+
 import mock
 import tests.unit
 
@@ -11,6 +17,7 @@ class TestPHPIni(tests.unit.BaseTestCase):
         self.fixture = {"php_options": {"options": {"apc.stat": 1}, "extensions": ["ioncube"], "other": "value"}}
 
         self.mock_call = self.setUpPatch('subprocess.call')
+        self.mock_schedule = self.setUpPatch('hypernode.nodeconfig.services.schedule')
 
         self.mock_checkvars = self.setUpPatch('hypernode.nodeconfig.common.check_vars')
         self.mock_writefile = self.setUpPatch('hypernode.nodeconfig.common.write_file')
@@ -36,9 +43,129 @@ class TestPHPIni(tests.unit.BaseTestCase):
                                                        {"options": {"apc.stat": 1},
                                                         "extensions": {"ioncube": True}})
 
-    def test_apply_config_enables_hypernode_ini_restarts_phpfpm(self):
+    def test_apply_config_enables_hypernode_ini_schedules_phpfpm_reload(self):
+        phpini.apply_config(self.fixture)
+        self.mock_call.assert_called_once_with(["php5enmod", "hypernode/99"])
+        self.mock_schedule.assert_called_once_with("php5-fpm", "reload")
+
+    def test_apply_config_does_not_restart_phpfpm_if_ini_unchanged(self):
+        self.mock_writefile.return_value = False
         phpini.apply_config(self.fixture)
-        self.mock_call.assert_has_calls([
-            mock.call(["php5enmod", "hypernode/99"]),
-            mock.call(["service", "php5-fpm", "restart"])
-        ])
\ No newline at end of file
+        self.assertFalse(self.mock_call.called)
+        self.assertFalse(self.mock_schedule.called)
+
+
+class TestReloadFPM(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.mock_call = self.setUpPatch('subprocess.call', mock.Mock(return_value=0))
+        self.mock_kill = self.setUpPatch('os.kill')
+        self.mock_read_pid = self.setUpPatch('hypernode.nodeconfig.phpini.read_pid', mock.Mock(return_value=1234))
+        self.mock_pidfile_stat = self.setUpPatch('hypernode.nodeconfig.phpini.pidfile_stat',
+                                                 mock.Mock(return_value=(1, 10.0)))
+        self.mock_wait = self.setUpPatch('hypernode.nodeconfig.phpini.wait_until_ready',
+                                         mock.Mock(return_value=True))
+        self.mock_record = self.setUpPatch('hypernode.metrics.record')
+
+    def test_reload_fpm_is_registered_as_reload_of_phpfpm(self):
+        self.assertIs(phpini.services._handlers[("php5-fpm", "reload")], phpini.reload_fpm)
+
+    def test_reload_fpm_tests_the_configuration_first(self):
+        phpini.reload_fpm()
+        self.assertEqual(self.mock_call.call_args_list[0], mock.call(["php5-fpm", "-t"]))
+
+    def test_reload_fpm_does_not_touch_phpfpm_if_configuration_is_broken(self):
+        self.mock_call.return_value = 1
+        self.assertEqual(phpini.reload_fpm(), 1)
+        self.mock_call.assert_called_once_with(["php5-fpm", "-t"])
+        self.assertFalse(self.mock_kill.called)
+
+    def test_reload_fpm_signals_phpfpm_and_waits_until_ready(self):
+        self.assertEqual(phpini.reload_fpm(), 0)
+        self.mock_kill.assert_called_once_with(1234, signal.SIGUSR2)
+        self.mock_wait.assert_called_once_with((1, 10.0))
+        self.mock_call.assert_called_once_with(["php5-fpm", "-t"])
+
+    def test_reload_fpm_reports_downtime_of_reload(self):
+        phpini.reload_fpm()
+        self.mock_record.assert_any_call("php5-fpm.downtime.seconds", mock.ANY, method="reload")
+
+    def test_reload_fpm_restarts_phpfpm_if_it_does_not_come_back(self):
+        self.mock_wait.side_effect = [False, True]
+        self.assertEqual(phpini.reload_fpm(), 0)
+        self.mock_call.assert_any_call(["service", "php5-fpm", "restart"])
+        self.mock_record.assert_any_call("php5-fpm.downtime.seconds", mock.ANY, method="restart")
+
+    def test_reload_fpm_restarts_phpfpm_if_it_can_not_be_signalled(self):
+        self.mock_kill.side_effect = OSError(3, "No such process")
+        phpini.reload_fpm()
+        self.mock_call.assert_any_call(["service", "php5-fpm", "restart"])
+
+    def test_reload_fpm_starts_phpfpm_if_it_is_not_running(self):
+        self.mock_read_pid.side_effect = IOError(2, "No such file or directory")
+        self.assertEqual(phpini.reload_fpm(), 0)
+        self.mock_call.assert_any_call(["service", "php5-fpm", "restart"])
+        self.assertFalse(self.mock_kill.called)
+        self.assertFalse(self.mock_wait.called)
+
+    def test_reload_fpm_returns_exit_code_of_failed_restart(self):
+        self.mock_wait.return_value = False
+        self.mock_call.side_effect = [0, 1]
+        self.assertEqual(phpini.reload_fpm(), 1)
+
+    def test_reload_fpm_does_not_report_downtime_of_failed_restart(self):
+        self.mock_wait.return_value = False
+        self.mock_call.side_effect = [0, 1]
+        phpini.reload_fpm()
+        names = [call[0][0] for call in self.mock_record.call_args_list]
+        self.assertNotIn("php5-fpm.downtime.seconds", names)
+        self.mock_record.assert_any_call("php5-fpm.restart.failures", 1)
+
+
+class TestWaitUntilReady(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.mock_pidfile_stat = self.setUpPatch('hypernode.nodeconfig.phpini.pidfile_stat')
+        self.mock_accepts = self.setUpPatch('hypernode.nodeconfig.phpini.accepts_connections',
+                                            mock.Mock(return_value=True))
+        self.mock_sleep = self.setUpPatch('time.sleep')
+
+    def test_wait_until_ready_waits_for_a_new_pidfile(self):
+        self.mock_pidfile_stat.side_effect = [(1, 10.0), None, (2, 11.0)]
+        self.assertTrue(phpini.wait_until_ready((1, 10.0)))
+        self.assertEqual(self.mock_sleep.call_count, 2)
+
+    def test_wait_until_ready_waits_for_the_socket(self):
+        self.mock_pidfile_stat.return_value = (2, 11.0)
+        self.mock_accepts.side_effect = [False, True]
+        self.assertTrue(phpini.wait_until_ready((1, 10.0)))
+
+    def test_wait_until_ready_gives_up_after_timeout(self):
+        self.mock_pidfile_stat.return_value = (1, 10.0)
+        self.setUpPatch('time.time', mock.Mock(side_effect=[100.0, 100.0, 105.0, 111.0]))
+        self.assertFalse(phpini.wait_until_ready((1, 10.0), timeout=10))
+
+
+class TestFPMPaths(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.setUpPatch('hypernode.nodeconfig.common.ROOT', self.root)
+        os.makedirs(os.path.join(self.root, "var/run"))
+
+    def test_fpm_paths_are_relative_to_root(self):
+        self.assertIsNone(phpini.pidfile_stat())
+        self.assertRaises(IOError, phpini.read_pid)
+        self.assertFalse(phpini.accepts_connections())
+
+        with open(os.path.join(self.root, "var/run/php5-fpm.pid"), "w") as fd:
+            fd.write("1234\n")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(os.path.join(self.root, "var/run/php5-fpm.sock"))
+        sock.listen(1)
+
+        self.assertEqual(phpini.read_pid(), 1234)
+        self.assertIsNotNone(phpini.pidfile_stat())
+        self.assertTrue(phpini.accepts_connections())
@@ -0,0 +1,109 @@
+import os
+import json
+import stat
+import shutil
+import tempfile
+import mock
+import tests.unit
+
+from hypernode.nodeconfig import common, render
+
+TEMPLATES = {
+    "03.hostname.hosts": "{% for hostname in hostnames %}127.0.1.1 {{ hostname }}\n{% endfor %}",
+    "20.phpini": "{% for key, value in options.items %}{{ key }} = {{ value }}\n{% endfor %}",
+    "05.ssl.default-ssl-vhost": "ServerName {{ servername }}\n",
+}
+
+
+class TestRender(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        self.templatedir = os.path.join(self.tmpdir, "templates")
+        os.mkdir(self.templatedir)
+        for name, content in TEMPLATES.items():
+            with open(os.path.join(self.templatedir, name), "w") as fd:
+                fd.write(content)
+        self.setUpPatch('hypernode.nodeconfig.common.TEMPLATEDIR', self.templatedir)
+
+        self.configdir = os.path.join(self.tmpdir, "configs")
+        self.outdir = os.path.join(self.tmpdir, "out")
+        os.mkdir(self.configdir)
+
+        self.fixture = {"app_name": "app1", "hostnames": ["app1.hypernode.io"],
+                        "public_keys": ["ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIFJoZKDKcFXMvqLuJX1POK3sFyl0uLTmDAc3+h9mn7xU user@host"],
+                        "php_options": {"options": {"memory_limit": "256M"}}}
+
+    def write_config(self, name, config):
+        with open(os.path.join(self.configdir, name + ".json"), "w") as fd:
+            json.dump(config, fd)
+
+    def read_output(self, name, path):
+        with open(os.path.join(self.outdir, name, path.lstrip("/"))) as fd:
+            return fd.read()
+
+    def test_render_config_returns_files_of_all_parts(self):
+        files = render.render_config(self.fixture)
+        self.assertEqual(sorted(files.keys()), ["/etc/hostname", "/etc/hosts",
+                                                "/etc/php5/mods-available/hypernode.ini",
+                                                "/home/user/.ssh/authorized_keys",
+                                                "/var/lib/hypernode/authorized_keys.json"])
+        self.assertEqual(files["/etc/hosts"], "127.0.1.1 app1.hypernode.io\n")
+
+    def test_render_config_does_not_write_or_call_anything(self):
+        mock_writefile = self.setUpPatch('hypernode.nodeconfig.common.write_file')
+        mock_call = self.setUpPatch('subprocess.call')
+        mock_schedule = self.setUpPatch('hypernode.nodeconfig.services.schedule')
+
+        render.render_config(self.fixture)
+
+        self.assertFalse(mock_writefile.called)
+        self.assertFalse(mock_call.called)
+        self.assertFalse(mock_schedule.called)
+
+    def test_render_config_includes_ssl_vhost_if_ssl_is_configured(self):
+        self.fixture.update({"ssl_common_name": "app1.hypernode.io", "ssl_body": "key",
+                             "ssl_certificate": "crt", "ssl_key_chain": ""})
+        files = render.render_config(self.fixture)
+        self.assertEqual(files["/etc/apache2/sites-enabled/default-ssl"], "ServerName app1.hypernode.io\n")
+
+    def test_render_config_leaves_out_key_material(self):
+        self.fixture.update({"ssl_common_name": "app1.hypernode.io", "ssl_body": "key",
+                             "ssl_certificate": "crt", "ssl_key_chain": "ca"})
+        files = render.render_config(self.fixture)
+        self.assertNotIn("/etc/ssl/private/hypernode.crt", files)
+        self.assertNotIn("/etc/ssl/private/hypernode.ca", files)
+
+        files = render.render_config(self.fixture, private=True)
+        self.assertEqual(files["/etc/ssl/private/hypernode.crt"], "crt\n\nkey")
+
+    def test_write_tree_makes_files_and_directories_private(self):
+        render.write_tree(self.outdir, {"/etc/hostname": "app1"})
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.outdir, "etc")).st_mode), 0700)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.outdir, "etc/hostname")).st_mode), 0600)
+        self.assertEqual(self.read_output("", "/etc/hostname"), "app1")
+
+    def test_render_node_writes_tree_per_node(self):
+        self.write_config("app1", self.fixture)
+        self.assertEqual(render.render_node((os.path.join(self.configdir, "app1.json"), self.outdir)), ("app1", None))
+        self.assertEqual(self.read_output("app1", "/etc/hostname"), "app1")
+
+    def test_render_node_returns_error_of_broken_config(self):
+        del self.fixture["hostnames"]
+        self.write_config("app1", self.fixture)
+        name, error = render.render_node((os.path.join(self.configdir, "app1.json"), self.outdir))
+        self.assertEqual(error, "SchemaError: Invalid nodeconfig: hostnames is required")
+
+    def test_render_configs_renders_all_configs_in_pool(self):
+        self.write_config("app1", self.fixture)
+        self.write_config("app2", dict(self.fixture, app_name="app2"))
+        self.write_config("broken", {"app_name": "broken"})
+
+        count, errors = render.render_configs(self.configdir, self.outdir, templatedir=self.templatedir, processes=2)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(errors.keys(), ["broken"])
+        self.assertEqual(self.read_output("app2", "/etc/hostname"), "app2")
+        self.assertIn("memory_limit = 256M", self.read_output("app1", "/etc/php5/mods-available/hypernode.ini"))
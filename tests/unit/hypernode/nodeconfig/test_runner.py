@@ -0,0 +1,271 @@
+import threading
+import mock
+import tests.unit
+
+import hypernode.nodeconfig.runner as runner
+from hypernode.nodeconfig import schema
+
+
+def make_part(name, after=None, side_effect=None):
+    part = mock.Mock(spec=["__name__", "apply_config", "CONFIG_KEYS", "AFTER"])
+    part.__name__ = name
+    part.CONFIG_KEYS = [name]
+    part.AFTER = after or []
+    part.apply_config.side_effect = side_effect
+    return part
+
+
+class TestRunParts(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.fixture = {"a": 1, "b": 2, "c": 3}
+        self.mock_savestate = self.setUpPatch('hypernode.nodeconfig.state.save_state')
+        self.mock_loadstate = self.setUpPatch('hypernode.nodeconfig.state.load_state', mock.Mock(return_value={}))
+
+    def test_run_parts_applies_all_parts(self):
+        parts = [make_part("a"), make_part("b"), make_part("c")]
+        runner.run_parts(parts, self.fixture)
+        for part in parts:
+            part.apply_config.assert_called_once_with(self.fixture)
+
+    def test_run_parts_loads_state_if_none_given(self):
+        runner.run_parts([make_part("a")], self.fixture)
+        self.mock_loadstate.assert_called_once_with()
+
+    def test_run_parts_marks_applied_parts_without_saving_state(self):
+        applied = {}
+        runner.run_parts([make_part("a"), make_part("b")], self.fixture, applied)
+        self.assertEqual(sorted(applied.keys()), ["a", "b"])
+        self.assertFalse(self.mock_savestate.called)
+
+    def test_run_parts_skips_unchanged_parts(self):
+        part = make_part("a")
+        applied = {}
+        runner.run_parts([part], self.fixture, applied)
+        runner.run_parts([part], self.fixture, applied)
+        self.assertEqual(part.apply_config.call_count, 1)
+
+    def test_run_parts_applies_unchanged_parts_when_forced(self):
+        part = make_part("a")
+        applied = {}
+        runner.run_parts([part], self.fixture, applied)
+        runner.run_parts([part], self.fixture, applied, force=True)
+        self.assertEqual(part.apply_config.call_count, 2)
+
+    def test_run_parts_runs_parts_after_their_dependencies(self):
+        order = []
+        first = make_part("a", side_effect=lambda config: order.append("a"))
+        second = make_part("b", after=["a"], side_effect=lambda config: order.append("b"))
+        runner.run_parts([second, first], self.fixture, {})
+        self.assertEqual(order, ["a", "b"])
+
+    def test_run_parts_ignores_dependencies_outside_of_the_run(self):
+        part = make_part("b", after=["not-there"])
+        runner.run_parts([part], self.fixture, {})
+        self.assertTrue(part.apply_config.called)
+
+    def test_run_parts_runs_independent_parts_concurrently(self):
+        # Both parts wait for each other, which only succeeds if they run at
+        # the same time
+        started = {"a": threading.Event(), "b": threading.Event()}
+
+        def wait_for(me, other):
+            def apply_config(config):
+                started[me].set()
+                if not started[other].wait(5):
+                    raise RuntimeError("Parts did not run concurrently")
+            return apply_config
+
+        parts = [make_part("a", side_effect=wait_for("a", "b")), make_part("b", side_effect=wait_for("b", "a"))]
+        runner.run_parts(parts, self.fixture, {})
+
+    def test_run_parts_raises_part_error_with_failing_module(self):
+        error = ValueError("broken")
+        part = make_part("a", side_effect=error)
+
+        with self.assertRaises(runner.PartError) as cm:
+            runner.run_parts([part], self.fixture, {})
+
+        self.assertIs(cm.exception.module, part)
+        self.assertIs(cm.exception.exception, error)
+        self.assertIn("ValueError: broken", cm.exception.traceback)
+
+    def test_run_parts_does_not_start_dependent_parts_after_failure(self):
+        first = make_part("a", side_effect=ValueError)
+        second = make_part("b", after=["a"])
+        self.assertRaises(runner.PartError, runner.run_parts, [first, second], self.fixture, {})
+        self.assertFalse(second.apply_config.called)
+
+    def test_run_parts_does_not_save_state_of_failed_part(self):
+        applied = {}
+        self.assertRaises(runner.PartError, runner.run_parts,
+                          [make_part("a", side_effect=ValueError)], self.fixture, applied)
+        self.assertEqual(applied, {})
+
+    def test_run_parts_collects_timings_of_parts_that_ran(self):
+        timings = []
+        applied = {}
+        runner.run_parts([make_part("a")], self.fixture, applied)
+        self.assertRaises(runner.PartError, runner.run_parts,
+                          [make_part("a"), make_part("b", side_effect=ValueError)], self.fixture, applied, timings=timings)
+        self.assertEqual([timer.name for timer in timings], ["b"])
+        self.assertIsNotNone(timings[0].wall)
+
+    def test_run_parts_raises_exception_on_circular_dependencies(self):
+        parts = [make_part("a", after=["b"]), make_part("b", after=["a"])]
+        self.assertRaises(RuntimeError, runner.run_parts, parts, self.fixture, {})
+
+
+class TestRunAndRestart(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.fixture = {"a": 1}
+        self.applied = {"other": "digest"}
+        self.setUpPatch('hypernode.nodeconfig.services._pending', {})
+        self.mock_runparts = self.setUpPatch('hypernode.nodeconfig.runner.run_parts')
+        self.mock_runpending = self.setUpPatch('hypernode.nodeconfig.services.run_pending',
+                                               mock.Mock(return_value={}))
+        self.mock_loadstate = self.setUpPatch('hypernode.nodeconfig.state.load_state',
+                                              mock.Mock(return_value=self.applied))
+        self.mock_savestate = self.setUpPatch('hypernode.nodeconfig.state.save_state')
+        self.mock_loadpending = self.setUpPatch('hypernode.nodeconfig.state.load_pending',
+                                                mock.Mock(return_value={}))
+        self.mock_savepending = self.setUpPatch('hypernode.nodeconfig.state.save_pending')
+
+    def schedule(self, service, action):
+        return lambda *args, **kwargs: runner.services.schedule(service, action)
+
+    def test_run_and_restart_runs_parts_and_then_services(self):
+        runner.run_and_restart([make_part("a")], self.fixture)
+        self.mock_runparts.assert_called_once_with([mock.ANY], self.fixture, self.applied, force=False, timings=mock.ANY)
+        self.mock_runpending.assert_called_once_with()
+
+    def test_run_and_restart_saves_state_after_services_succeeded(self):
+        self.mock_runpending.side_effect = lambda: self.assertFalse(self.mock_savestate.called) or {}
+        runner.run_and_restart([make_part("a")], self.fixture)
+        self.mock_savestate.assert_called_once_with(self.applied)
+
+    def test_run_and_restart_does_not_save_state_if_a_service_fails(self):
+        self.mock_runpending.return_value = {"apache2": 1}
+        self.assertRaises(runner.services.ServiceError, runner.run_and_restart, [make_part("a")], self.fixture)
+        self.assertFalse(self.mock_savestate.called)
+
+    def test_run_and_restart_saves_pending_services_before_running_them(self):
+        self.mock_runparts.side_effect = self.schedule("apache2", "reload")
+        self.mock_runpending.side_effect = lambda: self.mock_savepending.assert_called_once_with(
+            {"apache2": "reload"}) or {"apache2": 0}
+
+        runner.run_and_restart([make_part("a")], self.fixture)
+
+        self.mock_savepending.assert_called_with({})
+
+    def test_run_and_restart_keeps_failed_services_pending(self):
+        self.mock_runparts.side_effect = self.schedule("apache2", "reload")
+        self.mock_runpending.return_value = {"apache2": 1}
+
+        self.assertRaises(runner.services.ServiceError, runner.run_and_restart, [make_part("a")], self.fixture)
+
+        self.mock_savepending.assert_called_with({"apache2": "reload"})
+
+    def test_run_and_restart_retries_pending_services_of_earlier_run(self):
+        self.mock_loadpending.return_value = {"apache2": "reload"}
+        runner.run_and_restart([make_part("a")], self.fixture)
+        self.mock_savepending.assert_any_call({"apache2": "reload"})
+
+    def test_run_and_restart_runs_services_and_saves_state_if_a_part_fails(self):
+        part = make_part("a")
+        self.mock_runparts.side_effect = runner.PartError(part, ValueError(), "traceback")
+
+        self.assertRaises(runner.PartError, runner.run_and_restart, [part], self.fixture)
+
+        self.mock_runpending.assert_called_once_with()
+        self.mock_savestate.assert_called_once_with(self.applied)
+
+    def test_run_and_restart_does_not_raise_if_state_can_not_be_saved(self):
+        self.mock_savestate.side_effect = IOError
+        self.mock_savepending.side_effect = OSError
+        runner.run_and_restart([make_part("a")], self.fixture)
+
+
+class TestApplyParts(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.fixture = {"a": 1}
+        self.logbuffer = mock.Mock()
+        self.logbuffer.formatBuffer.return_value = ["log"]
+        self.setUpPatch('hypernode.nodeconfig.services._pending', {})
+        self.mock_runparts = self.setUpPatch('hypernode.nodeconfig.runner.run_parts')
+        self.mock_runpending = self.setUpPatch('hypernode.nodeconfig.services.run_pending',
+                                               mock.Mock(return_value={}))
+        self.setUpPatch('hypernode.nodeconfig.state.load_state', mock.Mock(return_value={}))
+        self.setUpPatch('hypernode.nodeconfig.state.save_state')
+        self.setUpPatch('hypernode.nodeconfig.state.load_pending', mock.Mock(return_value={}))
+        self.setUpPatch('hypernode.nodeconfig.state.save_pending')
+        self.mock_success = self.setUpPatch('hypernode.nodeconfig.callback.call_success')
+        self.mock_error = self.setUpPatch('hypernode.nodeconfig.callback.call_error')
+        self.mock_recordrun = self.setUpPatch('hypernode.nodeconfig.state.record_run')
+        self.mock_validate = self.setUpPatch('hypernode.nodeconfig.schema.validate')
+
+    def test_apply_parts_runs_all_parts_by_default(self):
+        self.assertTrue(runner.apply_parts(self.fixture, self.logbuffer))
+        self.mock_runparts.assert_called_once_with(runner.RUNPARTS, self.fixture, {}, force=False, timings=mock.ANY)
+
+    def test_apply_parts_restarts_services_and_calls_success_callback(self):
+        runner.apply_parts(self.fixture, self.logbuffer)
+        self.mock_runpending.assert_called_once_with()
+        self.mock_success.assert_called_once_with(self.fixture, timings=mock.ANY)
+        self.assertFalse(self.mock_error.called)
+
+    def test_apply_parts_calls_error_callback_if_a_service_action_fails(self):
+        self.mock_runpending.return_value = {"apache2": 1, "php5-fpm": 0}
+
+        self.assertFalse(runner.apply_parts(self.fixture, self.logbuffer))
+
+        self.assertFalse(self.mock_success.called)
+        self.mock_error.assert_called_once_with(self.fixture, runner.services, mock.ANY, ["log"], timings=mock.ANY)
+        error = self.mock_error.call_args[0][2]
+        self.assertIsInstance(error, runner.services.ServiceError)
+        self.assertEqual(error.failed, {"apache2": 1})
+        self.assertEqual(self.mock_error.call_args[1]["timings"]["failed"], "hypernode.nodeconfig.services")
+
+    def test_apply_parts_returns_false_if_success_callback_fails(self):
+        self.mock_success.side_effect = Exception
+        self.assertFalse(runner.apply_parts(self.fixture, self.logbuffer))
+
+    def test_apply_parts_calls_error_callback_with_failing_module_and_log(self):
+        part = make_part("a")
+        error = ValueError()
+        self.mock_runparts.side_effect = runner.PartError(part, error, "traceback")
+
+        self.assertFalse(runner.apply_parts(self.fixture, self.logbuffer, [part]))
+
+        self.mock_runpending.assert_called_once_with()
+        self.mock_error.assert_called_once_with(self.fixture, part, error, ["log"], timings=mock.ANY)
+        self.assertEqual(self.mock_error.call_args[1]["timings"]["failed"], "a")
+        self.assertFalse(self.mock_success.called)
+
+    def test_apply_parts_reports_and_records_timings_of_the_run(self):
+        earlier = mock.Mock()
+        earlier.as_dict.return_value = {"name": "earlier"}
+
+        runner.apply_parts(self.fixture, self.logbuffer, timings=[earlier])
+
+        run = self.mock_success.call_args[1]["timings"]
+        self.assertEqual([timer["name"] for timer in run["timings"]], ["earlier", "services"])
+        self.assertIsNone(run["failed"])
+        self.mock_recordrun.assert_called_once_with(run)
+
+    def test_apply_parts_does_not_run_parts_if_config_is_invalid(self):
+        error = schema.SchemaError(["app_name is required", "hostnames is required"])
+        self.mock_validate.side_effect = error
+
+        self.assertFalse(runner.apply_parts(self.fixture, self.logbuffer))
+
+        self.assertFalse(self.mock_runparts.called)
+        self.assertFalse(self.mock_runpending.called)
+        self.mock_error.assert_called_once_with(self.fixture, schema, error, ["log"], timings=mock.ANY)
+
+    def test_apply_parts_does_not_raise_if_error_callback_fails(self):
+        self.mock_runparts.side_effect = runner.PartError(make_part("a"), ValueError(), "traceback")
+        self.mock_error.side_effect = Exception
+        self.assertFalse(runner.apply_parts(self.fixture, self.logbuffer))
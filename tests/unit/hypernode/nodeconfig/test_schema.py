@@ -0,0 +1,58 @@
+import tests.unit
+
+from hypernode.nodeconfig import schema
+
+
+class TestSchema(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.fixture = {"app_name": "app1",
+                        "hostnames": ["app1.hypernode.io"],
+                        "public_keys": ["ssh-rsa AAAA user@host"],
+                        "php_options": {"options": {"memory_limit": "256M", "max_execution_time": 60},
+                                        "extensions": ["ioncube"]},
+                        "unknown": object()}
+
+    def test_validate_accepts_valid_config(self):
+        schema.validate(self.fixture)
+        self.assertEqual(schema.errors(self.fixture), [])
+
+    def test_validate_accepts_complete_ssl_group(self):
+        self.fixture.update({"ssl_common_name": "a", "ssl_body": "b", "ssl_certificate": "c", "ssl_key_chain": ""})
+        self.assertEqual(schema.errors(self.fixture), [])
+
+    def test_validate_reports_all_errors_at_once(self):
+        del self.fixture["app_name"]
+        self.fixture["hostnames"] = ["ok", 1]
+        self.fixture["php_options"]["extensions"] = "ioncube"
+
+        with self.assertRaises(schema.SchemaError) as cm:
+            schema.validate(self.fixture)
+
+        self.assertEqual(cm.exception.errors, ["app_name is required",
+                                               "hostnames[1] must be a string, not a number",
+                                               "php_options.extensions must be a list, not a string"])
+
+    def test_validate_checks_values_of_nested_objects(self):
+        self.fixture["php_options"]["options"]["memory_limit"] = ["256M"]
+        self.assertEqual(schema.errors(self.fixture),
+                         ["php_options.options.memory_limit must be a string or a number, not a list"])
+
+    def test_validate_reports_incomplete_ssl_group(self):
+        self.fixture.update({"ssl_common_name": "a", "ssl_body": "b"})
+        self.assertEqual(schema.errors(self.fixture),
+                         ["ssl_common_name, ssl_body, ssl_certificate, ssl_key_chain must be given together, "
+                          "missing ssl_certificate, ssl_key_chain"])
+
+    def test_validate_reports_null_values(self):
+        self.fixture["app_name"] = None
+        self.assertEqual(schema.errors(self.fixture), ["app_name must be a string, not null"])
+
+    def test_validate_rejects_config_that_is_not_an_object(self):
+        self.assertEqual(schema.errors([]), ["nodeconfig must be an object, not a list"])
+
+    def test_compile_schema_returns_reusable_validator(self):
+        validate = schema.compile_schema({"a": {"type": int, "required": True}}, [["b", "c"]])
+        errors = []
+        validate({"b": 1}, errors)
+        self.assertEqual(errors, ["a is required", "b, c must be given together, missing c"])
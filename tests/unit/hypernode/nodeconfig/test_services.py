@@ -0,0 +1,85 @@
+import mock
+import tests.unit
+
+import hypernode.nodeconfig.services as services
+
+
+class TestServices(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.mock_call = self.setUpPatch('subprocess.call', mock.Mock(return_value=0))
+        self.setUpPatch('hypernode.nodeconfig.services._pending', {})
+        self.setUpPatch('hypernode.nodeconfig.services._handlers', {})
+
+    def test_schedule_registers_intent(self):
+        services.schedule("apache2", "restart")
+        self.assertEqual(services.pending(), {"apache2": "restart"})
+
+    def test_schedule_defaults_to_restart(self):
+        services.schedule("apache2")
+        self.assertEqual(services.pending(), {"apache2": "restart"})
+
+    def test_schedule_raises_exception_on_unknown_action(self):
+        self.assertRaises(ValueError, services.schedule, "apache2", "explode")
+
+    def test_schedule_deduplicates_intents(self):
+        services.schedule("apache2", "restart")
+        services.schedule("apache2", "restart")
+        services.run_pending()
+        self.mock_call.assert_called_once_with(["service", "apache2", "restart"])
+
+    def test_restart_supersedes_reload(self):
+        services.schedule("apache2", "reload")
+        services.schedule("apache2", "restart")
+        services.schedule("apache2", "reload")
+        self.assertEqual(services.pending(), {"apache2": "restart"})
+
+    def test_run_pending_runs_every_service_once(self):
+        services.schedule("apache2", "restart")
+        services.schedule("rsyslog", "reload")
+        results = services.run_pending()
+
+        self.assertEqual(self.mock_call.call_count, 2)
+        self.mock_call.assert_any_call(["service", "apache2", "restart"])
+        self.mock_call.assert_any_call(["service", "rsyslog", "reload"])
+        self.assertEqual(results, {"apache2": 0, "rsyslog": 0})
+
+    def test_run_pending_clears_pending_intents(self):
+        services.schedule("apache2", "restart")
+        services.run_pending()
+        self.assertEqual(services.pending(), {})
+        services.run_pending()
+        self.assertEqual(self.mock_call.call_count, 1)
+
+    def test_run_pending_returns_exit_code_of_failed_action(self):
+        self.mock_call.return_value = 1
+        services.schedule("apache2", "restart")
+        self.assertEqual(services.run_pending(), {"apache2": 1})
+
+    def test_run_pending_uses_registered_handler(self):
+        handler = mock.Mock(return_value=0)
+        services.register("php5-fpm", "reload", handler)
+        services.schedule("php5-fpm", "reload")
+        self.assertEqual(services.run_pending(), {"php5-fpm": 0})
+        handler.assert_called_once_with(None)
+        self.assertFalse(self.mock_call.called)
+
+    def test_handler_is_not_used_for_other_actions(self):
+        handler = mock.Mock(return_value=0)
+        services.register("php5-fpm", "reload", handler)
+        services.schedule("php5-fpm", "restart")
+        services.run_pending()
+        self.assertFalse(handler.called)
+        self.mock_call.assert_called_once_with(["service", "php5-fpm", "restart"])
+
+    def test_run_pending_returns_failure_if_handler_raises(self):
+        services.register("php5-fpm", "reload", mock.Mock(side_effect=OSError(2, "No such file or directory")))
+        services.schedule("php5-fpm", "reload")
+        self.assertEqual(services.run_pending(), {"php5-fpm": -1})
+
+    def test_service_error_lists_failed_services(self):
+        error = services.ServiceError({"php5-fpm": 1, "apache2": -1})
+        self.assertEqual(str(error), "Service actions failed: apache2 (exit code -1), php5-fpm (exit code 1)")
+
+    def test_register_raises_exception_on_unknown_action(self):
+        self.assertRaises(ValueError, services.register, "php5-fpm", "explode", mock.Mock())
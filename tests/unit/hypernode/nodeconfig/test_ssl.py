@@ -4,7 +4,11 @@ import sys
 import mock
 import tests.unit
 
-import subprocess
+import os
+import json
+import shutil
+import tempfile
+from OpenSSL import crypto
 
 import hypernode.nodeconfig.sslcerts as ssl
 import hypernode.nodeconfig.common
@@ -16,10 +20,11 @@ class TestSSLConfig(tests.unit.BaseTestCase):
         self.mock_checkvars = self.setUpPatch('hypernode.nodeconfig.common.check_vars')
 
         self.mock_call = self.setUpPatch('subprocess.call')
-        self.mock_check_output = self.setUpPatch('subprocess.check_output')
+        self.mock_schedule = self.setUpPatch('hypernode.nodeconfig.services.schedule')
 
         self.mock_open = self.setUpPatch('__builtin__.open', themock=mock.mock_open())
-        self.mock_tempfile = self.setUpPatch('tempfile.NamedTemporaryFile', themock=mock.mock_open())
+        self.mock_loadcache = self.setUpPatch('hypernode.nodeconfig.sslcerts.load_verify_cache', mock.Mock(return_value={}))
+        self.mock_savecache = self.setUpPatch('hypernode.nodeconfig.sslcerts.save_verify_cache')
 
         self.mock_writefile = self.setUpPatch('hypernode.nodeconfig.common.write_file', mock.Mock(return_value=True))
         self.mock_filltemplate = self.setUpPatch('hypernode.nodeconfig.common.fill_template', mock.Mock(return_value="data"))
@@ -38,6 +43,7 @@ class TestSSLConfig(tests.unit.BaseTestCase):
         self.mock_checkvars.assert_called_once_with(self.fixture, ["app_name"])
 
     def test_apply_config_raises_exception_when_not_all_ssl_params_present(self):
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl')
         config = self.fixture.copy()
         del config["ssl_body"]
         self.assertRaises(Exception, ssl.apply_config, config)
@@ -102,21 +108,18 @@ class TestSSLConfig(tests.unit.BaseTestCase):
                                                                               (self.fixture['ssl_certificate'],
                                                                                self.fixture['ssl_body']), umask=0077)
 
-    def test_apply_config_restarts_apache_if_certificate_is_valid(self):
+    def test_apply_config_schedules_apache_restart_if_certificate_is_valid(self):
         self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl')
 
         ssl.apply_config(self.fixture)
-        self.mock_call.assert_called_once_with(["service", "apache2", "restart"])
-
-    def test_verify_ssl_writes_certificateinfo_to_tempfiles(self):
-        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_pem')
-        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_ca')
+        self.mock_schedule.assert_called_once_with("apache2", "restart")
 
-        ssl.verify_ssl('my_crt', 'my_key', 'my_ca')
+    def test_apply_config_does_not_restart_apache_if_nothing_changed(self):
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl')
+        self.mock_writefile.return_value = False
 
-        fd = self.mock_tempfile()
-        fd.write.assert_any_call('%s\n\n%s' % ('my_key', 'my_crt'))
-        fd.write.assert_any_call('my_ca')
+        ssl.apply_config(self.fixture)
+        self.assertFalse(self.mock_schedule.called)
 
     def test_verify_ssl_raises_exception_when_pem_verification_fails(self):
         mock_verifypem = self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_pem', mock.Mock(side_effect=SSLTestException))
@@ -154,25 +157,44 @@ class TestSSLConfig(tests.unit.BaseTestCase):
         self.assertTrue(verify_ssl_pem.called)
         self.assertFalse(verify_ssl_ca.called)
 
-    def test_verify_ssl_pem_calls_openssl_with_filename(self):
-        ssl.verify_ssl_pem("my_crt_file")
-        self.mock_check_output.assert_called_once_with(["/usr/bin/openssl", "x509",
-                                                        "-in", "my_crt_file", "-noout"],
-                                                       shell=False, stderr=subprocess.STDOUT)
+    def test_verify_ssl_skips_verification_if_cached(self):
+        verify_ssl_pem = self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_pem')
+        fingerprint = ssl.ssl_fingerprint('my_crt', 'my_key', 'my_ca')
+        self.mock_loadcache.return_value = {fingerprint: "99991231235959Z"}
 
-    def test_verify_ssl_pem_does_not_catch_exception_raised_by_subprocess(self):
-        self.setUpPatch('subprocess.check_output', mock.Mock(side_effect=SSLTestException))
-        self.assertRaises(SSLTestException, ssl.verify_ssl_pem, "non-existing-file")
+        ssl.verify_ssl('my_crt', 'my_key', 'my_ca')
 
-    def test_verify_ssl_ca_calls_openssl_with_filenames(self):
-        ssl.verify_ssl_ca("my_crt_file", "my_ca_file")
-        self.mock_check_output.assert_called_once_with(["/usr/bin/openssl", "verify",
-                                                        "-CAfile", "my_ca_file", "my_crt_file"],
-                                                       shell=False, stderr=subprocess.STDOUT)
+        self.assertFalse(verify_ssl_pem.called)
+        self.assertFalse(self.mock_savecache.called)
 
-    def test_verify_ssl_ca_does_not_catch_exception_raised_by_subprocess(self):
-        self.setUpPatch('subprocess.check_output', mock.Mock(side_effect=SSLTestException))
-        self.assertRaises(SSLTestException, ssl.verify_ssl_ca, "non-existing-file", "non-existing-file")
+    def test_verify_ssl_verifies_again_if_cached_result_expired(self):
+        verify_ssl_pem = self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_pem')
+        fingerprint = ssl.ssl_fingerprint('my_crt', 'my_key', '')
+        self.mock_loadcache.return_value = {fingerprint: "20000101000000Z"}
+
+        ssl.verify_ssl('my_crt', 'my_key', '')
+
+        self.assertTrue(verify_ssl_pem.called)
+
+    def test_verify_ssl_caches_earliest_expiry_of_successful_verification(self):
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_pem', mock.Mock(return_value="20300101000000Z"))
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_ca', mock.Mock(return_value="20200101000000Z"))
+
+        ssl.verify_ssl('my_crt', 'my_key', 'my_ca')
+
+        fingerprint = ssl.ssl_fingerprint('my_crt', 'my_key', 'my_ca')
+        self.mock_savecache.assert_called_once_with({fingerprint: "20200101000000Z"})
+
+    def test_verify_ssl_does_not_cache_failed_verification(self):
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl_pem', mock.Mock(side_effect=SSLTestException))
+        self.assertRaises(SSLTestException, ssl.verify_ssl, 'my_crt', 'my_key', 'my_ca')
+        self.assertFalse(self.mock_savecache.called)
+
+    def test_ssl_fingerprint_depends_on_certificate_key_and_chain(self):
+        fingerprint = ssl.ssl_fingerprint('my_crt', 'my_key', 'my_ca')
+        self.assertNotEqual(fingerprint, ssl.ssl_fingerprint('other_crt', 'my_key', 'my_ca'))
+        self.assertNotEqual(fingerprint, ssl.ssl_fingerprint('my_crt', 'other_key', 'my_ca'))
+        self.assertNotEqual(fingerprint, ssl.ssl_fingerprint('my_crt', 'my_key', 'other_ca'))
 
     def test_disable_ssl_unlinks_required_files(self):
         with mock.patch('os.unlink') as mock_unlink:
@@ -182,10 +204,15 @@ class TestSSLConfig(tests.unit.BaseTestCase):
                 mock.call("/etc/ssl/private/hypernode.ca"),
                 mock.call("/etc/apache2/sites-enabled/default-ssl")])
 
-    def test_disable_ssl_restarts_apache_if_at_least_one_file_is_deleted(self):
+    def test_disable_ssl_schedules_apache_restart_if_at_least_one_file_is_deleted(self):
         with mock.patch('os.unlink', mock.Mock(side_effect=[1, OSError(2, ""), OSError(2, "")])):
             ssl.disable_ssl()
-            self.mock_call.assert_called_once_with(["service", "apache2", "restart"])
+            self.mock_schedule.assert_called_once_with("apache2", "restart")
+
+    def test_disable_ssl_does_not_restart_apache_if_no_file_is_deleted(self):
+        with mock.patch('os.unlink', mock.Mock(side_effect=OSError(2, ""))):
+            ssl.disable_ssl()
+            self.assertFalse(self.mock_schedule.called)
 
     def test_disable_ssl_catches_file_does_not_exist_exception_but_no_other_exception(self):
         with mock.patch('os.unlink', mock.Mock(side_effect=OSError(2, ""))):
@@ -200,15 +227,18 @@ class IntegratedSSLConfig(tests.unit.BaseTestCase):
     def setUp(self):
         self.write_file = self.setUpPatch('hypernode.nodeconfig.common.write_file')
         self.subprocess_call = self.setUpPatch('subprocess.call')
-        self.check_output = self.setUpPatch('subprocess.check_output')
+        self.schedule = self.setUpPatch('hypernode.nodeconfig.services.schedule')
+        self.verify_ssl = self.setUpPatch('hypernode.nodeconfig.sslcerts.verify_ssl')
         self.unlink = self.setUpPatch('os.unlink')
         self.open = self.setUpPatch('__builtin__.open', mock.mock_open(read_data=template))
+        self.stat = self.setUpPatch('os.stat')
+        self.setUpPatch('hypernode.nodeconfig.common._templates', {})
 
     def test_that_config_without_ssl_parameters_disables_ssl(self):
         config = {'app_name': 'testapp'}
         hypernode.nodeconfig.sslcerts.apply_config(config)
         self.assertEqual(self.unlink.call_count, 3)
-        self.subprocess_call.assert_called_once_with(['service', 'apache2', 'restart'])
+        self.schedule.assert_called_once_with('apache2', 'restart')
 
     def test_that_config_with_ssl_parameters_enables_ssl(self):
         config = {'app_name': 'testapp',
@@ -224,7 +254,7 @@ class IntegratedSSLConfig(tests.unit.BaseTestCase):
         self.assertRegexpMatches(apacheconf, r"ServerName\W+cname")
         self.assertRegexpMatches(apacheconf, r"SSLCertificateFile\W+" + hypernode.nodeconfig.sslcerts.CRTPATH)
         self.assertRegexpMatches(apacheconf, r"SSLCertificateChainFile\W+" + hypernode.nodeconfig.sslcerts.CAPATH)
-        self.subprocess_call.assert_called_once_with(['service', 'apache2', 'restart'])
+        self.schedule.assert_called_once_with('apache2', 'restart')
 
     def test_that_config_with_ssl_parameters_without_chain_enables_ssl(self):
         config = {'app_name': 'testapp',
@@ -240,7 +270,7 @@ class IntegratedSSLConfig(tests.unit.BaseTestCase):
         self.assertRegexpMatches(apacheconf, r"ServerName\W+cname")
         self.assertRegexpMatches(apacheconf, r"SSLCertificateFile\W+" + hypernode.nodeconfig.sslcerts.CRTPATH)
         self.assertNotRegexpMatches(apacheconf, r"SSLCertificateChainFile")
-        self.subprocess_call.assert_called_once_with(['service', 'apache2', 'restart'])
+        self.schedule.assert_called_once_with('apache2', 'restart')
 
     def test_that_config_with_missing_parameter_raises_exception(self):
         config = {'app_name': 'testapp',
@@ -255,6 +285,90 @@ class IntegratedSSLConfig(tests.unit.BaseTestCase):
                 return call[1][1]
         return False
 
+
+def make_certificate(cn, issuer=None, days=30):
+    # Returns (certificate, key) as PEM, signed by issuer if given and
+    # self-signed otherwise
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 1024)
+
+    cert = crypto.X509()
+    cert.set_version(2)
+    cert.set_serial_number(abs(hash(cn)))
+    cert.get_subject().CN = cn
+    cert.gmtime_adj_notBefore(-3600)
+    cert.gmtime_adj_notAfter(days * 86400)
+    cert.set_pubkey(key)
+
+    if issuer is None:
+        cert.set_issuer(cert.get_subject())
+        cert.add_extensions([crypto.X509Extension("basicConstraints", True, "CA:TRUE")])
+        cert.sign(key, "sha256")
+    else:
+        issuer_cert = crypto.load_certificate(crypto.FILETYPE_PEM, issuer[0])
+        issuer_key = crypto.load_privatekey(crypto.FILETYPE_PEM, issuer[1])
+        cert.set_issuer(issuer_cert.get_subject())
+        cert.sign(issuer_key, "sha256")
+
+    return (crypto.dump_certificate(crypto.FILETYPE_PEM, cert),
+            crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+
+
+class InProcessSSLVerification(tests.unit.BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ca = make_certificate("Test CA")
+        cls.crt, cls.key = make_certificate("www.example.com", issuer=cls.ca)
+        cls.othercrt, cls.otherkey = make_certificate("other.example.com", issuer=cls.ca)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.VERIFYCACHE', os.path.join(self.tmpdir, "cache", "sslverify.json"))
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.SYSTEM_CAPATH', self.tmpdir)
+
+    def test_verify_ssl_pem_accepts_matching_certificate_and_key(self):
+        notafter = ssl.verify_ssl_pem(self.crt, self.key)
+        self.assertRegexpMatches(notafter, r"^\d{14}Z$")
+
+    def test_verify_ssl_pem_rejects_key_of_other_certificate(self):
+        self.assertRaises(ssl.SSLVerificationError, ssl.verify_ssl_pem, self.crt, self.otherkey)
+
+    def test_verify_ssl_pem_rejects_garbage(self):
+        self.assertRaises(ssl.SSLVerificationError, ssl.verify_ssl_pem, "sslcert", self.key)
+        self.assertRaises(ssl.SSLVerificationError, ssl.verify_ssl_pem, self.crt, "sslbody")
+
+    def test_verify_ssl_ca_accepts_certificate_issued_by_chain(self):
+        ssl.verify_ssl_ca(self.crt, self.ca[0])
+
+    def test_verify_ssl_ca_rejects_certificate_not_issued_by_chain(self):
+        otherca = make_certificate("Other CA")
+        self.assertRaises(ssl.SSLVerificationError, ssl.verify_ssl_ca, self.crt, otherca[0])
+
+    def test_verify_ssl_ca_rejects_chain_without_certificates(self):
+        self.assertRaises(ssl.SSLVerificationError, ssl.verify_ssl_ca, self.crt, "chain")
+
+    def test_verify_ssl_caches_result_on_disk(self):
+        ssl.verify_ssl(self.crt, self.key, self.ca[0])
+
+        with open(ssl.VERIFYCACHE) as fd:
+            cache = json.load(fd)
+        self.assertIn(ssl.ssl_fingerprint(self.crt, self.key, self.ca[0]), cache)
+        self.assertEqual(os.stat(ssl.VERIFYCACHE).st_mode & 0777, 0600)
+
+        with mock.patch('hypernode.nodeconfig.sslcerts.verify_ssl_pem') as verify_ssl_pem:
+            ssl.verify_ssl(self.crt, self.key, self.ca[0])
+            self.assertFalse(verify_ssl_pem.called)
+
+    def test_verify_ssl_keeps_cache_bounded(self):
+        self.setUpPatch('hypernode.nodeconfig.sslcerts.VERIFYCACHE_SIZE', 2)
+        ssl.verify_ssl(self.crt, self.key, "")
+        ssl.verify_ssl(self.othercrt, self.otherkey, "")
+        ssl.verify_ssl(self.crt, self.key, self.ca[0])
+        self.assertEqual(len(ssl.load_verify_cache()), 2)
+
+
 # This template is copied from the puppet-ami repo
 template = """
 <IfModule mod_ssl.c>
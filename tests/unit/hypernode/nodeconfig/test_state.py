@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import tempfile
+
+import mock
+import tests.unit
+
+import hypernode.nodeconfig.state as state
+
+
+class FakePart(object):
+    __name__ = "fakepart"
+    CONFIG_KEYS = ["a", "b"]
+
+
+class FakeTemplatePart(FakePart):
+    TEMPLATES = ["10.fake"]
+
+
+class TestState(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.fixture = {"a": 1, "b": [1, 2], "c": "other"}
+        self.mock_writefile = self.setUpPatch('hypernode.nodeconfig.common.write_file')
+        self.mock_makedirs = self.setUpPatch('os.makedirs')
+
+    def test_load_state_returns_empty_dict_if_statefile_does_not_exist(self):
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(side_effect=IOError))
+        self.assertEqual(state.load_state("non-exist"), {})
+
+    def test_load_state_returns_stored_state(self):
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(return_value={"part": "digest"}))
+        self.assertEqual(state.load_state("my-state"), {"part": "digest"})
+
+    def test_save_state_writes_state_as_json(self):
+        self.setUpPatch('os.path.isdir', mock.Mock(return_value=True))
+        state.save_state({"part": "digest"}, "/my/state")
+        self.mock_writefile.assert_called_once_with("/my/state", '{\n  "part": "digest"\n}')
+        self.assertFalse(self.mock_makedirs.called)
+
+    def test_save_state_creates_state_dir_if_not_exists(self):
+        self.setUpPatch('os.path.isdir', mock.Mock(return_value=False))
+        state.save_state({}, "/my/state")
+        self.mock_makedirs.assert_called_once_with("/my", 0755)
+
+    def test_config_digest_only_depends_on_given_keys(self):
+        digest = state.config_digest(self.fixture, ["a", "b"])
+        self.fixture["c"] = "changed"
+        self.assertEqual(digest, state.config_digest(self.fixture, ["a", "b"]))
+        self.fixture["b"] = [2, 1]
+        self.assertNotEqual(digest, state.config_digest(self.fixture, ["a", "b"]))
+
+    def test_config_digest_distinguishes_missing_and_null_keys(self):
+        self.assertNotEqual(state.config_digest({}, ["a"]), state.config_digest({"a": None}, ["a"]))
+
+    def test_part_changed_is_true_if_part_was_never_applied(self):
+        self.assertTrue(state.part_changed(FakePart, self.fixture, {}))
+
+    def test_part_changed_is_false_after_part_was_applied(self):
+        applied = {}
+        state.mark_applied(FakePart, self.fixture, applied)
+        self.assertFalse(state.part_changed(FakePart, self.fixture, applied))
+
+        self.fixture["a"] = 2
+        self.assertTrue(state.part_changed(FakePart, self.fixture, applied))
+
+    def test_part_changed_is_always_true_for_parts_without_config_keys(self):
+        part = mock.Mock(spec=[])
+        part.__name__ = "nokeys"
+        applied = {}
+        state.mark_applied(part, self.fixture, applied)
+        self.assertEqual(applied, {})
+        self.assertTrue(state.part_changed(part, self.fixture, applied))
+
+    def test_part_changed_is_true_if_its_template_changed(self):
+        templatedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, templatedir)
+        self.setUpPatch('hypernode.nodeconfig.common.TEMPLATEDIR', templatedir)
+        with open(os.path.join(templatedir, "10.fake"), "w") as fd:
+            fd.write("old")
+
+        applied = {}
+        state.mark_applied(FakeTemplatePart, self.fixture, applied)
+        self.assertFalse(state.part_changed(FakeTemplatePart, self.fixture, applied))
+
+        with open(os.path.join(templatedir, "10.fake"), "w") as fd:
+            fd.write("new")
+        self.assertTrue(state.part_changed(FakeTemplatePart, self.fixture, applied))
+
+    def test_template_hashes_has_no_hash_for_missing_templates(self):
+        self.setUpPatch('hypernode.nodeconfig.common.TEMPLATEDIR', "/non-exist")
+        self.assertEqual(state.template_hashes(["10.fake"]), {"10.fake": None})
+
+    def test_load_pending_returns_empty_dict_for_invalid_file(self):
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(return_value=["invalid"]))
+        self.assertEqual(state.load_pending("/my/pending"), {})
+
+    def test_record_run_keeps_last_runs(self):
+        self.setUpPatch('os.path.isdir', mock.Mock(return_value=True))
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(return_value=range(state.RUNS_KEPT)))
+        state.record_run("new", "/my/runs")
+        runs = json.loads(self.mock_writefile.call_args[0][1])
+        self.assertEqual(len(runs), state.RUNS_KEPT)
+        self.assertEqual(runs[-1], "new")
+
+    def test_record_run_starts_anew_if_record_is_invalid(self):
+        self.setUpPatch('os.path.isdir', mock.Mock(return_value=True))
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(return_value=state.common.NodeConfig()))
+        state.record_run("new", "/my/runs")
+        self.assertEqual(json.loads(self.mock_writefile.call_args[0][1]), ["new"])
+
+    def test_record_run_does_not_raise_on_unexpected_errors(self):
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(side_effect=TypeError))
+        state.record_run({}, "/my/runs")
+
+    def test_record_run_does_not_raise_if_record_can_not_be_written(self):
+        self.setUpPatch('hypernode.nodeconfig.common.get_config', mock.Mock(side_effect=IOError))
+        self.setUpPatch('os.path.isdir', mock.Mock(return_value=True))
+        self.mock_writefile.side_effect = IOError
+        state.record_run({}, "/my/runs")
@@ -0,0 +1,150 @@
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+import mock
+import requests
+import tests.unit
+
+import hypernode.httpclient
+import hypernode.metrics
+
+backoff = hypernode.httpclient.backoff
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # The server holds a list of (status, delay) tuples, one per request
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader("content-length", 0)))
+        self.server.requests.append((self.path, body))
+
+        status, delay = self.server.responses.pop(0) if self.server.responses else (200, 0)
+        time.sleep(delay)
+
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write("ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        # Keep track of the handler threads, so tests can wait for them
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(2)
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out have gone away before we respond
+        pass
+
+
+class TestHTTPClient(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        self.server.requests = []
+        self.server.threads = []
+        self.server.responses = []
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.url = "http://127.0.0.1:%d/callback/" % self.server.server_address[1]
+        self.mock_backoff = self.setUpPatch('hypernode.httpclient.backoff', mock.Mock(return_value=0))
+        hypernode.httpclient._session = None
+        self.addCleanup(lambda: hypernode.httpclient.get_session().close())
+        hypernode.metrics.reset()
+
+    def test_post_sends_data_to_url(self):
+        r = hypernode.httpclient.post(self.url, data={"applied_hash": "abc"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.server.requests, [("/callback/", "applied_hash=abc")])
+
+    def test_post_reuses_session(self):
+        hypernode.httpclient.post(self.url)
+        session = hypernode.httpclient.get_session()
+        hypernode.httpclient.post(self.url)
+        self.assertIs(session, hypernode.httpclient.get_session())
+
+    def test_post_retries_on_gateway_errors(self):
+        self.server.responses = [(503, 0), (502, 0)]
+        r = hypernode.httpclient.post(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.mock_backoff.call_count, 2)
+
+    def test_post_returns_last_response_when_retries_exhausted(self):
+        self.server.responses = [(503, 0)] * 3
+        r = hypernode.httpclient.post(self.url, retries=2)
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_post_does_not_retry_other_errors(self):
+        self.server.responses = [(404, 0)]
+        r = hypernode.httpclient.post(self.url)
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_raises_timeout_when_retries_exhausted(self):
+        self.server.responses = [(200, 0.5)] * 2
+        with self.assertRaises(requests.Timeout):
+            hypernode.httpclient.post(self.url, timeout=(1, 0.05), retries=1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_post_does_not_retry_read_timeout_of_non_idempotent_request(self):
+        self.server.responses = [(200, 0.5)] * 2
+        with self.assertRaises(requests.Timeout):
+            hypernode.httpclient.post(self.url, timeout=(1, 0.05), retries=1, idempotent=False)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_does_not_retry_gateway_timeout_of_non_idempotent_request(self):
+        self.server.responses = [(504, 0)]
+        r = hypernode.httpclient.post(self.url, idempotent=False)
+        self.assertEqual(r.status_code, 504)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_retries_other_gateway_errors_of_non_idempotent_request(self):
+        self.server.responses = [(503, 0)]
+        r = hypernode.httpclient.post(self.url, idempotent=False)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_post_retries_connection_errors(self):
+        url = self.url
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(requests.ConnectionError):
+            hypernode.httpclient.post(url, retries=2)
+        self.assertEqual(self.mock_backoff.call_count, 2)
+
+    def test_post_records_latency_per_request(self):
+        self.server.responses = [(503, 0)]
+        hypernode.httpclient.post(self.url)
+
+        measurements = hypernode.metrics.get("http.request.seconds")
+        self.assertEqual([m[2]["status"] for m in measurements], [503, 200])
+        self.assertEqual([m[2]["attempt"] for m in measurements], [0, 1])
+        self.assertTrue(all(m[1] >= 0 for m in measurements))
+
+    def test_backoff_is_jittered_and_bounded(self):
+        with mock.patch('random.uniform') as mock_uniform:
+            backoff(0)
+            mock_uniform.assert_called_with(0, hypernode.httpclient.BACKOFF)
+            backoff(100)
+            mock_uniform.assert_called_with(0, hypernode.httpclient.MAX_BACKOFF)
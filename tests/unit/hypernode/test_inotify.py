@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import tests.unit
+
+from hypernode import inotify
+
+
+class TestInotify(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.notifier = inotify.Inotify()
+        self.addCleanup(self.notifier.close)
+
+    def test_read_returns_no_events_after_timeout(self):
+        self.notifier.add_watch(self.tmpdir, inotify.IN_CLOSE_WRITE)
+        self.assertEqual(self.notifier.read(timeout=0), [])
+
+    def test_read_returns_events_for_watched_directory(self):
+        wd = self.notifier.add_watch(self.tmpdir, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+
+        with open(os.path.join(self.tmpdir, "written"), "w") as fd:
+            fd.write("data")
+        with open(os.path.join(self.tmpdir, "tmp"), "w") as fd:
+            fd.write("data")
+        os.rename(os.path.join(self.tmpdir, "tmp"), os.path.join(self.tmpdir, "moved"))
+
+        events = self.notifier.read(timeout=1)
+        self.assertEqual([(e.wd, e.name) for e in events], [(wd, "written"), (wd, "tmp"), (wd, "moved")])
+        self.assertTrue(events[0].mask & inotify.IN_CLOSE_WRITE)
+        self.assertTrue(events[2].mask & inotify.IN_MOVED_TO)
+
+    def test_add_watch_raises_oserror_for_missing_path(self):
+        self.assertRaises(OSError, self.notifier.add_watch, os.path.join(self.tmpdir, "missing"), inotify.IN_MODIFY)
+
+    def test_close_closes_file_descriptor(self):
+        fd = self.notifier.fileno()
+        self.notifier.close()
+        self.assertRaises(OSError, os.fstat, fd)
@@ -3,6 +3,8 @@ import hypernode.log
 import mock
 import sys
 import logging
+import threading
+import time
 
 
 class TestLogging(tests.unit.BaseTestCase):
@@ -57,35 +59,95 @@ class TestLogging(tests.unit.BaseTestCase):
     ###
     # Buffer handler
     ###
+    def make_buffer_handler(self, *args, **kwargs):
+        bufferhandler = hypernode.log.MyBufferHandler(*args, **kwargs)
+        bufferhandler.setFormatter(logging.Formatter("%(levelname)s %(name)s %(message)s"))
+        logger = logging.getLogger("buffertest.%d" % id(bufferhandler))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(bufferhandler)
+        return bufferhandler, logger
+
     def test_buffer_handler_has_buffer_attribute(self):
         logbuffer = hypernode.log.MyBufferHandler()
         logbuffer.buffer
 
     def test_buffer_handler_method_flush_does_nothing(self):
-        bufferhandler = hypernode.log.MyBufferHandler(10)
-        bufferhandler.buffer = ["a"]
+        bufferhandler, logger = self.make_buffer_handler(10)
+        logger.info("a")
         bufferhandler.flush()
-        self.assertEqual(bufferhandler.buffer, ["a"])
+        self.assertEqual(len(bufferhandler.buffer), 1)
 
     def test_buffer_handler_method_truncate_empties_buffer(self):
-        bufferhandler = hypernode.log.MyBufferHandler(10)
-        bufferhandler.buffer = ["a"]
+        bufferhandler, logger = self.make_buffer_handler(1)
+        logger.info("a")
+        logger.info("b")
         bufferhandler.truncate()
-        self.assertEqual(bufferhandler.buffer, [])
+        self.assertEqual(len(bufferhandler.buffer), 0)
+        self.assertEqual(bufferhandler.formatBuffer(), [])
 
     def test_buffer_handler_method_shouldflush_returns_false(self):
         bufferhandler = hypernode.log.MyBufferHandler(1)
-        bufferhandler.buffer = ["a"]
         self.assertFalse(bufferhandler.shouldFlush("a"))
 
     def test_buffer_handler_method_format_buffer_formats_entire_buffer_into_strings(self):
-        bufferhandler = hypernode.log.MyBufferHandler()
-        bufferhandler.buffer = [1, 2, 3]
-        bufferhandler.format = mock.Mock()
-        bufferhandler.format.side_effect = ["a", "b", "c", "d", "e", "f"]
-        result = bufferhandler.formatBuffer()
-        self.assertEqual(result, ["a", "b", "c"])
-        self.assertEqual(bufferhandler.format.call_count, 3)
+        bufferhandler, logger = self.make_buffer_handler()
+        logger.info("a %s", "b")
+        logger.error("c")
+        self.assertEqual(bufferhandler.formatBuffer(), ["INFO %s a b" % logger.name, "ERROR %s c" % logger.name])
+
+    def test_buffer_handler_formats_records_only_once(self):
+        bufferhandler, logger = self.make_buffer_handler()
+        logger.info("a")
+        bufferhandler.formatBuffer()
+        logger.info("b")
+
+        with mock.patch.object(bufferhandler, "format", mock.Mock(return_value="formatted")) as mock_format:
+            self.assertEqual(bufferhandler.formatBuffer()[1], "formatted")
+            self.assertEqual(mock_format.call_count, 1)
+
+    def test_buffer_handler_stores_message_when_logged(self):
+        bufferhandler, logger = self.make_buffer_handler()
+        value = ["a"]
+        logger.info("%s", value)
+        value.append("b")
+        self.assertEqual(bufferhandler.formatBuffer(), ["INFO %s ['a']" % logger.name])
+
+    def test_buffer_handler_keeps_formatted_exceptions(self):
+        bufferhandler, logger = self.make_buffer_handler()
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            logger.exception("failed")
+        self.assertIn("ValueError: broken", bufferhandler.formatBuffer()[0])
+
+    def test_buffer_handler_does_not_raise_on_broken_format(self):
+        bufferhandler, logger = self.make_buffer_handler()
+        with mock.patch.object(bufferhandler, "handleError") as mock_handle_error:
+            logger.error("%s %s", "a")
+            self.assertEqual(mock_handle_error.call_count, 1)
+        self.assertEqual(len(bufferhandler.buffer), 0)
+
+    def test_buffer_handler_drops_oldest_records_beyond_capacity(self):
+        bufferhandler, logger = self.make_buffer_handler(2)
+        for message in "abc":
+            logger.info(message)
+        self.assertEqual(bufferhandler.formatBuffer(),
+                         ["[1 earlier log lines dropped]", "INFO %s b" % logger.name, "INFO %s c" % logger.name])
+
+    def test_buffer_handler_drops_oldest_records_beyond_maxbytes(self):
+        bufferhandler, logger = self.make_buffer_handler(maxbytes=25)
+        for message in ("a" * 10, "b" * 10, "c" * 10):
+            logger.info(message)
+        self.assertEqual(len(bufferhandler.buffer), 2)
+        self.assertEqual(bufferhandler.size, 20)
+
+    def test_buffer_handler_keeps_newest_record_larger_than_maxbytes(self):
+        bufferhandler, logger = self.make_buffer_handler(maxbytes=5)
+        logger.info("a")
+        logger.info("b" * 10)
+        self.assertEqual(bufferhandler.formatBuffer()[-1], "INFO %s %s" % (logger.name, "b" * 10))
+        self.assertEqual(len(bufferhandler.buffer), 1)
 
     def test_attach_buffer_handler_attaches_and_returns_bufferhandler(self):
         logger = mock.Mock()
@@ -106,3 +168,76 @@ class TestLogging(tests.unit.BaseTestCase):
             mock_handler_instance = mock_handler.return_value = mock.Mock()
             hypernode.log.attachBufferHandler(logger)
             mock_handler_instance.setLevel.assert_called_once_with(logging.DEBUG)
+
+    ###
+    # Queue handler
+    ###
+    def make_queue_handler(self, target, maxsize=10000):
+        queuehandler = hypernode.log.QueueHandler(target, maxsize)
+        self.addCleanup(queuehandler.stop, 1)
+        logger = logging.getLogger("queuetest.%d" % id(queuehandler))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(queuehandler)
+        return queuehandler, logger
+
+    def test_queue_handler_passes_records_to_target_in_order(self):
+        target, _ = self.make_buffer_handler()
+        queuehandler, logger = self.make_queue_handler(target)
+        logger.info("a %s", "b")
+        logger.info("c")
+        queuehandler.stop()
+        self.assertEqual([entry.message for entry in target.buffer], ["a b", "c"])
+
+    def test_queue_handler_resolves_message_and_exception_before_queueing(self):
+        target, _ = self.make_buffer_handler()
+        queuehandler, logger = self.make_queue_handler(target)
+        value = ["a"]
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            logger.exception("%s", value)
+        value.append("b")
+        queuehandler.stop()
+        self.assertEqual(target.buffer[0].message, "['a']")
+        self.assertIn("ValueError: broken", target.buffer[0].exc_text)
+
+    def test_queue_handler_does_not_raise_on_broken_format(self):
+        target, _ = self.make_buffer_handler()
+        queuehandler, logger = self.make_queue_handler(target)
+        with mock.patch.object(queuehandler, "handleError") as mock_handle_error:
+            logger.error("%s %s", "a")
+            self.assertEqual(mock_handle_error.call_count, 1)
+        queuehandler.stop()
+        self.assertEqual(len(target.buffer), 0)
+
+    def test_queue_handler_does_not_block_on_stalled_target_and_counts_drops(self):
+        release = threading.Event()
+        target, _ = self.make_buffer_handler()
+        handle = target.handle
+        target.handle = lambda record: release.wait(5) and handle(record)
+
+        queuehandler, logger = self.make_queue_handler(target, maxsize=2)
+        start = time.time()
+        for i in range(10):
+            logger.info("message %d", i)
+        self.assertLess(time.time() - start, 1)
+        self.assertGreaterEqual(queuehandler.dropped, 7)
+
+        release.set()
+        queuehandler.stop()
+        self.assertIn("Dropped", target.formatBuffer()[-1])
+        self.assertEqual(queuehandler.dropped, 0)
+
+    def test_attach_syslog_handler_queues_records_if_requested(self):
+        logger = mock.Mock()
+
+        with mock.patch("logging.handlers.SysLogHandler") as mock_handler:
+            mock_handler_instance = mock_handler.return_value = mock.Mock(level=logging.INFO)
+            queuehandler = hypernode.log.attachSyslogHandler(logger, queued=True)
+            self.addCleanup(queuehandler.stop, 1)
+
+            self.assertIsInstance(queuehandler, hypernode.log.QueueHandler)
+            self.assertIs(queuehandler.target, mock_handler_instance)
+            self.assertEqual(queuehandler.level, logging.INFO)
+            logger.addHandler.assert_called_once_with(queuehandler)
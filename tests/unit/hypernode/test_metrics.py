@@ -0,0 +1,70 @@
+import os
+import json
+import shutil
+import tempfile
+
+import mock
+import tests.unit
+import hypernode.metrics as metrics
+
+
+class TestMetrics(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_record_stores_measurement_with_tags(self):
+        metrics.record("my.metric", 1.5, host="henk")
+        self.assertEqual(metrics.get(), [("my.metric", 1.5, {"host": "henk"})])
+
+    def test_get_filters_by_name(self):
+        metrics.record("a", 1)
+        metrics.record("b", 2)
+        self.assertEqual(metrics.get("b"), [("b", 2, {})])
+
+    def test_reset_removes_all_measurements(self):
+        metrics.record("a", 1)
+        metrics.reset()
+        self.assertEqual(metrics.get(), [])
+
+    def test_get_keeps_only_recent_measurements(self):
+        for i in range(metrics.RECENT_KEPT + 10):
+            metrics.record("a", i)
+        measurements = metrics.get("a")
+        self.assertEqual(len(measurements), metrics.RECENT_KEPT)
+        self.assertEqual(measurements[-1], ("a", metrics.RECENT_KEPT + 9, {}))
+
+    def test_summaries_aggregate_per_name_and_tags(self):
+        for value in (3, 1, 2):
+            metrics.record("a", value, host="henk")
+        metrics.record("a", 10, host="ingrid")
+        metrics.record("b", 5)
+
+        self.assertEqual(metrics.summaries("a"), [
+            {"name": "a", "tags": {"host": "henk"}, "count": 3, "sum": 6, "min": 1, "max": 3, "last": 2},
+            {"name": "a", "tags": {"host": "ingrid"}, "count": 1, "sum": 10, "min": 10, "max": 10, "last": 10},
+        ])
+
+    def test_summaries_are_bounded(self):
+        self.setUpPatch('hypernode.metrics.MAX_SERIES', 2)
+        for i in range(5):
+            metrics.record("a", 1, attempt=i)
+        metrics.record("a", 1, attempt=0)
+        self.assertEqual([summary["count"] for summary in metrics.summaries()], [2, 1])
+
+    def test_flush_writes_summaries_as_json(self):
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirname)
+        metrics.record("a", 1.5, host="henk")
+
+        metrics.flush("test", os.path.join(dirname, "metrics"))
+
+        with open(os.path.join(dirname, "metrics", "test.json")) as fd:
+            data = json.load(fd)
+        self.assertEqual(data["metrics"], metrics.summaries())
+        self.assertEqual(os.listdir(os.path.join(dirname, "metrics")), ["test.json"])
+
+    def test_flush_does_not_raise_if_it_can_not_write(self):
+        self.setUpPatch('os.makedirs', mock.Mock(side_effect=OSError(13, "Permission denied")))
+        metrics.flush("test", "/non-exist/metrics")
@@ -0,0 +1,61 @@
+import threading
+import mock
+import tests.unit
+
+from hypernode import metrics, timing
+
+
+class TestTiming(tests.unit.BaseTestCase):
+
+    def setUp(self):
+        self.mock_call = self.setUpPatch('subprocess.call', mock.Mock(return_value=0))
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_timer_measures_wall_and_cpu_time(self):
+        with timing.Timer("part") as timer:
+            sum(range(100000))
+
+        self.assertGreater(timer.wall, 0)
+        self.assertGreaterEqual(timer.cpu, 0)
+        self.assertEqual(timer.children, 0)
+        self.assertEqual(metrics.get("timing.seconds")[0][2], {"timer": "part"})
+
+    def test_current_returns_innermost_timer_of_this_thread(self):
+        self.assertIsNone(timing.current())
+        with timing.Timer("outer") as outer:
+            with timing.Timer("inner") as inner:
+                self.assertIs(timing.current(), inner)
+
+                other = []
+                thread = threading.Thread(target=lambda: other.append(timing.current()))
+                thread.start()
+                thread.join()
+                self.assertEqual(other, [None])
+            self.assertIs(timing.current(), outer)
+        self.assertIsNone(timing.current())
+
+    def test_call_adds_command_to_current_timer(self):
+        with timing.Timer("part") as timer:
+            self.assertEqual(timing.call(["hostname", "app"]), 0)
+
+        self.mock_call.assert_called_once_with(["hostname", "app"])
+        self.assertEqual(timer.calls[0]["command"], "hostname app")
+        self.assertEqual(timer.calls[0]["returncode"], 0)
+        self.assertEqual(metrics.get("subprocess.seconds")[0][2], {"command": "hostname"})
+
+    def test_call_adds_command_to_given_timer(self):
+        timer = timing.Timer("services")
+        timing.call(["service", "nginx", "reload"], timer=timer)
+        self.assertEqual(len(timer.calls), 1)
+
+    def test_call_without_timer_only_calls_command(self):
+        self.assertEqual(timing.call(["true"]), 0)
+
+    def test_timer_as_dict_includes_calls(self):
+        with timing.Timer("part") as timer:
+            timing.call(["true"])
+
+        result = timer.as_dict()
+        self.assertEqual(sorted(result.keys()), ["calls", "children", "cpu", "name", "wall"])
+        self.assertEqual(result["calls"][0]["command"], "true")